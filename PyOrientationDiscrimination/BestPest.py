@@ -1,147 +1,670 @@
-
-import numpy
-
-class BestPest():
-	"""
-		An implementation fo the Best Pest algorithm for psychometric parameter estimation using maximum liklehood
-		
-		See: Pentland, A. (1980). Maximum likelihood estimation: The best PEST. Attention, Perception, & Psychophysics, 28(4), 377-379.
-		See: Lieberman, H. R., & Pentland, A. P. (1982). Microcomputer-based estimation of psychophysical thresholds: the best PEST. Behavior Research Methods & Instrumentation, 14(1), 21-25.
-	"""
-	def __init__(self, stimulusLevels):
-		"""
-			Initializes parameters for a 2AFC Best Pest algorithm
-
-			Args:
-				stimulusRange (list): list of stimulus levels
-		"""
-		# range of possible stimulus values (i.e., number of possible independent variable testing values)
-		self.stimulusLevels = stimulusLevels
-		self.range = len(stimulusLevels)
-
-		# cumulative probabiltiy that threshold is at each possible stim level
-		self.prob = [0] * (self.range)
-
-		# (logarithms of) the psychometric function
-		self.plgit = [0] * (self.range * 2) # probability of a positive response
-		self.mlgit = [0] * (self.range * 2) # probability of a negative response
-
-		# STD sets the slope of the psychometric function
-		self.std = self.range / 5
-
-		# initialize probability arrays
-		for i in range(2*self.range):
-			lgit = .5 + .5/(1+numpy.exp(((self.range-(i+1))/self.std)))
-
-			self.plgit[i] = numpy.log(lgit)
-			self.mlgit[i] = numpy.log(1-lgit)
-
-		self.currentStimIndex = int(self.range / 2)
-		self.currentStimLevel = self.stimulusLevels[self.currentStimIndex]
-		
-	def getNormalizedProbabilities(self):
-		"""
-			Returns a normalized list of probabilities
-
-			Returns:
-				numpy.array: the list of probabilities for each level of the stimulus
-		"""
-		# make a copy
-		probs = numpy.asarray(self.prob)
-		# probabilities in this class are stored as log probabilities
-		probs = numpy.exp(probs)
-		# normalize
-		probs /= sum(probs)
-
-		return probs
-
-	def getExtentIndexRange(self, extent=2, index=None):
-		"""
-			Calculates the index ranges for a given extent, clamped at 0 and len(stimValues)
-
-			Args:
-				extent (int): The number of stimulus values to include below and above the current estimated threshold
-		"""
-
-		if index is None:
-			index = self.currentStimIndex
-
-		start = int(max(0, index - extent))
-		end = int(min(self.range-1, index + extent + 1))
-
-		return start, end
-
-	def getConfidence(self, extent=2):
-		"""
-			Retrieves the confidence interval for a range 
-
-			Args:
-				extent (int): The number of stimulus values to include below and above the current estimated threshold
-					A value of 2 will be the sum of 5 probabilities (2 below the estimate, the estimate, and 2 above the estimate)
-
-			Returns:
-				float: A value between 0 and 1 indicating the confidence level
-		"""
-
-		# normalize probabilities
-		probs = self.getNormalizedProbabilities()
-
-		# calculate extents
-		start, end = self.getExtentIndexRange(extent)
-
-		# find sum for that interval
-		return sum(probs[start:end])
-
-	def markResponse(self, response, stimValue=None, stimIndex=None):
-		"""
-			Logs the response to a stimulus and returns the next stimulus level to test
-
-			Args:
-				response (bool): True for a positive response, False for a negative one
-				stimValue (float): Optional varaible for indicating the stimulus value corresponding to the response
-				stimIndex (int): Optional variable for indicating the stimulus index correspodning to the response
-
-				If stimValue and stimIndex are ommitted, function defaults to current stimulus level/index
-
-			Returns:
-				int: The next level of the stimulus to be tested
-		"""
-
-		# Allow calling function to override a specific stimulus value or index
-		if stimIndex is None:
-			if stimValue is None:
-				stimIndex = self.currentStimIndex
-			else:
-				for i,v in enumerate(self.stimulusLevels):
-					if v == stimValue:
-						stimIndex = i
-						break
-
-		# The highest probability *might* be a range, so keep track of the indexes of the endpoints of that range
-		p1 = None
-		p2 = None
-
-		# Update probability array and find the highest probability
-		for i in range(self.range):
-			if response:
-				self.prob[i] += self.plgit[self.range + (stimIndex-1) - i]
-			else:
-				self.prob[i] += self.mlgit[self.range + (stimIndex-1) - i]
-			
-			if p1 is None or self.prob[i] > self.prob[p1]:
-				p1 = i
-				p2 = i
-			elif self.prob[i] == self.prob[p1]:
-				p2 = i
-
-		# Set the next stimulus level to be the one w/ the highest probability
-		self.currentStimIndex = int((p1+p2) / 2)
-		self.currentStimLevel = self.stimulusLevels[self.currentStimIndex]
-
-		return self.currentStimLevel
-
-	def getBestPest(self):
-		return self.currentStimLevel
-
-	def next(self):
-		return self.currentStimLevel
+
+import numpy
+
+# below about 1000 levels a full BestPest update is as fast or faster, so the adaptive grid is only used from here on
+ADAPTIVE_MIN_LEVELS = 2000
+
+def getLogPsychometricFunctions(numLevels):
+	"""
+		Builds the (logarithms of the) psychometric function used by BestPest
+
+		Args:
+			numLevels (int): number of stimulus levels
+
+		Returns:
+			tuple: (plgit, mlgit) arrays of length 2*numLevels with the log probability of a positive and negative response
+	"""
+	# STD sets the slope of the psychometric function
+	std = numLevels / 5
+
+	lgit = .5 + .5/(1+numpy.exp((numLevels-(numpy.arange(2*numLevels)+1))/std))
+
+	return numpy.log(lgit), numpy.log(1-lgit)
+
+def getBestIndices(logProbs):
+	"""
+		Finds the stimulus index BestPest would pick for each posterior, i.e. the middle of the range of maximum probability
+
+		Args:
+			logProbs (numpy.array): log probabilities, stimulus levels along the last axis
+
+		Returns:
+			numpy.array: indexes with the shape of logProbs minus its last axis
+	"""
+	numLevels = logProbs.shape[-1]
+	first = numpy.argmax(logProbs, axis=-1)
+	last = numLevels - 1 - numpy.argmax(logProbs[..., ::-1], axis=-1)
+
+	return (first + last) // 2
+
+def getResponseLogLikelihoods(numLevels, stimIndices, responses):
+	"""
+		Calculates the log likelihood each response adds to the posterior
+
+		Args:
+			numLevels (int): number of stimulus levels
+			stimIndices (numpy.array): (batch, trials) stimulus index of each response
+			responses (numpy.array): (batch, trials) bool responses. Pad short batches with stimIndex -1, which contributes nothing.
+
+		Returns:
+			numpy.array: (batch, trials, numLevels) log likelihoods
+	"""
+	plgit, mlgit = getLogPsychometricFunctions(numLevels)
+	stimIndices = numpy.asarray(stimIndices)
+
+	# same indexing as BestPest.markResponse: prob[i] += lgit[range + (stimIndex-1) - i]
+	lookup = numLevels + (stimIndices[..., None] - 1) - numpy.arange(numLevels)
+	valid = (stimIndices >= 0)[..., None]
+	lookup = numpy.where(valid, lookup, 0)
+
+	updates = numpy.where(numpy.asarray(responses)[..., None], plgit[lookup], mlgit[lookup])
+
+	return numpy.where(valid, updates, 0)
+
+def replayResponses(numLevels, stimIndices, responses):
+	"""
+		Replays batches of responses through the Best PEST posterior in one pass
+
+		Args:
+			numLevels (int): number of stimulus levels
+			stimIndices (numpy.array): (batch, trials) stimulus index of each response, -1 for padding
+			responses (numpy.array): (batch, trials) bool responses
+
+		Returns:
+			numpy.array: (batch, trials, numLevels) log probabilities after each trial
+	"""
+	return numpy.cumsum(getResponseLogLikelihoods(numLevels, stimIndices, responses), axis=-2)
+
+def bootstrapIntervals(stimulusLevels, stimIndices, responses, resamples=2000, confidence=.95, randomState=None, maxElements=1<<22):
+	"""
+		Estimates threshold confidence intervals by resampling each batch's trials with replacement
+
+		The final posterior is a sum over trials, so every resample of a batch is evaluated at once
+		as (resample counts) x (per-trial log likelihoods).
+
+		Args:
+			stimulusLevels (list): list of stimulus levels
+			stimIndices (numpy.array): (batch, trials) stimulus index of each response, -1 for padding
+			responses (numpy.array): (batch, trials) bool responses
+			resamples (int): number of bootstrap resamples per batch
+			confidence (float): width of the interval
+			randomState (numpy.random.RandomState): source of randomness
+			maxElements (int): batches are processed in groups whose posteriors hold at most this many values
+
+		Returns:
+			numpy.array: (batch, 2) lower and upper threshold bounds, both stimulus levels (nan for batches without trials)
+	"""
+	if randomState is None:
+		randomState = numpy.random.RandomState()
+
+	stimulusLevels = numpy.asarray(stimulusLevels)
+	stimIndices = numpy.atleast_2d(stimIndices)
+	responses = numpy.atleast_2d(responses)
+	batches, trials = stimIndices.shape
+	trialCounts = (stimIndices >= 0).sum(axis=1)
+	logLikelihoods = getResponseLogLikelihoods(len(stimulusLevels), stimIndices, responses)
+
+	tail = 100 * (1 - confidence) / 2
+	intervals = numpy.full((batches, 2), numpy.nan)
+
+	groupSize = max(1, maxElements // (resamples * max(len(stimulusLevels), trials)))
+	for start in range(0, batches, groupSize):
+		group = slice(start, start + groupSize)
+		counts = trialCounts[group]
+		size = len(counts)
+
+		# draw trial numbers uniformly within each batch's own trial count, then tally how often each was drawn
+		draws = (randomState.random_sample((size, resamples, trials)) * counts[:, None, None]).astype(int)
+		drawn = numpy.broadcast_to(numpy.arange(trials) < counts[:, None, None], draws.shape)
+		resampleOffsets = numpy.arange(size * resamples).reshape(size, resamples, 1) * trials
+		resampleCounts = numpy.bincount((resampleOffsets + draws)[drawn], minlength=size*resamples*trials)
+		resampleCounts = resampleCounts.reshape(size, resamples, trials).astype(float)
+
+		posteriors = numpy.matmul(resampleCounts, logLikelihoods[group])
+		thresholds = stimulusLevels[getBestIndices(posteriors)]
+		# thresholds are always stimulus levels, so the bounds are rounded outwards to levels too
+		intervals[group, 0] = numpy.percentile(thresholds, tail, axis=1, method='lower')
+		intervals[group, 1] = numpy.percentile(thresholds, 100 - tail, axis=1, method='higher')
+
+	intervals[trialCounts == 0] = numpy.nan
+
+	return intervals
+
+def getConfidences(logProbs, indices, extent=2):
+	"""
+		Vectorized BestPest.getConfidence for many posteriors at once
+
+		Args:
+			logProbs (numpy.array): log probabilities, stimulus levels along the last axis
+			indices (numpy.array): the estimate around which to sum, shaped like logProbs minus its last axis
+			extent (int): number of stimulus values to include below and above the estimate
+
+		Returns:
+			numpy.array: probability mass within the extent of each estimate
+	"""
+	numLevels = logProbs.shape[-1]
+	probs = numpy.exp(logProbs - logProbs.max(axis=-1, keepdims=True))
+	cdf = numpy.cumsum(probs, axis=-1)
+	cdf = numpy.concatenate([numpy.zeros(cdf.shape[:-1] + (1,)), cdf], axis=-1)
+
+	start = numpy.maximum(0, indices - extent)
+	end = numpy.minimum(numLevels-1, indices + extent + 1)
+
+	mass = numpy.take_along_axis(cdf, end[..., None], -1) - numpy.take_along_axis(cdf, start[..., None], -1)
+	return mass[..., 0] / cdf[..., -1]
+
+class BestPest():
+	"""
+		An implementation fo the Best Pest algorithm for psychometric parameter estimation using maximum liklehood
+		
+		See: Pentland, A. (1980). Maximum likelihood estimation: The best PEST. Attention, Perception, & Psychophysics, 28(4), 377-379.
+		See: Lieberman, H. R., & Pentland, A. P. (1982). Microcomputer-based estimation of psychophysical thresholds: the best PEST. Behavior Research Methods & Instrumentation, 14(1), 21-25.
+	"""
+	def __init__(self, stimulusLevels):
+		"""
+			Initializes parameters for a 2AFC Best Pest algorithm
+
+			Args:
+				stimulusRange (list): list of stimulus levels
+		"""
+		# range of possible stimulus values (i.e., number of possible independent variable testing values)
+		self.stimulusLevels = stimulusLevels
+		self.range = len(stimulusLevels)
+
+		# cumulative probabiltiy that threshold is at each possible stim level
+		self.prob = [0] * (self.range)
+
+		# STD sets the slope of the psychometric function
+		self.std = self.range / 5
+
+		# (logarithms of) the psychometric function
+		plgit, mlgit = getLogPsychometricFunctions(self.range)
+		self.plgit = plgit.tolist() # probability of a positive response
+		self.mlgit = mlgit.tolist() # probability of a negative response
+
+		self.currentStimIndex = int(self.range / 2)
+		self.currentStimLevel = self.stimulusLevels[self.currentStimIndex]
+
+		# (stimIndex, response) pairs, in the order they were marked
+		self.responses = []
+
+		# outcomes of both responses to the current stimulus, see prepareResponses
+		self.prepared = None
+
+		# normalized posterior index, rebuilt on demand after markResponse
+		self.probs = None
+		self.cdf = None
+		self.mean = None
+		self.hdiCache = {}
+		
+	def refreshIndex(self):
+		"""
+			Rebuilds the normalized probabilities and their prefix sums if a response has been marked since the last query
+		"""
+		if self.cdf is not None:
+			return
+
+		# probabilities in this class are stored as log probabilities
+		logProbs = numpy.asarray(self.prob)
+		probs = numpy.exp(logProbs - logProbs.max())
+		probs /= probs.sum()
+
+		# cdf[i] is the mass of every level below index i, so the mass of [start, end) is cdf[end] - cdf[start]
+		self.cdf = numpy.concatenate([[0], numpy.cumsum(probs)])
+		self.probs = probs
+		self.mean = float(numpy.dot(probs, self.stimulusLevels))
+		self.hdiCache = {}
+
+	def getNormalizedProbabilities(self):
+		"""
+			Returns a normalized list of probabilities
+
+			Returns:
+				numpy.array: the list of probabilities for each level of the stimulus
+		"""
+		self.refreshIndex()
+
+		# make a copy
+		return self.probs.copy()
+
+	def getMass(self, start, end):
+		"""
+			Probability that the threshold lies at a stimulus index in [start, end)
+		"""
+		self.refreshIndex()
+
+		return self.cdf[end] - self.cdf[start]
+
+	def getQuantile(self, quantile):
+		"""
+			Returns:
+				float: the lowest stimulus level at which the cumulative probability reaches quantile
+		"""
+		self.refreshIndex()
+
+		index = numpy.searchsorted(self.cdf, quantile, side='left') - 1
+		return self.stimulusLevels[min(max(index, 0), self.range-1)]
+
+	def getMedian(self):
+		return self.getQuantile(.5)
+
+	def getPosteriorMean(self):
+		self.refreshIndex()
+
+		return self.mean
+
+	def getCredibleInterval(self, mass=.95):
+		"""
+			Returns:
+				tuple: (lower, upper) stimulus levels of the equal-tailed interval holding at least mass
+		"""
+		tail = (1 - mass) / 2
+		return self.getQuantile(tail), self.getQuantile(1 - tail)
+
+	def getHighestDensityInterval(self, mass=.95):
+		"""
+			Finds the narrowest run of stimulus levels holding at least mass. The posterior is unimodal, so
+			this is the highest density interval.
+
+			Returns:
+				tuple: (lower, upper) stimulus levels
+		"""
+		self.refreshIndex()
+
+		if mass not in self.hdiCache:
+			# for every start, the first (exclusive) end whose interval reaches the mass
+			targets = self.cdf[:-1] + mass - 1e-12
+			ends = numpy.searchsorted(self.cdf, targets, side='left')
+			widths = numpy.where(targets <= self.cdf[-1], ends - numpy.arange(self.range), self.range + 1)
+			start = int(numpy.argmin(widths))
+			self.hdiCache[mass] = (self.stimulusLevels[start], self.stimulusLevels[ends[start] - 1])
+
+		return self.hdiCache[mass]
+
+	def getExtentIndexRange(self, extent=2, index=None):
+		"""
+			Calculates the index ranges for a given extent, clamped at 0 and len(stimValues)
+
+			Args:
+				extent (int): The number of stimulus values to include below and above the current estimated threshold
+		"""
+
+		if index is None:
+			index = self.currentStimIndex
+
+		start = int(max(0, index - extent))
+		end = int(min(self.range-1, index + extent + 1))
+
+		return start, end
+
+	def getConfidence(self, extent=2):
+		"""
+			Retrieves the confidence interval for a range 
+
+			Args:
+				extent (int): The number of stimulus values to include below and above the current estimated threshold
+					A value of 2 will be the sum of 5 probabilities (2 below the estimate, the estimate, and 2 above the estimate)
+
+			Returns:
+				float: A value between 0 and 1 indicating the confidence level
+		"""
+
+		# calculate extents
+		start, end = self.getExtentIndexRange(extent)
+
+		# find sum for that interval
+		return self.getMass(start, end)
+
+	def getStimIndex(self, stimValue):
+		for i,v in enumerate(self.stimulusLevels):
+			if v == stimValue:
+				return i
+
+	def getUpdate(self, response, stimIndex):
+		"""
+			Computes the posterior after a response, without applying it
+
+			Returns:
+				tuple: (prob, next stimulus index) for applyUpdate
+		"""
+		prob = list(self.prob)
+
+		# The highest probability *might* be a range, so keep track of the indexes of the endpoints of that range
+		p1 = None
+		p2 = None
+
+		# Update probability array and find the highest probability
+		for i in range(self.range):
+			if response:
+				prob[i] += self.plgit[self.range + (stimIndex-1) - i]
+			else:
+				prob[i] += self.mlgit[self.range + (stimIndex-1) - i]
+			
+			if p1 is None or prob[i] > prob[p1]:
+				p1 = i
+				p2 = i
+			elif prob[i] == prob[p1]:
+				p2 = i
+
+		# The next stimulus level is the one w/ the highest probability
+		return prob, int((p1+p2) / 2)
+
+	def applyUpdate(self, update):
+		self.prob, self.currentStimIndex = update
+		self.cdf = None
+
+	def prepareResponses(self):
+		"""
+			Computes the outcome of both possible responses to the current stimulus ahead of time (e.g. while
+			waiting for the response), so that markResponse only has to adopt one of them
+
+			Returns:
+				dict: the next stimulus level after a positive (True) and a negative (False) response
+		"""
+		self.prepared = {response: self.getUpdate(response, self.currentStimIndex) for response in (True, False)}
+
+		return {response: self.stimulusLevels[update[-1]] for response, update in self.prepared.items()}
+
+	def markResponse(self, response, stimValue=None, stimIndex=None):
+		"""
+			Logs the response to a stimulus and returns the next stimulus level to test
+
+			Args:
+				response (bool): True for a positive response, False for a negative one
+				stimValue (float): Optional varaible for indicating the stimulus value corresponding to the response
+				stimIndex (int): Optional variable for indicating the stimulus index correspodning to the response
+
+				If stimValue and stimIndex are ommitted, function defaults to current stimulus level/index
+
+			Returns:
+				int: The next level of the stimulus to be tested
+		"""
+
+		# Allow calling function to override a specific stimulus value or index
+		if stimIndex is None:
+			if stimValue is None:
+				stimIndex = self.currentStimIndex
+			else:
+				stimIndex = self.getStimIndex(stimValue)
+
+		if self.prepared is not None and stimIndex == self.currentStimIndex:
+			update = self.prepared[bool(response)]
+		else:
+			update = self.getUpdate(response, stimIndex)
+		self.prepared = None
+
+		self.responses.append((stimIndex, bool(response)))
+		self.applyUpdate(update)
+		self.currentStimLevel = self.stimulusLevels[self.currentStimIndex]
+
+		return self.currentStimLevel
+
+	def getBestPest(self):
+		return self.currentStimLevel
+
+	def next(self):
+		return self.currentStimLevel
+
+class AdaptiveBestPest(BestPest):
+	"""
+		Best PEST over the same stimulus levels, with the posterior kept on a coarse-to-fine grid of cells
+
+		Each cell covers a run of stimulus levels and holds the exact log probability of the level at its centre.
+		As evidence accumulates, cells where treating the posterior as flat would misplace more than tolerance of
+		its mass are split, and neighbouring cells where it would misplace far less are merged again, so each response
+		updates a few dozen cells rather than every stimulus level. Newly created cells are scored from the
+		response history. The most probable cell and its neighbours are always single levels, so the next
+		stimulus is the one BestPest would pick.
+
+		With tolerance=0 every level ends up in its own cell and the estimates match BestPest.
+	"""
+	def __init__(self, stimulusLevels, initialCells=32, tolerance=1e-3, merge=True, branching=4):
+		"""
+			Args:
+				stimulusLevels (list): list of (evenly spaced) stimulus levels
+				initialCells (int): number of cells to start with; merging never makes a cell wider than these
+				tolerance (float): cells are split when their mass times the change in density across them exceeds this
+				merge (bool): whether to merge cells again once the posterior has moved away from them
+				branching (int): number of cells a cell is split into
+		"""
+		self.stimulusLevels = numpy.asarray(stimulusLevels)
+		self.range = len(stimulusLevels)
+
+		self.tolerance = tolerance
+		self.mergeCells = merge
+		self.branching = branching
+
+		# same psychometric function as BestPest, indexed by stimulus level
+		self.plgit, self.mlgit = getLogPsychometricFunctions(self.range)
+
+		# cell k covers stimulus indices [edges[k], edges[k+1])
+		self.maxWidth = max(1, -(-self.range // initialCells))
+		edges = numpy.append(numpy.arange(0, self.range, self.maxWidth), self.range)
+		self.setCells(edges, numpy.zeros(len(edges) - 1))
+
+		self.currentStimIndex = int(self.range / 2)
+		self.currentStimLevel = self.stimulusLevels[self.currentStimIndex]
+
+		# (stimIndex, response) pairs, in the order they were marked
+		self.responses = []
+
+		# outcomes of both responses to the current stimulus, see prepareResponses
+		self.prepared = None
+
+		# normalized posterior index, rebuilt on demand after markResponse
+		self.cellCdf = None
+		self.density = None
+		self.probs = None
+		self.cdf = None
+		self.mean = None
+		self.hdiCache = {}
+
+	def setCells(self, edges, logProbs):
+		self.edges = edges
+		self.widths = numpy.diff(edges)
+		self.centers = (edges[:-1] + edges[1:] - 1) // 2
+		self.logProbs = logProbs
+
+	def getLogLikelihoods(self, stimIndices):
+		"""
+			Log probability of every marked response if the threshold were at each of stimIndices
+		"""
+		if not self.responses:
+			return numpy.zeros(len(stimIndices))
+
+		marked, responses = numpy.array(self.responses).T
+		# same indexing as BestPest.markResponse, summed trial by trial in the same order
+		lookup = self.range + (marked[:, None] - 1) - stimIndices
+		updates = numpy.where(responses[:, None].astype(bool), self.plgit[lookup], self.mlgit[lookup])
+
+		return updates.sum(axis=0)
+
+	def getCellMasses(self):
+		masses = self.widths * numpy.exp(self.logProbs - self.logProbs.max())
+
+		return masses / masses.sum()
+
+	def getSlopes(self):
+		"""
+			Returns:
+				numpy.array: steeper of the slopes of the log posterior to each neighbouring cell, per stimulus level
+		"""
+		if len(self.logProbs) < 2:
+			return numpy.zeros(len(self.logProbs))
+
+		between = numpy.abs((self.logProbs[1:] - self.logProbs[:-1]) / (self.centers[1:] - self.centers[:-1]))
+		slopes = numpy.empty(len(self.logProbs))
+		slopes[:-1] = between
+		slopes[-1] = between[-1]
+		slopes[1:] = numpy.maximum(slopes[1:], between)
+
+		return slopes
+
+	def getErrors(self, masses, slopes, widths):
+		"""
+			Estimates the mass treating the posterior as flat within cells would misplace
+		"""
+		return masses * numpy.minimum(slopes * widths, 1)
+
+	def getSplitCells(self):
+		"""
+			Returns:
+				numpy.array: bool mask of the cells to split
+		"""
+		widths = self.widths
+		split = (widths > 1) & (self.getErrors(self.getCellMasses(), self.getSlopes(), widths) > self.tolerance)
+
+		best = numpy.argmax(self.logProbs)
+		neighbours = slice(max(0, best - 1), best + 2)
+		split[neighbours] |= widths[neighbours] > 1
+
+		return split
+
+	def refine(self):
+		"""
+			Splits cells until getSplitCells finds none left to split
+		"""
+		while True:
+			widths = self.widths
+			split = self.getSplitCells()
+			if not split.any():
+				return
+
+			# children of each split cell start at evenly spaced offsets within it
+			counts = numpy.where(split, numpy.minimum(self.branching, widths), 1)
+			parents = numpy.repeat(numpy.arange(len(counts)), counts)
+			children = numpy.arange(len(parents)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+			edges = numpy.append(self.edges[parents] + children * widths[parents] // counts[parents], self.range)
+
+			logProbs = self.logProbs[parents]
+			self.setCells(edges, logProbs)
+
+			created = split[parents]
+			logProbs[created] = self.getLogLikelihoods(self.centers[created])
+
+	def merge(self):
+		"""
+			Merges pairs of neighbouring cells whose union would misplace well under tolerance of the posterior,
+			away from the most probable cell. Pairs start at even cells after even trials and odd cells after odd ones.
+		"""
+		if not self.mergeCells or len(self.logProbs) < 2:
+			return
+
+		widths = self.widths
+		masses = self.getCellMasses()
+		slopes = self.getSlopes()
+		pairs = numpy.arange(len(self.responses) % 2, len(widths) - 1, 2)
+
+		# a quarter of the tolerance, so merged cells aren't split again straight away
+		errors = self.getErrors(masses[pairs] + masses[pairs+1], numpy.maximum(slopes[pairs], slopes[pairs+1]), widths[pairs] + widths[pairs+1])
+		best = numpy.argmax(self.logProbs)
+		merged = pairs[(errors < self.tolerance / 4) & (widths[pairs] + widths[pairs+1] <= self.maxWidth) & (numpy.abs(pairs - best) > 2)]
+		if len(merged) == 0:
+			return
+
+		keep = numpy.ones(len(self.edges), dtype=bool)
+		keep[merged + 1] = False
+		self.setCells(self.edges[keep], numpy.delete(self.logProbs, merged + 1))
+
+		merged -= numpy.arange(len(merged))
+		self.logProbs[merged] = self.getLogLikelihoods(self.centers[merged])
+
+	def refreshIndex(self):
+		"""
+			Rebuilds the per-cell masses and their prefix sums if a response has been marked since the last query.
+			Within a cell the posterior is taken to be flat.
+		"""
+		if self.cellCdf is not None:
+			return
+
+		masses = self.getCellMasses()
+
+		self.cellCdf = numpy.concatenate([[0], numpy.cumsum(masses)])
+		self.density = masses / self.widths
+		# mean level of a cell is the mean of its first and last level, as they're evenly spaced
+		self.mean = float(numpy.dot(masses, (self.stimulusLevels[self.edges[:-1]] + self.stimulusLevels[self.edges[1:] - 1]) / 2))
+		self.probs = None
+		self.cdf = None
+		self.hdiCache = {}
+
+	def getCdf(self, stimIndices):
+		"""
+			Probability that the threshold lies below each of stimIndices
+		"""
+		self.refreshIndex()
+
+		cells = numpy.clip(numpy.searchsorted(self.edges, stimIndices, side='right') - 1, 0, len(self.density) - 1)
+		return self.cellCdf[cells] + (stimIndices - self.edges[cells]) * self.density[cells]
+
+	def refreshFineIndex(self):
+		"""
+			Expands the cells onto every stimulus level, for queries that need the whole posterior
+		"""
+		self.refreshIndex()
+
+		if self.cdf is None:
+			self.cdf = self.getCdf(numpy.arange(self.range + 1))
+			self.probs = numpy.diff(self.cdf)
+
+	def getNormalizedProbabilities(self):
+		self.refreshFineIndex()
+
+		# make a copy
+		return self.probs.copy()
+
+	def getMass(self, start, end):
+		"""
+			Probability that the threshold lies at a stimulus index in [start, end)
+		"""
+		return float(numpy.diff(self.getCdf(numpy.array([start, end])))[0])
+
+	def getQuantile(self, quantile):
+		"""
+			Returns:
+				float: the lowest stimulus level at which the cumulative probability reaches quantile
+		"""
+		self.refreshIndex()
+
+		cell = min(max(numpy.searchsorted(self.cellCdf, quantile, side='left') - 1, 0), len(self.density) - 1)
+		offset = int(numpy.ceil((quantile - self.cellCdf[cell]) / self.density[cell])) - 1
+		index = self.edges[cell] + min(max(offset, 0), self.widths[cell] - 1)
+
+		return self.stimulusLevels[index]
+
+	def getHighestDensityInterval(self, mass=.95):
+		self.refreshFineIndex()
+
+		return super().getHighestDensityInterval(mass)
+
+	def getStimIndex(self, stimValue):
+		return int(numpy.argmin(numpy.abs(self.stimulusLevels - stimValue)))
+
+	def getUpdate(self, response, stimIndex):
+		"""
+			Computes the cells after a response, without applying them
+
+			Returns:
+				tuple: (edges, logProbs, next stimulus index) for applyUpdate
+		"""
+		cells = (self.edges, self.logProbs)
+
+		# refine and merge score new cells from the response history, so the response is added for the duration
+		self.responses.append((stimIndex, bool(response)))
+		try:
+			lookup = self.range + (stimIndex-1) - self.centers
+			self.setCells(self.edges, self.logProbs + (self.plgit[lookup] if response else self.mlgit[lookup]))
+
+			self.refine()
+			self.merge()
+
+			# as in BestPest, the middle of the range of maximum probability
+			best = numpy.flatnonzero(self.logProbs == self.logProbs.max())
+			return self.edges, self.logProbs, int((self.centers[best[0]] + self.centers[best[-1]]) // 2)
+		finally:
+			self.responses.pop()
+			self.setCells(*cells)
+
+	def applyUpdate(self, update):
+		edges, logProbs, self.currentStimIndex = update
+		self.setCells(edges, logProbs)
+		self.cellCdf = None
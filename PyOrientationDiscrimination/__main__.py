@@ -1,790 +1,1140 @@
-import sys, os, platform
-import traceback
-import argparse
-import time, random
-import logging
-from pathlib import Path
-
-from functools import partial
-from collections import OrderedDict
-
-import BestPest, settings, assets
-from MonitorShutter import ShutterController
-import monitorTools
-
-import psychopy
-
-psychopy.prefs.general['audioLib'] = ['pyo','pygame', 'sounddevice']
-
-from psychopy import core, visual, gui, data, event, monitors, sound, tools
-import numpy
-
-import math
-
-class Trial():
-	def __init__(self, eccentricity, orientation, stimPositionAngles):
-		self.eccentricity = eccentricity
-		self.orientation = orientation
-		self.stimPositionAngles = list(stimPositionAngles)
-
-	def __str__(self):
-		return self.__repr__()
-
-	def __repr__(self):
-		return f'Trial(e={self.eccentricity},o={self.orientation},a={self.stimPositionAngles})'
-
-class UserExit(Exception):
-	def __init__(self):
-		super().__init__('User asked to quit.')
-
-def getSound(filename, freq, duration):
-	try:
-		filename = os.path.join('assets', 'PyOrientationDiscrimination', filename)
-		filename = assets.getFilePath(filename)
-		return sound.Sound(filename)
-	except ValueError:
-		logging.warning(f'Failed to load sound file: {filename}. Synthesizing sound instead.')
-		return sound.Sound(freq, secs=duration)
-
-def getConfig():
-	config = settings.getSettings()
-	config['General settings']['start_time'] = data.getDateStr()
-	logFile = os.path.join(
-		Path(config['General settings']['data_path']),
-		config['General settings']['data_filename'].format(**config['General settings']) + '.log'
-	)
-	logging.basicConfig(filename=logFile, level=logging.DEBUG, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-
-	# group = 'Stimuli settings'
-	# for k in ['eccentricities', 'orientations', 'stimulus_position_angles']:
-	# 	if isinstance(config[group][k], str):
-	# 		config[group][k] = [float(v) for v in config[group][k].split(' ')]
-	# 	else:
-	# 		config[group][k] = [float(config[group][k])]
-
-	config['sitmulusTone'] = getSound('600Hz_square_25.wav', 600, .185)
-	config['positiveFeedback'] = getSound('1000Hz_sine_50.wav', 1000, .077)
-	config['negativeFeedback'] = getSound('300Hz_sine_25.wav', 300, .2)
-	config['gazeTone'] = getSound('hurt.wav', 200, .2)
-
-	return config
-
-class OrientationDiscriminationTester():
-	def __init__(self, config):
-		self.config = config
-
-		sound.init()
-
-		self.setupMonitor()
-		self.setupHUD()
-		self.setupDataFile()
-
-		self.setupBlocks()
-
-	def setupMonitor(self):
-		physicalSize = monitorTools.getPhysicalSize()
-		resolution = monitorTools.getResolution()
-
-		self.mon = monitors.Monitor('testMonitor')
-		self.mon.setDistance(self.config['Display settings']['monitor_distance'])  # Measure first to ensure this is correct
-		self.mon.setWidth(physicalSize[0]/10)
-		self.mon.setSizePix(resolution)
-		self.mon.save()
-
-		self.win = visual.Window(size = resolution, fullscr=True, monitor='testMonitor', allowGUI=False, units='deg')
-		self.background = visual.Rect(self.win, size=[dim*2 for dim in resolution], units='pix', color=self.config['Display settings']['background_color'])
-		self.flipBuffer()
-
-		self.referenceCircles = [
-			visual.Circle(
-				self.win,
-				radius        = self.config['Stimuli settings']['stimulus_size'] * .5,
-				lineColor     = -1,
-				lineWidth     = 5,
-				name          = 'Circle surrounding patch'
-			),
-			visual.Circle(
-				self.win,
-				radius        = self.config['Stimuli settings']['stimulus_size'] * .6,
-				lineColor     = -1,
-				lineWidth     = 5,
-				name          = 'Circle surrounding patch'
-			),
-		]
-
-		self.stim = visual.GratingStim(self.win, contrast=self.config['Stimuli settings']['stimulus_contrast'], sf=self.config['Stimuli settings']['stimulus_frequency'], size=self.config['Stimuli settings']['stimulus_size'], mask='gauss')
-		fixationVertices = (
-			(0, -0.5), (0, 0.5),
-			(0, 0),
-			(-0.5, 0), (0.5, 0),
-		)
-		self.fixationStim = visual.ShapeStim(self.win, vertices=fixationVertices, lineColor=-1, closeShape=False, size=self.config['Display settings']['fixation_size']/60.0)
-		self.fixationAid = [
-			visual.Circle(self.win,
-				radius = self.config['Gaze tracking']['gaze_offset_max'] * .5,
-				lineColor = self.config['Display settings']['fixation_color'],
-				fillColor = None,
-			), visual.Circle(self.win,
-				radius = self.config['Gaze tracking']['gaze_offset_max'] * .05,
-				fillColor = self.config['Display settings']['fixation_color'],
-				lineColor = None,
-			)
-		]
-
-		if self.config['Display settings']['show_annuli']:
-			self.annuli = {}
-			for eccentricity in self.config['Stimuli settings']['eccentricities']:
-				self.annuli[eccentricity] = []
-
-				for angle in self.config['Stimuli settings']['stimulus_position_angles']:
-					pos = [
-						numpy.cos(angle * numpy.pi/180.0) * eccentricity,
-						numpy.sin(angle * numpy.pi/180.0) * eccentricity,
-					]
-					self.annuli[eccentricity].append(
-						visual.Circle(
-							self.win,
-							pos=pos,
-							radius = .5 * monitorTools.scaleSizeByEccentricity(self.config['Stimuli settings']['stimulus_size'], eccentricity),
-							lineColor = self.config['Display settings']['annuli_color'],
-							fillColor = None,
-							units = 'deg'
-						)
-					)
-
-		if self.config['Stimuli settings']['mask_time'] > 0:
-			self.masks = {}
-			size = self.config['Stimuli settings']['stimulus_size']
-			maskImagePath = assets.getFilePath(os.path.join('assets', 'PyOrientationDiscrimination', 'mask.png'))
-
-			for eccentricity in self.config['Stimuli settings']['eccentricities']:
-				self.masks[eccentricity] = []
-				for angle in self.config['Stimuli settings']['stimulus_position_angles']:
-					pos = [
-						numpy.cos(angle * numpy.pi/180.0) * eccentricity,
-						numpy.sin(angle * numpy.pi/180.0) * eccentricity,
-					]
-					self.masks[eccentricity].append(
-						visual.ImageStim(
-							self.win,
-							image=maskImagePath,
-							pos=pos,
-							size=monitorTools.scaleSizeByEccentricity(size, eccentricity),
-							mask='gauss',
-						)
-					)
-
-		if self.config['Gaze tracking']['wait_for_fixation'] or self.config['Gaze tracking']['render_at_gaze']:
-			self.screenMarkers = PyPupilGazeTracker.PsychoPyVisuals.ScreenMarkers(self.win)
-			self.gazeTracker = PyPupilGazeTracker.GazeTracker.GazeTracker(
-				smoother=PyPupilGazeTracker.smoothing.SimpleDecay(),
-				screenSize=resolution
-			)
-			self.gazeTracker.start(closeShutter=False)
-			self.gazeMarker = PyPupilGazeTracker.PsychoPyVisuals.FixationStim(self.win, size=self.config['Gaze tracking']['gaze_offset_max'], units='deg', autoDraw=False)
-		else:
-			self.gazeTracker = None
-
-		self.cobreCommander = ShutterController()
-
-		self.trial = None
-
-	def setTopLeftPos(self, stim, pos):
-		# convert pixels to degrees
-		stimDim = stim.boundingBox
-		screenDim = self.mon.getSizePix()
-		centerPos = [
-			pos[0] + (stimDim[0] - screenDim[0]) / 2,
-			(screenDim[1] - stimDim[1]) / 2 - pos[1],
-		]
-		stim.pos = centerPos
-
-	def updateHUD(self, item, text, color=None):
-		element, pos, labelText = self.hudElements[item]
-		element.text = text
-		self.setTopLeftPos(element, pos)
-		if color != None:
-			element.color = color
-
-	def setupHUD(self):
-		lineHeight = 40
-		xOffset = 225
-		yOffset = 10
-
-		self.hudElements = OrderedDict(
-			lastStim = [visual.TextStim(self.win, text=' '), [xOffset-150, 0 + yOffset], 'Last stim'],
-			lastResp = [visual.TextStim(self.win, text=' '), [xOffset + 40, 6*lineHeight + yOffset], None],
-			lastOk = [visual.TextStim(self.win, text=' '), [xOffset -10, 6*lineHeight + yOffset], 'Last resp'],
-			thisStim = [visual.TextStim(self.win, text=' '), [xOffset-150, 8*lineHeight + yOffset], 'This stim'],
-			expectedResp = [visual.TextStim(self.win, text=' '), [xOffset, 14*lineHeight + yOffset], 'Exp resp'],
-			progress = [visual.TextStim(self.win, text=' '), [xOffset-150, 20*lineHeight + yOffset], 'Progress'],
-		)
-
-		for key in list(self.hudElements):
-			stim, pos, labelText = self.hudElements[key]
-			if labelText is not None:
-				label = visual.TextStim(self.win, text=labelText+':')
-				pos = [30, pos[1]]
-				self.hudElements[key+'_label'] = [label, pos, None]
-
-		for key in list(self.hudElements):
-			stim, pos, labelText = self.hudElements[key]
-
-			stim.color = 1
-			stim.units = 'pix'
-			stim.height = lineHeight * .88
-			stim.wrapWidth = 9999
-			self.setTopLeftPos(stim, pos)
-
-	def enableHUD(self):
-		for key, hudArgs in self.hudElements.items():
-			stim, pos, labelText = hudArgs
-			stim.autoDraw = True
-
-		if self.config['Stimuli settings']['stereo_circles']:
-			for circle in self.referenceCircles:
-				circle.autoDraw = True
-
-	def disableHUD(self):
-		for key, hudArgs in self.hudElements.items():
-			stim, pos, labelText = hudArgs
-			stim.autoDraw = False
-
-		for circle in self.referenceCircles:
-			circle.autoDraw = False
-
-	def flipBuffer(self):
-		self.win.flip()
-		self.background.draw()
-
-	def setupDataFile(self):
-		self.dataFilename = os.path.join(
-			Path(self.config['General settings']['data_path']),
-			self.config['General settings']['data_filename'].format(**self.config['General settings']) + '.csv'
-		)
-		logging.info(f'Starting data file {self.dataFilename}')
-
-		if not os.path.exists(self.dataFilename):
-			dataFile = open(self.dataFilename, 'w')
-			dataFile.write('Eccentricity,Orientation,Threshold\n')
-			dataFile.close()
-
-	def writeOutput(self, eccentricity, orientation, threshold):
-		logging.debug(f'Saving record to {self.dataFilename}, e={eccentricity}, o={orientation}, t={threshold}')
-
-		dataFile = open(self.dataFilename, 'a')  # a simple text file with 'comma-separated-values'
-		dataFile.write(f'{eccentricity},{orientation},{threshold}\n')
-		dataFile.close()
-
-	def setupStepHandler(self):
-		stimSpace = numpy.arange(
-			self.config['Stimuli settings']['stimulus_angle_precision'], # minimum
-			self.config['Stimuli settings']['max_stimulus_angle'] + self.config['Stimuli settings']['stimulus_angle_precision'], # maximum + 1
-			self.config['Stimuli settings']['stimulus_angle_precision'] # precision
-		)
-		return BestPest.BestPest(stimSpace)
-
-	def doCalibration(self, withValidation=False):
-		self.cobreCommander.openShutter()
-		self.showMessage('Looks like you need to be re-calibrated!\nFollow the circle around the next screen.\nPress SPACE to begin.')
-
-		if not withValidation:
-			self.gazeTracker.doCalibration(shutterCloseAfterCalibration=True)
-		else:
-			self.win.winHandle.minimize()
-			self.win.winHandle.set_fullscreen(False) # disable fullscreen
-			self.win.flip()
-			os.system('"%s" -m PyPupilGazeTracker.AccuracyChecker' % sys.executable)
-			time.sleep(1)
-
-			# Attempt to bring the window back (doesn't appear to work)
-			self.win.winHandle.maximize()
-			self.win.winHandle.set_fullscreen(True)
-			self.win.winHandle.activate()
-			self.win.flip()
-
-			self.cobreCommander.activateLights()
-			self.cobreCommander.closeShutter()
-
-		time.sleep(1)
-
-	def showMessage(self, msg, exceptionOnEsc=True):
-		keepWaiting = True
-		firstRender = True
-
-		messageStim = visual.TextStim(self.win, text=msg, color=-1, wrapWidth=40)
-
-		while keepWaiting:
-			if self.config['Gaze tracking']['show_gaze'] and self.gazeTracker is not None:
-				pos = self.getGazePosition()
-				if pos is not None:
-					self.gazeMarker.pos = pos
-
-				self.gazeMarker.draw(drawText=False)
-
-			messageStim.draw()
-			self.flipBuffer()
-
-			if firstRender:
-				firstRender = False
-				time.sleep(0.25)
-				event.clearEvents()
-			else:
-				keys = event.getKeys()
-				keyPressed = len(keys) > 0
-				if keyPressed:
-					if 'c' in keys and self.gazeTracker is not None:
-						self.doCalibration(withValidation=True)
-
-					if 'g' in keys:
-						self.config['Gaze tracking']['show_gaze'] = not self.config['Gaze tracking']['show_gaze']
-
-					if 'm' in keys:
-						self.win.winHandle.minimize()
-
-					if 'space' in keys:
-						keepWaiting = False
-
-					if 'escape' in keys:
-						if exceptionOnEsc:
-							raise UserExit()
-						else:
-							keepWaiting = False
-
-	def showInstructions(self, firstTime=False):
-		leftKey = self.config['Input settings']['rotated_left_key_label']
-		rightKey = self.config['Input settings']['rotated_right_key_label']
-
-		instructions = 'For this test, you will be presented with two striped circles, one at a time and in different locations.\n\n'
-		instructions += 'The second striped circle is the same as the first except rotated slightly to the left or slightly to the right.\n\n'
-		instructions += 'Sometimes these striped circles will appear in the center of the screen, and sometimes around the center of the screen.\n\n'
-		instructions += 'If the second striped circle is rotated to the counter-clockwise, press [' + leftKey.upper() + '].\n'
-		instructions += 'If the second striped circle is rotated to the clockwise, press [' + rightKey.upper() + '].\n\n'
-		instructions += 'Throughout the test, keep your gaze fixated on the circled-dot at the center of the screen.\n\n'
-		instructions += 'If you are uncertain, make a guess.\n\n\nPress [SPACEBAR] to start.'
-
-		if not firstTime:
-			instructions = 'These instructions are the same as before.\n\n' + instructions
-
-		self.showMessage(instructions)
-		self.cobreCommander.closeShutter()
-
-	def takeABreak(self, waitForKey=True):
-		for circle in self.referenceCircles:
-			circle.autoDraw = False
-
-		self.showMessage('Good job - it\'s now time for a break!\n\nWhen you are ready to continue, press the [SPACEBAR].')
-
-	def checkResponse(self, whichDirection):
-		leftKey = self.config['Input settings']['rotated_left_key']
-		rightKey = self.config['Input settings']['rotated_right_key']
-
-		leftKeyLabel = self.config['Input settings']['rotated_left_key_label']
-		rightKeyLabel = self.config['Input settings']['rotated_right_key_label']
-
-		correct = None
-		while correct is None:
-			keys = event.waitKeys()
-			logging.debug(f'Keys detected: {keys}')
-			if leftKey in keys:
-				self.updateHUD('lastResp', leftKeyLabel)
-				logging.info(f'User selected left ({leftKey})')
-				correct = (whichDirection < 0)
-			if rightKey in keys:
-				self.updateHUD('lastResp', rightKeyLabel)
-				logging.info(f'User selected right ({rightKey})')
-				correct = (whichDirection > 0)
-			if 'q' in keys or 'escape' in keys:
-				raise UserExit()
-
-			event.clearEvents()
-
-		return correct
-
-	def getBlockAndNonBlock(self):
-		blockSeparatorKey = self.config['General settings']['separate_blocks_by'].lower()
-		if blockSeparatorKey == 'orientations':
-			nonBlockedKey = 'eccentricities'
-		else:
-			nonBlockedKey = 'orientations'
-
-		return blockSeparatorKey, nonBlockedKey
-
-	def blockVarsToEccentricityAndOrientation(self, blockVarName, blockVarValue, nonBlockVarValue):
-		if blockVarName == 'eccentricities':
-			return blockVarValue, nonBlockVarValue
-		else:
-			return nonBlockVarValue, blockVarValue
-
-	def setupBlocks(self):
-		'''
-			blocks = [
-				{'eccentricity': x, 'trials': [trial, trial, trial]},
-				{'eccentricity': y, 'trials': [trial, trial, trial]},
-				...
-			]
-		'''
-
-		angleConfigs = []
-		for angle1 in self.config['Stimuli settings']['stimulus_position_angles']:
-			for angle2 in self.config['Stimuli settings']['stimulus_position_angles']:
-				if angle1 != angle2:
-					angleConfigs.append([angle1, angle2])
-
-		self.blocks = []
-		self.stepHandlers = {}
-		for eccentricity in self.config['Stimuli settings']['eccentricities']:
-			self.stepHandlers[eccentricity] = {}
-			for orientation in self.config['Stimuli settings']['orientations']:
-				self.stepHandlers[eccentricity][orientation] = self.setupStepHandler()
-
-		blockSeparatorKey, nonBlockedKey = self.getBlockAndNonBlock()
-		for blockValue in self.config['Stimuli settings'][blockSeparatorKey]:
-			block = {
-				'blockBy': blockSeparatorKey,
-				'blockValue': blockValue,
-				'trials': [],
-			}
-
-			for nonBlockedValue in self.config['Stimuli settings'][nonBlockedKey]:
-				eccentricity, orientation = self.blockVarsToEccentricityAndOrientation(blockSeparatorKey, blockValue, nonBlockedValue)
-				possibleAngles = []
-
-				for configTrial in range(self.config['Stimuli settings']['trials_per_stimulus_config']):
-					if len(possibleAngles) == 0:
-						possibleAngles = list(angleConfigs)
-						random.shuffle(possibleAngles)
-
-					block['trials'].append(Trial(eccentricity, orientation, possibleAngles.pop()))
-
-			random.shuffle(block['trials'])
-			self.blocks.append(block)
-
-		random.shuffle(self.blocks)
-
-		if self.config['General settings']['practice']:
-			self.history = [0] * self.config['General settings']['practice_history']
-			combinedBlock = {
-				'blockBy': None,
-				'blockValue': None,
-				'trials': []
-			}
-
-			for block in self.blocks:
-				combinedBlock['trials'] += block['trials']
-
-			random.shuffle(combinedBlock['trials'])
-			self.blocks = [combinedBlock]
-
-		for block in self.blocks:
-			logging.debug('Block by {blockBy}:{blockValue}'.format(**block))
-			for trial in block['trials']:
-				logging.debug(f'\t{trial}')
-
-	def runBlocks(self):
-		blockSeparatorKey, nonBlockedKey = self.getBlockAndNonBlock()
-		practiceWentOk = False
-
-		for blockCounter, block in enumerate(self.blocks):
-			# Show instructions
-			self.showInstructions(blockCounter==0)
-			# Run each trial in this block
-			if self.config['Stimuli settings']['stereo_circles']:
-				for circle in self.referenceCircles:
-					circle.autoDraw = True
-
-
-			self.enableHUD()
-			for trialCounter, trial in enumerate(block['trials']):
-				self.flipBuffer()
-
-				time.sleep(self.config['Stimuli settings']['time_between_stimuli'] / 1000.0)     # pause between trials
-
-				self.updateHUD('progress', f'\nB({blockCounter+1}/{len(self.blocks)})\nT({trialCounter+1}/{len(block["trials"])})')
-				self.runTrial(trial, self.stepHandlers[trial.eccentricity][trial.orientation])
-
-				if self.config['General settings']['practice']:
-					if sum(self.history) >= self.config['General settings']['practice_streak']:
-						logging.info('Practice completed!')
-						practiceWentOk = True
-						break
-
-			self.disableHUD()
-
-			# Write output
-			if self.config['General settings']['practice']:
-				for eccentricity, eccDicts in self.stepHandlers.items():
-					for orientation, stepHandler in eccDicts.items():
-						result = self.stepHandlers[eccentricity][orientation].getBestPest()
-						self.writeOutput(eccentricity, orientation, result)
-			else:
-				for nonBlockedValue in self.config['Stimuli settings'][nonBlockedKey]:
-					eccentricity, orientation = self.blockVarsToEccentricityAndOrientation(blockSeparatorKey, block['blockValue'], nonBlockedValue)
-					result = self.stepHandlers[eccentricity][orientation].getBestPest()
-					self.writeOutput(eccentricity, orientation, result)
-
-			# Take a break if it's time
-			self.flipBuffer()
-			if blockCounter < len(self.blocks)-1:
-				logging.debug('Break time')
-				self.takeABreak()
-
-		logging.debug('User is done!')
-		if self.config['General settings']['practice']:
-			return practiceWentOk
-		else:
-			return True
-
-	def runTrial(self, trial, stepHandler):
-		self.trial = trial
-		orientationOffset = stepHandler.next()
-
-		logging.info(f'Presenting eccentricity={trial.eccentricity}, orientation={trial.orientation}, stimAngleOffset={orientationOffset}')
-
-		whichDirection = random.choice([-1, 1])
-		logging.info(f'Correct direction = {whichDirection}')
-
-		stimString = '\nO: %.2f+%.2f,\nE: %.2f,\nP: [%.2f, %.2f]' % (trial.orientation, orientationOffset, trial.eccentricity, *trial.stimPositionAngles)
-
-		self.stim.ori = trial.orientation
-		self.stim.size = monitorTools.scaleSizeByEccentricity(self.config['Stimuli settings']['stimulus_size'], trial.eccentricity)
-
-		self.updateHUD('thisStim', stimString)
-
-		expectedLabels = {
-			-1: self.config['Input settings']['rotated_left_key_label'],
-			1: self.config['Input settings']['rotated_right_key_label'],
-		}
-		self.updateHUD('expectedResp', expectedLabels[whichDirection])
-
-		retries = -1
-		needToRetry = True
-		while retries < self.config['Gaze tracking']['retries'] and needToRetry:
-			retries += 1
-
-			if retries > 1 and (retries % self.config['Gaze tracking']['retries_to_trigger_calibration']) == 0 and self.gazeTracker is not None:
-				self.doCalibration()
-
-			if self.config['Input settings']['wait_for_ready_key']:
-				self.waitForReadyKey()
-
-			if self.config['Display settings']['show_fixation_aid']:
-				self.drawFixationAid()
-			else:
-				self.fixationStim.draw()
-
-			self.drawAnnuli(trial.eccentricity)
-			self.flipBuffer()
-			time.sleep(.5)
-
-			needToRetry = False
-
-			if self.config['Gaze tracking']['wait_for_fixation']:
-				if not self.waitForFixation():
-					needToRetry = True
-					self.config['gazeTone'].play()
-					continue
-
-			for i in range(2):
-				self.stim.pos = (
-					numpy.cos(trial.stimPositionAngles[i] * numpy.pi/180.0) * trial.eccentricity,
-					numpy.sin(trial.stimPositionAngles[i] * numpy.pi/180.0) * trial.eccentricity,
-				)
-
-				if i == 1 and self.config['Gaze tracking']['wait_for_fixation']:
-					gazePos = self.getGazePosition()
-					if gazePos is not None:
-						gazeAngle = math.sqrt(gazePos[0]**2 + gazePos[1]**2)
-
-						logging.info(f'Gaze pos: {gazePos}')
-						logging.info(f'Gaze angle: {gazeAngle}')
-						if gazeAngle > self.config['Gaze tracking']['gaze_offset_max']:
-							self.config['gazeTone'].play()
-							logging.info('Participant looked away!')
-							needToRetry = True
-							continue
-					else:
-						self.config['gazeTone'].play()
-						logging.info('Participant looked away!')
-						needToRetry = True
-						continue
-
-				if self.config['Gaze tracking']['render_at_gaze']:
-					gazePos = self.getGazePosition()
-					logging.info(f'Gaze pos: {gazePos}')
-					self.stim.pos = [
-						self.stim.pos[0] + gazePos[0],
-						self.stim.pos[1] + gazePos[1]
-					]
-
-				# First half of the stimulus
-				self.config['sitmulusTone'].play() # play the tone
-				self.drawFixationAid()
-				self.drawAnnuli(trial.eccentricity)
-				self.stim.draw()
-				self.flipBuffer()
-
-				time.sleep(self.config['Stimuli settings']['stimulus_duration']/1000.0)
-
-				self.applyMasks(trial.eccentricity)
-				self.drawFixationAid()
-				self.drawAnnuli(trial.eccentricity)
-				self.flipBuffer()
-
-				# Pause between stimuli in this pair
-				if i == 0:
-					self.stim.ori += orientationOffset * whichDirection
-					time.sleep(self.config['Stimuli settings']['time_between_stimuli'] / 1000.0)     # pause between stimuli
-
-			if self.config['Display settings']['show_fixation_aid']:
-				self.drawFixationAid()
-			else:
-				self.fixationStim.draw()
-
-			self.drawAnnuli(trial.eccentricity)
-			self.flipBuffer()
-
-			if not needToRetry:
-				correct = self.checkResponse(whichDirection)
-				self.updateHUD('lastStim', stimString)
-				self.updateHUD('thisStim', '')
-
-				if correct:
-					logging.debug('Correct response')
-					self.updateHUD('lastOk', '✔', (-1, 1, -1))
-					self.config['positiveFeedback'].play()
-				else:
-					logging.debug('Incorrect response')
-					self.updateHUD('lastOk', '✘', (1, -1, -1))
-					self.config['negativeFeedback'].play()
-
-		if retries >= self.config['Gaze tracking']['retries']:
-			raise Exception('Max retries exceeded!')
-
-		self.flipBuffer()
-		logLine = f'E={trial.eccentricity},O={trial.orientation}+{orientationOffset},Correct={correct}'
-		logging.info(f'Response: {logLine}')
-		stepHandler.markResponse(correct)
-		if self.config['General settings']['practice']:
-			self.history.pop(0)
-			self.history.append(1 if correct else 0)
-
-	def applyMasks(self, eccentricity=None):
-		if self.config['Stimuli settings']['mask_time'] > 0:
-			self.drawFixationAid()
-			self.drawAnnuli(eccentricity)
-			if eccentricity is None:
-				eccentricities = self.annuli.keys()
-			else:
-				eccentricities = [eccentricity]
-
-			for ecc in eccentricities:
-				for mask in self.masks[ecc]:
-					mask.draw()
-
-			self.flipBuffer()
-			time.sleep(self.config['Stimuli settings']['mask_time']/1000)
-
-	def drawFixationAid(self):
-		if self.config['Display settings']['show_fixation_aid']:
-			[_.draw() for _ in self.fixationAid]
-
-	def drawAnnuli(self, eccentricity=None):
-		if self.config['Display settings']['show_annuli']:
-			if eccentricity is None:
-				eccentricities = self.annuli.keys()
-			else:
-				eccentricities = [eccentricity]
-
-			for eccentricity in eccentricities:
-				for circle in self.annuli[eccentricity]:
-					circle.draw()
-
-	def waitForReadyKey(self):
-		self.showMessage('Press [SPACEBAR] when ready.')
-
-	def waitForFixation(self, target=[0,0]):
-		logging.info(f'Waiting for fixation...')
-		distance = self.config['Gaze tracking']['gaze_offset_max'] + 1
-		startTime = time.time()
-		fixationStartTime = None
-
-		#self.fixationStim.autoDraw = True
-		fixated = None
-
-		while fixated is None:
-			currentTime = time.time()
-			pos = self.getGazePosition()
-			if pos is not None:
-				self.gazeMarker.pos = pos
-				if self.config['Gaze tracking']['show_gaze']:
-					self.gazeMarker.draw()
-
-				self.drawFixationAid()
-				self.drawAnnuli(eccentricity=self.trial.eccentricity)
-				self.flipBuffer()
-
-				distance = math.sqrt((target[0]-pos[0])**2 + (target[1]-pos[1])**2)
-				if distance < self.config['Gaze tracking']['gaze_offset_max']:
-					if fixationStartTime is None:
-						fixationStartTime = currentTime
-					elif currentTime - fixationStartTime > self.config['Gaze tracking']['fixation_period']:
-						fixated = True
-				else:
-					fixationStartTime = None
-
-			if time.time() - startTime > self.config['Gaze tracking']['max_wait_time']:
-				fixated = False
-
-		#self.fixationStim.autoDraw = False
-		return fixated
-
-	def getGazePosition(self):
-		pos = self.gazeTracker.getPosition()
-		if pos is None:
-			return
-		else:
-			return PyPupilGazeTracker.PsychoPyVisuals.screenToMonitorCenterDeg(self.mon, pos)
-
-	def start(self):
-		exitCode = 0
-		try:
-			if not self.runBlocks():
-				logging.critical('Participant failed practice')
-				exitCode = 66
-		except UserExit as exc:
-			exitCode = 2
-			logging.info(exc)
-		except Exception as exc:
-			exitCode = 1
-
-			print('Exception: %s' % exc)
-			traceback.print_exc()
-			logging.critical(exc)
-			self.showMessage('Something went wrong!\n\nPlease let the research assistant know.\n\n%s' % exc, exceptionOnEsc=False)
-
-		if self.gazeTracker is not None:
-			self.gazeTracker.stop()
-		else:
-			self.cobreCommander.openShutter()
-			self.cobreCommander.disconnectFromHost()
-
-		for stim in self.referenceCircles:
-			stim.autoDraw = False
-
-		self.showMessage('Good job - you are finished with this part of the study!\n\nPress the [SPACEBAR] to exit.', exceptionOnEsc=False)
-		self.win.close()
-		event.clearEvents()
-		core.quit(exitCode)
-
-os.makedirs('data', exist_ok=True)
-config = getConfig()
-
-if config['Gaze tracking']['wait_for_fixation'] or config['Gaze tracking']['render_at_gaze']:
-	import PyPupilGazeTracker
-	import PyPupilGazeTracker.smoothing
-	import PyPupilGazeTracker.PsychoPyVisuals
-	import PyPupilGazeTracker.GazeTracker
-
-tester = OrientationDiscriminationTester(config)
-tester.start()
\ No newline at end of file
+import os, platform
+import traceback
+import argparse
+import time, random
+import logging
+import cProfile
+import json
+from pathlib import Path
+
+from functools import partial
+from collections import OrderedDict
+
+import BestPest, settings, assets, profiling, responses, shutter, calibration, aggregator, markers, drift, export
+from MonitorShutter import ShutterController
+import monitorTools
+
+import psychopy
+
+psychopy.prefs.general['audioLib'] = ['pyo','pygame', 'sounddevice']
+
+from psychopy import core, visual, gui, data, event, monitors, sound, tools
+import numpy
+
+import math
+
+class Trial():
+	def __init__(self, eccentricity, orientation, stimPositionAngles):
+		self.eccentricity = eccentricity
+		self.orientation = orientation
+		self.stimPositionAngles = list(stimPositionAngles)
+		self.reactionTime = None
+		self.progressText = ''
+
+		# set by OrientationDiscriminationTester.prepareTrial
+		self.whichDirection = None
+		self.stimSize = None
+		self.stimPositions = None
+
+	def __str__(self):
+		return self.__repr__()
+
+	def __repr__(self):
+		return f'Trial(e={self.eccentricity},o={self.orientation},a={self.stimPositionAngles})'
+
+class UserExit(Exception):
+	def __init__(self):
+		super().__init__('User asked to quit.')
+
+def getSound(filename, freq, duration):
+	try:
+		filename = os.path.join('assets', 'PyOrientationDiscrimination', filename)
+		filename = assets.getFilePath(filename)
+		return sound.Sound(filename)
+	except ValueError:
+		logging.warning(f'Failed to load sound file: {filename}. Synthesizing sound instead.')
+		return sound.Sound(freq, secs=duration)
+
+def getConfig(preset=None, sessionId=None):
+	if preset is None:
+		config = settings.getSettings()
+	else:
+		config = settings.getPresetSettings(preset)
+
+	if sessionId is not None:
+		config['General settings']['session_id'] = sessionId
+
+	config['General settings']['start_time'] = data.getDateStr()
+	os.makedirs(config['General settings']['data_path'], exist_ok=True)
+	logFile = os.path.join(
+		Path(config['General settings']['data_path']),
+		config['General settings']['data_filename'].format(**config['General settings']) + '.log'
+	)
+	logging.basicConfig(filename=logFile, level=logging.DEBUG, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+	# recorded so offline analysis can rebuild the stimulus grid
+	logging.info(f'Settings: {json.dumps(config, default=str)}')
+
+	# group = 'Stimuli settings'
+	# for k in ['eccentricities', 'orientations', 'stimulus_position_angles']:
+	# 	if isinstance(config[group][k], str):
+	# 		config[group][k] = [float(v) for v in config[group][k].split(' ')]
+	# 	else:
+	# 		config[group][k] = [float(config[group][k])]
+
+	config['sitmulusTone'] = getSound('600Hz_square_25.wav', 600, .185)
+	config['positiveFeedback'] = getSound('1000Hz_sine_50.wav', 1000, .077)
+	config['negativeFeedback'] = getSound('300Hz_sine_25.wav', 300, .2)
+	config['gazeTone'] = getSound('hurt.wav', 200, .2)
+
+	return config
+
+class OrientationDiscriminationTester():
+	def __init__(self, config):
+		self.config = config
+		self.profiler = profiling.getProfiler(self.config['Debug settings']['profile_phases'])
+
+		sound.init()
+
+		self.setupMonitor()
+		self.setupHUD()
+		self.keyboard = responses.getKeyboard(self.config['Input settings']['response_backend'], core.getTime)
+		self.markerStream = markers.getMarkerStream(self.config['General settings']['event_marker_address'], core.getTime)
+		self.setupDataFile()
+		self.setupPublisher()
+		self.exporter = export.getExporter(self.config['General settings']['columnar_export'], self.dataBasename)
+
+		self.setupBlocks()
+
+	def setupMonitor(self):
+		physicalSize = monitorTools.getPhysicalSize()
+		resolution = monitorTools.getResolution()
+
+		self.mon = monitors.Monitor('testMonitor')
+		self.mon.setDistance(self.config['Display settings']['monitor_distance'])  # Measure first to ensure this is correct
+		self.mon.setWidth(physicalSize[0]/10)
+		self.mon.setSizePix(resolution)
+		self.mon.save()
+
+		self.win = visual.Window(size = resolution, fullscr=True, monitor='testMonitor', allowGUI=False, units='deg')
+		self.background = visual.Rect(self.win, size=[dim*2 for dim in resolution], units='pix', color=self.config['Display settings']['background_color'])
+		self.flipBuffer()
+
+		self.referenceCircles = [
+			visual.Circle(
+				self.win,
+				radius        = self.config['Stimuli settings']['stimulus_size'] * .5,
+				lineColor     = -1,
+				lineWidth     = 5,
+				name          = 'Circle surrounding patch'
+			),
+			visual.Circle(
+				self.win,
+				radius        = self.config['Stimuli settings']['stimulus_size'] * .6,
+				lineColor     = -1,
+				lineWidth     = 5,
+				name          = 'Circle surrounding patch'
+			),
+		]
+
+		self.stim = visual.GratingStim(self.win, contrast=self.config['Stimuli settings']['stimulus_contrast'], sf=self.config['Stimuli settings']['stimulus_frequency'], size=self.config['Stimuli settings']['stimulus_size'], mask='gauss')
+		fixationVertices = (
+			(0, -0.5), (0, 0.5),
+			(0, 0),
+			(-0.5, 0), (0.5, 0),
+		)
+		self.fixationStim = visual.ShapeStim(self.win, vertices=fixationVertices, lineColor=-1, closeShape=False, size=self.config['Display settings']['fixation_size']/60.0)
+		self.fixationAid = [
+			visual.Circle(self.win,
+				radius = self.config['Gaze tracking']['gaze_offset_max'] * .5,
+				lineColor = self.config['Display settings']['fixation_color'],
+				fillColor = None,
+			), visual.Circle(self.win,
+				radius = self.config['Gaze tracking']['gaze_offset_max'] * .05,
+				fillColor = self.config['Display settings']['fixation_color'],
+				lineColor = None,
+			)
+		]
+
+		if self.config['Display settings']['show_annuli']:
+			self.annuli = {}
+			for eccentricity in self.config['Stimuli settings']['eccentricities']:
+				self.annuli[eccentricity] = []
+
+				for angle in self.config['Stimuli settings']['stimulus_position_angles']:
+					pos = [
+						numpy.cos(angle * numpy.pi/180.0) * eccentricity,
+						numpy.sin(angle * numpy.pi/180.0) * eccentricity,
+					]
+					self.annuli[eccentricity].append(
+						visual.Circle(
+							self.win,
+							pos=pos,
+							radius = .5 * monitorTools.scaleSizeByEccentricity(self.config['Stimuli settings']['stimulus_size'], eccentricity),
+							lineColor = self.config['Display settings']['annuli_color'],
+							fillColor = None,
+							units = 'deg'
+						)
+					)
+
+		if self.config['Stimuli settings']['mask_time'] > 0:
+			self.masks = {}
+			size = self.config['Stimuli settings']['stimulus_size']
+			maskImagePath = assets.getFilePath(os.path.join('assets', 'PyOrientationDiscrimination', 'mask.png'))
+
+			for eccentricity in self.config['Stimuli settings']['eccentricities']:
+				self.masks[eccentricity] = []
+				for angle in self.config['Stimuli settings']['stimulus_position_angles']:
+					pos = [
+						numpy.cos(angle * numpy.pi/180.0) * eccentricity,
+						numpy.sin(angle * numpy.pi/180.0) * eccentricity,
+					]
+					self.masks[eccentricity].append(
+						visual.ImageStim(
+							self.win,
+							image=maskImagePath,
+							pos=pos,
+							size=monitorTools.scaleSizeByEccentricity(size, eccentricity),
+							mask='gauss',
+						)
+					)
+
+		if self.config['Gaze tracking']['wait_for_fixation'] or self.config['Gaze tracking']['render_at_gaze']:
+			self.screenMarkers = PyPupilGazeTracker.PsychoPyVisuals.ScreenMarkers(self.win)
+			self.gazeTracker = PyPupilGazeTracker.GazeTracker.GazeTracker(
+				smoother=PyPupilGazeTracker.smoothing.SimpleDecay(),
+				screenSize=resolution
+			)
+			self.gazeTracker.start(closeShutter=False)
+			self.gazeMarker = PyPupilGazeTracker.PsychoPyVisuals.FixationStim(self.win, size=self.config['Gaze tracking']['gaze_offset_max'], units='deg', autoDraw=False)
+			self.calibrationWorker = calibration.CalibrationWorker()
+			self.calibrationWorker.spawn()
+		else:
+			self.gazeTracker = None
+			self.calibrationWorker = None
+
+		if self.gazeTracker is not None and self.config['Gaze tracking']['drift_correction']:
+			# correcting more than the fixation tolerance would hide errors a calibration should fix
+			maxCorrection = min(self.config['Gaze tracking']['max_drift_correction'], self.config['Gaze tracking']['gaze_offset_max'])
+			if maxCorrection < self.config['Gaze tracking']['max_drift_correction']:
+				logging.warning(f'Max drift correction is limited to the gaze offset max of {maxCorrection} deg')
+
+			self.driftEstimator = drift.DriftEstimator(
+				fixationPeriod=self.config['Gaze tracking']['fixation_period'],
+				captureRadius=maxCorrection + self.config['Gaze tracking']['gaze_offset_max'],
+				maxCorrection=maxCorrection,
+				maxDispersion=self.config['Gaze tracking']['max_fixation_dispersion'],
+				maxUnexplainedFailures=self.config['Gaze tracking']['retries_to_trigger_calibration'],
+			)
+		else:
+			self.driftEstimator = None
+
+		self.cobreCommander = shutter.AsyncShutterController(ShutterController, self.config['Display settings']['shutter_command_timeout'])
+
+		self.trial = None
+
+	def setTopLeftPos(self, stim, pos):
+		# convert pixels to degrees
+		stimDim = stim.boundingBox
+		screenDim = self.mon.getSizePix()
+		centerPos = [
+			pos[0] + (stimDim[0] - screenDim[0]) / 2,
+			(screenDim[1] - stimDim[1]) / 2 - pos[1],
+		]
+		stim.pos = centerPos
+
+	def updateHUD(self, item, text, color=None):
+		element, pos, labelText = self.hudElements[item]
+
+		# swap in a copy staged with this text, if there is one, rather than laying the text out now
+		staged = self.hudStaged[item]
+		for index, (stagedText, stagedColor, stim) in enumerate(staged):
+			if stagedText == text and stagedColor == color:
+				del staged[index]
+				stim.autoDraw = element.autoDraw
+				element.autoDraw = False
+				self.hudElements[item][0] = stim
+				self.hudSpares[item].append(element)
+				return
+
+		element.text = text
+		self.setTopLeftPos(element, pos)
+		if color != None:
+			element.color = color
+
+	def stageHUD(self, item, text, color=None):
+		'''
+			Lays out text on a spare copy of a HUD element ahead of time, so that a later updateHUD with the same
+			text and color only has to swap it in
+		'''
+		element, pos, labelText = self.hudElements[item]
+		staged = self.hudStaged[item]
+		if any(stagedText == text and stagedColor == color for stagedText, stagedColor, stim in staged):
+			return
+
+		if self.hudSpares[item]:
+			stim = self.hudSpares[item].pop()
+		else:
+			stim = visual.TextStim(self.win, text=' ', units='pix', height=element.height, wrapWidth=element.wrapWidth)
+
+		stim.color = element.color if color is None else color
+		stim.text = text
+		self.setTopLeftPos(stim, pos)
+		staged.append((text, color, stim))
+
+	def clearStagedHUD(self):
+		for item, staged in self.hudStaged.items():
+			self.hudSpares[item] += [stim for stagedText, stagedColor, stim in staged]
+			staged.clear()
+
+	def setupHUD(self):
+		lineHeight = 40
+		xOffset = 225
+		yOffset = 10
+
+		self.hudElements = OrderedDict(
+			lastStim = [visual.TextStim(self.win, text=' '), [xOffset-150, 0 + yOffset], 'Last stim'],
+			lastResp = [visual.TextStim(self.win, text=' '), [xOffset + 40, 6*lineHeight + yOffset], None],
+			lastOk = [visual.TextStim(self.win, text=' '), [xOffset -10, 6*lineHeight + yOffset], 'Last resp'],
+			thisStim = [visual.TextStim(self.win, text=' '), [xOffset-150, 8*lineHeight + yOffset], 'This stim'],
+			expectedResp = [visual.TextStim(self.win, text=' '), [xOffset, 14*lineHeight + yOffset], 'Exp resp'],
+			progress = [visual.TextStim(self.win, text=' '), [xOffset-150, 20*lineHeight + yOffset], 'Progress'],
+		)
+
+		for key in list(self.hudElements):
+			stim, pos, labelText = self.hudElements[key]
+			if labelText is not None:
+				label = visual.TextStim(self.win, text=labelText+':')
+				pos = [30, pos[1]]
+				self.hudElements[key+'_label'] = [label, pos, None]
+
+		for key in list(self.hudElements):
+			stim, pos, labelText = self.hudElements[key]
+
+			stim.color = 1
+			stim.units = 'pix'
+			stim.height = lineHeight * .88
+			stim.wrapWidth = 9999
+			self.setTopLeftPos(stim, pos)
+
+		# see stageHUD
+		self.hudStaged = {key: [] for key in self.hudElements}
+		self.hudSpares = {key: [] for key in self.hudElements}
+
+	def enableHUD(self):
+		for key, hudArgs in self.hudElements.items():
+			stim, pos, labelText = hudArgs
+			stim.autoDraw = True
+
+		if self.config['Stimuli settings']['stereo_circles']:
+			for circle in self.referenceCircles:
+				circle.autoDraw = True
+
+	def disableHUD(self):
+		for key, hudArgs in self.hudElements.items():
+			stim, pos, labelText = hudArgs
+			stim.autoDraw = False
+
+		for circle in self.referenceCircles:
+			circle.autoDraw = False
+
+	def flipBuffer(self):
+		'''
+			Returns:
+				float: core.getTime() timestamp taken as soon as the flip returns
+		'''
+		with self.profiler.span('flipBuffer'):
+			self.win.flip()
+			flipTime = core.getTime()
+			self.background.draw()
+
+		return flipTime
+
+	def setupDataFile(self):
+		self.dataBasename = os.path.join(
+			Path(self.config['General settings']['data_path']),
+			self.config['General settings']['data_filename'].format(**self.config['General settings'])
+		)
+		self.dataFilename = self.dataBasename + '.csv'
+		logging.info(f'Starting data file {self.dataFilename}')
+
+		if not os.path.exists(self.dataFilename):
+			dataFile = open(self.dataFilename, 'w')
+			dataFile.write('Eccentricity,Orientation,Threshold,CI low,CI high\n')
+			dataFile.close()
+
+	def setupPublisher(self):
+		generalSettings = self.config['General settings']
+		self.sessionName = os.path.basename(self.dataBasename)
+		self.trialCount = 0
+
+		self.publisher = aggregator.getPublisher(
+			generalSettings['aggregator_address'],
+			generalSettings['station_name'] or platform.node(),
+			os.path.join(generalSettings['data_path'], 'aggregator.spool.jsonl'),
+		)
+		self.publisher.publish({
+			'type': 'session',
+			'session': self.sessionName,
+			'session_id': generalSettings['session_id'],
+			'start_time': generalSettings['start_time'],
+			'practice': generalSettings['practice'],
+		})
+
+	def writeOutput(self, eccentricity, orientation, threshold, interval=(numpy.nan, numpy.nan)):
+		logging.debug(f'Saving record to {self.dataFilename}, e={eccentricity}, o={orientation}, t={threshold}, ci={interval}')
+
+		dataFile = open(self.dataFilename, 'a')  # a simple text file with 'comma-separated-values'
+		dataFile.write(f'{eccentricity},{orientation},{threshold},{interval[0]},{interval[1]}\n')
+		dataFile.close()
+
+		self.publisher.publish({
+			'type': 'threshold',
+			'session': self.sessionName,
+			'eccentricity': eccentricity,
+			'orientation': orientation,
+			'threshold': float(threshold),
+			'ci_low': float(interval[0]),
+			'ci_high': float(interval[1]),
+		})
+
+	def getThresholdIntervals(self, stepHandlers):
+		'''
+			Bootstraps threshold confidence intervals for several conditions in one batch
+
+			Returns:
+				numpy.array: (len(stepHandlers), 2) lower and upper bounds, nan if disabled
+		'''
+		resamples = self.config['General settings']['bootstrap_resamples']
+		if resamples <= 0 or len(stepHandlers) == 0:
+			return numpy.full((len(stepHandlers), 2), numpy.nan)
+
+		trials = max(1, max(len(stepHandler.responses) for stepHandler in stepHandlers))
+		stimIndices = numpy.full((len(stepHandlers), trials), -1)
+		marked = numpy.zeros((len(stepHandlers), trials), dtype=bool)
+		for i, stepHandler in enumerate(stepHandlers):
+			for j, (stimIndex, response) in enumerate(stepHandler.responses):
+				stimIndices[i, j] = stimIndex
+				marked[i, j] = response
+
+		return BestPest.bootstrapIntervals(
+			stepHandlers[0].stimulusLevels, stimIndices, marked,
+			resamples, self.config['General settings']['confidence_level']
+		)
+
+	def setupStepHandler(self):
+		stimSpace = numpy.arange(
+			self.config['Stimuli settings']['stimulus_angle_precision'], # minimum
+			self.config['Stimuli settings']['max_stimulus_angle'] + self.config['Stimuli settings']['stimulus_angle_precision'], # maximum + 1
+			self.config['Stimuli settings']['stimulus_angle_precision'] # precision
+		)
+		if self.config['Stimuli settings']['adaptive_stimulus_grid'] and len(stimSpace) >= BestPest.ADAPTIVE_MIN_LEVELS:
+			return BestPest.AdaptiveBestPest(stimSpace)
+		else:
+			return BestPest.BestPest(stimSpace)
+
+	def doCalibration(self, withValidation=False):
+		self.cobreCommander.openShutter()
+		self.showMessage('Looks like you need to be re-calibrated!\nFollow the circle around the next screen.\nPress SPACE to begin.')
+		self.cobreCommander.flush()
+
+		if not withValidation:
+			self.gazeTracker.doCalibration(shutterCloseAfterCalibration=True)
+		else:
+			self.win.winHandle.minimize()
+			self.win.winHandle.set_fullscreen(False) # disable fullscreen
+			self.win.flip()
+			self.calibrationWorker.run()
+			time.sleep(1)
+
+			# Attempt to bring the window back (doesn't appear to work)
+			self.win.winHandle.maximize()
+			self.win.winHandle.set_fullscreen(True)
+			self.win.winHandle.activate()
+			self.win.flip()
+
+			self.cobreCommander.activateLights()
+			self.cobreCommander.closeShutter()
+
+		# the next trial needs the shutter closed again
+		self.cobreCommander.flush()
+
+		if self.driftEstimator is not None:
+			self.driftEstimator.reset()
+
+		time.sleep(1)
+
+	def needsCalibration(self, retries):
+		'''
+			Returns:
+				bool: True if the gaze tracker should be recalibrated before the next attempt at a trial
+		'''
+		if self.driftEstimator is not None:
+			return self.driftEstimator.needsCalibration()
+		else:
+			return retries > 1 and (retries % self.config['Gaze tracking']['retries_to_trigger_calibration']) == 0
+
+	def showMessage(self, msg, exceptionOnEsc=True):
+		keepWaiting = True
+		firstRender = True
+
+		messageStim = visual.TextStim(self.win, text=msg, color=-1, wrapWidth=40)
+
+		while keepWaiting:
+			if self.config['Gaze tracking']['show_gaze'] and self.gazeTracker is not None:
+				pos = self.getGazePosition()
+				if pos is not None:
+					self.gazeMarker.pos = pos
+
+				self.gazeMarker.draw(drawText=False)
+
+			messageStim.draw()
+			self.flipBuffer()
+
+			if firstRender:
+				firstRender = False
+				time.sleep(0.25)
+				event.clearEvents()
+			else:
+				keys = event.getKeys()
+				keyPressed = len(keys) > 0
+				if keyPressed:
+					if 'c' in keys and self.gazeTracker is not None:
+						self.doCalibration(withValidation=True)
+
+					if 'g' in keys:
+						self.config['Gaze tracking']['show_gaze'] = not self.config['Gaze tracking']['show_gaze']
+
+					if 'm' in keys:
+						self.win.winHandle.minimize()
+
+					if 'space' in keys:
+						keepWaiting = False
+
+					if 'escape' in keys:
+						if exceptionOnEsc:
+							raise UserExit()
+						else:
+							keepWaiting = False
+
+	def showInstructions(self, firstTime=False):
+		leftKey = self.config['Input settings']['rotated_left_key_label']
+		rightKey = self.config['Input settings']['rotated_right_key_label']
+
+		instructions = 'For this test, you will be presented with two striped circles, one at a time and in different locations.\n\n'
+		instructions += 'The second striped circle is the same as the first except rotated slightly to the left or slightly to the right.\n\n'
+		instructions += 'Sometimes these striped circles will appear in the center of the screen, and sometimes around the center of the screen.\n\n'
+		instructions += 'If the second striped circle is rotated to the counter-clockwise, press [' + leftKey.upper() + '].\n'
+		instructions += 'If the second striped circle is rotated to the clockwise, press [' + rightKey.upper() + '].\n\n'
+		instructions += 'Throughout the test, keep your gaze fixated on the circled-dot at the center of the screen.\n\n'
+		instructions += 'If you are uncertain, make a guess.\n\n\nPress [SPACEBAR] to start.'
+
+		if not firstTime:
+			instructions = 'These instructions are the same as before.\n\n' + instructions
+
+		self.showMessage(instructions)
+		self.cobreCommander.closeShutter()
+		self.cobreCommander.flush()
+
+	def takeABreak(self, waitForKey=True):
+		for circle in self.referenceCircles:
+			circle.autoDraw = False
+
+		self.showMessage('Good job - it\'s now time for a break!\n\nWhen you are ready to continue, press the [SPACEBAR].')
+
+	def checkResponse(self, whichDirection, onsetTime):
+		'''
+			Waits for a left/right response
+
+			Args:
+				whichDirection (int): -1 if the correct answer is left, 1 if right
+				onsetTime (float): flip timestamp of the second stimulus
+
+			Returns:
+				tuple: (correct, reaction time in seconds relative to onsetTime). Keys pressed before onsetTime are ignored.
+		'''
+		leftKey = self.config['Input settings']['rotated_left_key']
+		rightKey = self.config['Input settings']['rotated_right_key']
+
+		leftKeyLabel = self.config['Input settings']['rotated_left_key_label']
+		rightKeyLabel = self.config['Input settings']['rotated_right_key_label']
+
+		correct = None
+		reactionTime = None
+		while correct is None:
+			keys = self.keyboard.waitKeys()
+			logging.debug(f'Keys detected: {keys}')
+			for key, keyTime in keys:
+				# the buffer is cleared before the first stimulus, so this could be a guess made before the rotation was shown
+				if key in (leftKey, rightKey) and keyTime < onsetTime:
+					logging.info(f'Ignoring {key} pressed {onsetTime - keyTime:.3f}s before the second stimulus')
+					continue
+
+				if key == leftKey:
+					self.updateHUD('lastResp', leftKeyLabel)
+					logging.info(f'User selected left ({leftKey})')
+					correct = (whichDirection < 0)
+				elif key == rightKey:
+					self.updateHUD('lastResp', rightKeyLabel)
+					logging.info(f'User selected right ({rightKey})')
+					correct = (whichDirection > 0)
+				elif key in ['q', 'escape']:
+					raise UserExit()
+
+				if correct is not None:
+					reactionTime = keyTime - onsetTime
+					break
+
+			event.clearEvents()
+
+		return correct, reactionTime
+
+	def getBlockAndNonBlock(self):
+		blockSeparatorKey = self.config['General settings']['separate_blocks_by'].lower()
+		if blockSeparatorKey == 'orientations':
+			nonBlockedKey = 'eccentricities'
+		else:
+			nonBlockedKey = 'orientations'
+
+		return blockSeparatorKey, nonBlockedKey
+
+	def blockVarsToEccentricityAndOrientation(self, blockVarName, blockVarValue, nonBlockVarValue):
+		if blockVarName == 'eccentricities':
+			return blockVarValue, nonBlockVarValue
+		else:
+			return nonBlockVarValue, blockVarValue
+
+	def setupBlocks(self):
+		'''
+			blocks = [
+				{'eccentricity': x, 'trials': [trial, trial, trial]},
+				{'eccentricity': y, 'trials': [trial, trial, trial]},
+				...
+			]
+		'''
+
+		angleConfigs = []
+		for angle1 in self.config['Stimuli settings']['stimulus_position_angles']:
+			for angle2 in self.config['Stimuli settings']['stimulus_position_angles']:
+				if angle1 != angle2:
+					angleConfigs.append([angle1, angle2])
+
+		self.blocks = []
+		self.stepHandlers = {}
+		for eccentricity in self.config['Stimuli settings']['eccentricities']:
+			self.stepHandlers[eccentricity] = {}
+			for orientation in self.config['Stimuli settings']['orientations']:
+				self.stepHandlers[eccentricity][orientation] = self.setupStepHandler()
+
+		blockSeparatorKey, nonBlockedKey = self.getBlockAndNonBlock()
+		for blockValue in self.config['Stimuli settings'][blockSeparatorKey]:
+			block = {
+				'blockBy': blockSeparatorKey,
+				'blockValue': blockValue,
+				'trials': [],
+			}
+
+			for nonBlockedValue in self.config['Stimuli settings'][nonBlockedKey]:
+				eccentricity, orientation = self.blockVarsToEccentricityAndOrientation(blockSeparatorKey, blockValue, nonBlockedValue)
+				possibleAngles = []
+
+				for configTrial in range(self.config['Stimuli settings']['trials_per_stimulus_config']):
+					if len(possibleAngles) == 0:
+						possibleAngles = list(angleConfigs)
+						random.shuffle(possibleAngles)
+
+					block['trials'].append(Trial(eccentricity, orientation, possibleAngles.pop()))
+
+			random.shuffle(block['trials'])
+			self.blocks.append(block)
+
+		random.shuffle(self.blocks)
+
+		if self.config['General settings']['practice']:
+			self.history = [0] * self.config['General settings']['practice_history']
+			combinedBlock = {
+				'blockBy': None,
+				'blockValue': None,
+				'trials': []
+			}
+
+			for block in self.blocks:
+				combinedBlock['trials'] += block['trials']
+
+			random.shuffle(combinedBlock['trials'])
+			self.blocks = [combinedBlock]
+
+		for block in self.blocks:
+			logging.debug('Block by {blockBy}:{blockValue}'.format(**block))
+			for trial in block['trials']:
+				logging.debug(f'\t{trial}')
+
+	def runBlocks(self):
+		blockSeparatorKey, nonBlockedKey = self.getBlockAndNonBlock()
+		practiceWentOk = False
+
+		for blockCounter, block in enumerate(self.blocks):
+			# Show instructions
+			self.showInstructions(blockCounter==0)
+			# Run each trial in this block
+			if self.config['Stimuli settings']['stereo_circles']:
+				for circle in self.referenceCircles:
+					circle.autoDraw = True
+
+
+			self.enableHUD()
+			for trialCounter, trial in enumerate(block['trials']):
+				trial.progressText = f'\nB({blockCounter+1}/{len(self.blocks)})\nT({trialCounter+1}/{len(block["trials"])})'
+
+			for trialCounter, trial in enumerate(block['trials']):
+				self.flipBuffer()
+
+				with self.profiler.span('sleep'):
+					time.sleep(self.config['Stimuli settings']['time_between_stimuli'] / 1000.0)     # pause between trials
+
+				self.updateHUD('progress', trial.progressText)
+				nextTrial = block['trials'][trialCounter+1] if trialCounter+1 < len(block['trials']) else None
+				with self.profiler.span('runTrial'):
+					self.runTrial(trial, self.stepHandlers[trial.eccentricity][trial.orientation], nextTrial)
+
+				if self.config['General settings']['practice']:
+					if sum(self.history) >= self.config['General settings']['practice_streak']:
+						logging.info('Practice completed!')
+						practiceWentOk = True
+						break
+
+			self.disableHUD()
+
+			# Write output
+			with self.profiler.span('writeOutput'):
+				self.writeBlockOutput(block)
+
+			# Take a break if it's time
+			self.flipBuffer()
+			if blockCounter < len(self.blocks)-1:
+				logging.debug('Break time')
+				with self.profiler.span('takeABreak'):
+					self.takeABreak()
+
+		logging.debug('User is done!')
+		if self.config['General settings']['practice']:
+			return practiceWentOk
+		else:
+			return True
+
+	def writeBlockOutput(self, block):
+		blockSeparatorKey, nonBlockedKey = self.getBlockAndNonBlock()
+
+		conditions = []
+		if self.config['General settings']['practice']:
+			for eccentricity, eccDicts in self.stepHandlers.items():
+				for orientation, stepHandler in eccDicts.items():
+					conditions.append((eccentricity, orientation))
+		else:
+			for nonBlockedValue in self.config['Stimuli settings'][nonBlockedKey]:
+				conditions.append(self.blockVarsToEccentricityAndOrientation(blockSeparatorKey, block['blockValue'], nonBlockedValue))
+
+		stepHandlers = [self.stepHandlers[eccentricity][orientation] for eccentricity, orientation in conditions]
+		intervals = self.getThresholdIntervals(stepHandlers)
+		for (eccentricity, orientation), stepHandler, interval in zip(conditions, stepHandlers, intervals):
+			threshold = stepHandler.getBestPest()
+			self.writeOutput(eccentricity, orientation, threshold, interval)
+			self.exporter.addCondition(eccentricity, orientation, stepHandler, threshold, interval)
+
+		self.exporter.flush()
+
+	def getStimString(self, trial, orientationOffset):
+		return '\nO: %.2f+%.2f,\nE: %.2f,\nP: [%.2f, %.2f]' % (trial.orientation, orientationOffset, trial.eccentricity, *trial.stimPositionAngles)
+
+	def getExpectedLabel(self, whichDirection):
+		if whichDirection < 0:
+			return self.config['Input settings']['rotated_left_key_label']
+		else:
+			return self.config['Input settings']['rotated_right_key_label']
+
+	def prepareTrial(self, trial):
+		'''
+			Works out everything about a trial that doesn't depend on the responses before it
+		'''
+		trial.whichDirection = random.choice([-1, 1])
+		trial.stimSize = monitorTools.scaleSizeByEccentricity(self.config['Stimuli settings']['stimulus_size'], trial.eccentricity)
+		trial.stimPositions = [
+			(
+				numpy.cos(angle * numpy.pi/180.0) * trial.eccentricity,
+				numpy.sin(angle * numpy.pi/180.0) * trial.eccentricity,
+			) for angle in trial.stimPositionAngles
+		]
+
+	def prepareResponse(self, stepHandler, stimString, nextTrial=None):
+		'''
+			Runs at the start of the response window. Computes both staircase outcomes, and stages the HUD text for
+			either response and the next trial's stimulus, so the response only has to commit one prepared branch.
+
+			The keyboard is polled between steps, so keys pressed meanwhile are still timestamped as they arrive.
+		'''
+		self.clearStagedHUD()
+		nextLevels = stepHandler.prepareResponses()
+		self.keyboard.poll()
+
+		feedback = [
+			('lastStim', stimString, None),
+			('thisStim', '', None),
+			('lastResp', self.config['Input settings']['rotated_left_key_label'], None),
+			('lastResp', self.config['Input settings']['rotated_right_key_label'], None),
+			('lastOk', '✔', (-1, 1, -1)),
+			('lastOk', '✘', (1, -1, -1)),
+		]
+		for item, text, color in feedback:
+			self.stageHUD(item, text, color)
+			self.keyboard.poll()
+
+		if nextTrial is None:
+			return
+
+		self.prepareTrial(nextTrial)
+		nextStepHandler = self.stepHandlers[nextTrial.eccentricity][nextTrial.orientation]
+		if nextStepHandler is stepHandler:
+			# the next offset depends on this response
+			nextOffsets = set(nextLevels.values())
+		else:
+			nextOffsets = [nextStepHandler.next()]
+
+		self.stageHUD('progress', nextTrial.progressText)
+		self.stageHUD('expectedResp', self.getExpectedLabel(nextTrial.whichDirection))
+		for orientationOffset in nextOffsets:
+			self.keyboard.poll()
+			self.stageHUD('thisStim', self.getStimString(nextTrial, orientationOffset))
+
+	def runTrial(self, trial, stepHandler, nextTrial=None):
+		self.trial = trial
+		trialNumber = self.trialCount + 1
+		orientationOffset = stepHandler.next()
+
+		logging.info(f'Presenting eccentricity={trial.eccentricity}, orientation={trial.orientation}, stimAngleOffset={orientationOffset}')
+
+		# usually done during the previous trial's response window
+		if trial.stimPositions is None:
+			self.prepareTrial(trial)
+
+		whichDirection = trial.whichDirection
+		logging.info(f'Correct direction = {whichDirection}')
+
+		stimString = self.getStimString(trial, orientationOffset)
+
+		self.stim.ori = trial.orientation
+		self.stim.size = trial.stimSize
+
+		self.updateHUD('thisStim', stimString)
+		self.updateHUD('expectedResp', self.getExpectedLabel(whichDirection))
+
+		retries = -1
+		needToRetry = True
+		while retries < self.config['Gaze tracking']['retries'] and needToRetry:
+			retries += 1
+
+			if self.gazeTracker is not None and self.needsCalibration(retries):
+				with self.profiler.span('doCalibration'):
+					self.doCalibration()
+
+			if self.config['Input settings']['wait_for_ready_key']:
+				with self.profiler.span('waitForReadyKey'):
+					self.waitForReadyKey()
+
+			with self.profiler.span('draw'):
+				if self.config['Display settings']['show_fixation_aid']:
+					self.drawFixationAid()
+				else:
+					self.fixationStim.draw()
+
+				self.drawAnnuli(trial.eccentricity)
+			self.markerStream.markOnFlip(self.win, 'trial start', trialNumber)
+			self.flipBuffer()
+			with self.profiler.span('sleep'):
+				time.sleep(.5)
+
+			needToRetry = False
+
+			if self.config['Gaze tracking']['wait_for_fixation']:
+				with self.profiler.span('waitForFixation'):
+					fixated = self.waitForFixation()
+				if not fixated:
+					needToRetry = True
+					self.config['gazeTone'].play()
+					continue
+
+			self.keyboard.clear()
+			for i in range(2):
+				self.stim.pos = trial.stimPositions[i]
+
+				if i == 1 and self.config['Gaze tracking']['wait_for_fixation']:
+					gazePos = self.getGazePosition()
+					if gazePos is not None:
+						gazeAngle = math.sqrt(gazePos[0]**2 + gazePos[1]**2)
+
+						logging.info(f'Gaze pos: {gazePos}')
+						logging.info(f'Gaze angle: {gazeAngle}')
+						if gazeAngle > self.config['Gaze tracking']['gaze_offset_max']:
+							self.markerStream.mark('gaze break', trialNumber)
+							self.config['gazeTone'].play()
+							logging.info('Participant looked away!')
+							needToRetry = True
+							continue
+					else:
+						self.markerStream.mark('gaze break', trialNumber)
+						self.config['gazeTone'].play()
+						logging.info('Participant looked away!')
+						needToRetry = True
+						continue
+
+				if self.config['Gaze tracking']['render_at_gaze']:
+					gazePos = self.getGazePosition()
+					logging.info(f'Gaze pos: {gazePos}')
+					self.stim.pos = [
+						self.stim.pos[0] + gazePos[0],
+						self.stim.pos[1] + gazePos[1]
+					]
+
+				# First half of the stimulus
+				with self.profiler.span('draw'):
+					self.config['sitmulusTone'].play() # play the tone
+					self.drawFixationAid()
+					self.drawAnnuli(trial.eccentricity)
+					self.stim.draw()
+				self.markerStream.markOnFlip(self.win, 'stim1 onset' if i == 0 else 'stim2 onset', trialNumber)
+				onsetTime = self.flipBuffer() # reaction times are measured from the second stimulus' onset
+
+				with self.profiler.span('sleep'):
+					time.sleep(self.config['Stimuli settings']['stimulus_duration']/1000.0)
+
+				with self.profiler.span('applyMasks'):
+					self.applyMasks(trial.eccentricity)
+				with self.profiler.span('draw'):
+					self.drawFixationAid()
+					self.drawAnnuli(trial.eccentricity)
+				self.flipBuffer()
+
+				# Pause between stimuli in this pair
+				if i == 0:
+					self.stim.ori += orientationOffset * whichDirection
+					with self.profiler.span('sleep'):
+						time.sleep(self.config['Stimuli settings']['time_between_stimuli'] / 1000.0)     # pause between stimuli
+
+			with self.profiler.span('draw'):
+				if self.config['Display settings']['show_fixation_aid']:
+					self.drawFixationAid()
+				else:
+					self.fixationStim.draw()
+
+				self.drawAnnuli(trial.eccentricity)
+			self.flipBuffer()
+
+			if not needToRetry:
+				with self.profiler.span('prepareResponse'):
+					self.prepareResponse(stepHandler, stimString, nextTrial)
+				with self.profiler.span('checkResponse'):
+					correct, trial.reactionTime = self.checkResponse(whichDirection, onsetTime)
+				self.markerStream.mark('response', trialNumber, onsetTime + trial.reactionTime)
+				self.updateHUD('lastStim', stimString)
+				self.updateHUD('thisStim', '')
+
+				if correct:
+					logging.debug('Correct response')
+					self.updateHUD('lastOk', '✔', (-1, 1, -1))
+					self.config['positiveFeedback'].play()
+				else:
+					logging.debug('Incorrect response')
+					self.updateHUD('lastOk', '✘', (1, -1, -1))
+					self.config['negativeFeedback'].play()
+
+		if retries >= self.config['Gaze tracking']['retries']:
+			raise Exception('Max retries exceeded!')
+
+		self.flipBuffer()
+		logLine = f'E={trial.eccentricity},O={trial.orientation}+{orientationOffset},Correct={correct},RT={trial.reactionTime:.4f}'
+		logging.info(f'Response: {logLine}')
+		self.trialCount += 1
+		self.publisher.publish({
+			'type': 'trial',
+			'session': self.sessionName,
+			'trial': self.trialCount,
+			'eccentricity': trial.eccentricity,
+			'orientation': trial.orientation,
+			'offset': float(orientationOffset),
+			'correct': correct,
+			'rt': trial.reactionTime,
+		})
+		self.exporter.addTrial(self.trialCount, trial.eccentricity, trial.orientation, orientationOffset, whichDirection, correct, trial.reactionTime, onsetTime)
+		with self.profiler.span('markResponse'):
+			stepHandler.markResponse(correct)
+		if self.config['General settings']['practice']:
+			self.history.pop(0)
+			self.history.append(1 if correct else 0)
+
+	def applyMasks(self, eccentricity=None):
+		if self.config['Stimuli settings']['mask_time'] > 0:
+			self.drawFixationAid()
+			self.drawAnnuli(eccentricity)
+			if eccentricity is None:
+				eccentricities = self.annuli.keys()
+			else:
+				eccentricities = [eccentricity]
+
+			for ecc in eccentricities:
+				for mask in self.masks[ecc]:
+					mask.draw()
+
+			self.markerStream.markOnFlip(self.win, 'mask onset', self.trialCount + 1)
+			self.flipBuffer()
+			time.sleep(self.config['Stimuli settings']['mask_time']/1000)
+
+	def drawFixationAid(self):
+		if self.config['Display settings']['show_fixation_aid']:
+			[_.draw() for _ in self.fixationAid]
+
+	def drawAnnuli(self, eccentricity=None):
+		if self.config['Display settings']['show_annuli']:
+			if eccentricity is None:
+				eccentricities = self.annuli.keys()
+			else:
+				eccentricities = [eccentricity]
+
+			for eccentricity in eccentricities:
+				for circle in self.annuli[eccentricity]:
+					circle.draw()
+
+	def waitForReadyKey(self):
+		self.showMessage('Press [SPACEBAR] when ready.')
+
+	def waitForFixation(self, target=[0,0]):
+		logging.info(f'Waiting for fixation...')
+		distance = self.config['Gaze tracking']['gaze_offset_max'] + 1
+		startTime = time.time()
+		fixationStartTime = None
+
+		#self.fixationStim.autoDraw = True
+		fixated = None
+
+		while fixated is None:
+			currentTime = time.time()
+			pos = self.getGazePosition(correctDrift=False)
+			if pos is not None:
+				if self.driftEstimator is not None:
+					self.driftEstimator.addSample(pos, currentTime, target)
+					pos = self.driftEstimator.correct(pos)
+
+				self.gazeMarker.pos = pos
+				if self.config['Gaze tracking']['show_gaze']:
+					self.gazeMarker.draw()
+
+				self.drawFixationAid()
+				self.drawAnnuli(eccentricity=self.trial.eccentricity)
+				self.flipBuffer()
+
+				distance = math.sqrt((target[0]-pos[0])**2 + (target[1]-pos[1])**2)
+				if distance < self.config['Gaze tracking']['gaze_offset_max']:
+					if fixationStartTime is None:
+						fixationStartTime = currentTime
+					elif currentTime - fixationStartTime > self.config['Gaze tracking']['fixation_period']:
+						fixated = True
+				else:
+					fixationStartTime = None
+
+			if time.time() - startTime > self.config['Gaze tracking']['max_wait_time']:
+				fixated = False
+
+		#self.fixationStim.autoDraw = False
+		if self.driftEstimator is not None:
+			self.driftEstimator.endAttempt(fixated)
+			correction = self.driftEstimator.correction
+			logging.info(f'Drift correction: ({correction[0]:.2f}, {correction[1]:.2f}) deg, fixation dispersion {self.driftEstimator.getDispersion():.2f} deg')
+
+		return fixated
+
+	def getGazePosition(self, correctDrift=True):
+		pos = self.gazeTracker.getPosition()
+		if pos is None:
+			return
+
+		pos = PyPupilGazeTracker.PsychoPyVisuals.screenToMonitorCenterDeg(self.mon, pos)
+		if correctDrift and self.driftEstimator is not None:
+			pos = self.driftEstimator.correct(pos)
+
+		return pos
+
+	def start(self):
+		exitCode = 0
+
+		if self.config['Debug settings']['profile_with_cprofile']:
+			cProfiler = cProfile.Profile()
+			cProfiler.enable()
+		else:
+			cProfiler = None
+
+		try:
+			with self.profiler.span('runBlocks'):
+				passed = self.runBlocks()
+
+			if not passed:
+				logging.critical('Participant failed practice')
+				exitCode = 66
+		except UserExit as exc:
+			exitCode = 2
+			logging.info(exc)
+		except Exception as exc:
+			exitCode = 1
+
+			print('Exception: %s' % exc)
+			traceback.print_exc()
+			logging.critical(exc)
+			self.showMessage('Something went wrong!\n\nPlease let the research assistant know.\n\n%s' % exc, exceptionOnEsc=False)
+
+		if cProfiler is not None:
+			cProfiler.disable()
+			cProfiler.dump_stats(self.dataBasename + '.prof')
+			logging.info(f'Wrote cProfile stats to {self.dataBasename}.prof')
+
+		self.profiler.export(self.dataBasename)
+
+		self.keyboard.stop()
+		self.publisher.close()
+		self.markerStream.close()
+		self.exporter.close()
+
+		if self.gazeTracker is not None:
+			self.gazeTracker.stop()
+			self.calibrationWorker.stop()
+			self.cobreCommander.close()
+		else:
+			self.cobreCommander.openShutter()
+			self.cobreCommander.disconnectFromHost()
+
+		for stim in self.referenceCircles:
+			stim.autoDraw = False
+
+		self.showMessage('Good job - you are finished with this part of the study!\n\nPress the [SPACEBAR] to exit.', exceptionOnEsc=False)
+		self.win.close()
+		event.clearEvents()
+		core.quit(exitCode)
+
+def importGazeTracker():
+	global PyPupilGazeTracker
+	import PyPupilGazeTracker
+	import PyPupilGazeTracker.smoothing
+	import PyPupilGazeTracker.PsychoPyVisuals
+	import PyPupilGazeTracker.GazeTracker
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Orientation discrimination threshold estimation')
+	parser.add_argument('--preset', help=f'Run with {settings.PRESET_PATH}/PRESET.ini without showing the settings dialog')
+	parser.add_argument('--session-id', help='Overrides the session ID from the settings')
+	args = parser.parse_args(argv)
+
+	config = getConfig(args.preset, args.session_id)
+
+	if config['Gaze tracking']['wait_for_fixation'] or config['Gaze tracking']['render_at_gaze']:
+		importGazeTracker()
+
+	tester = OrientationDiscriminationTester(config)
+	tester.start()
+
+if __name__ == '__main__':
+	main()
\ No newline at end of file
@@ -0,0 +1,272 @@
+'''
+	Streams trial and threshold records from each testing station to a central aggregator
+
+	Stations publish through ResultsPublisher, which never blocks the caller: records are batched on a
+	worker thread and sent over a persistent TCP connection. If the aggregator can't be reached, batches
+	are spooled to disk and sent once the connection is back (in this or a later session).
+
+	Protocol: one JSON object per line, {"station": ..., "records": [...]}, acknowledged with "ok".
+
+	Usage (aggregator):
+		python aggregator.py --host 0.0.0.0 --port 5757 --db aggregate.sqlite
+'''
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+
+import results
+
+DEFAULT_PORT = 5757
+
+def parseAddress(address):
+	host, _, port = address.rpartition(':')
+	if not host:
+		return port, DEFAULT_PORT
+	return host, int(port)
+
+class NullPublisher():
+	def publish(self, record):
+		pass
+
+	def close(self, timeout=None):
+		pass
+
+class ResultsPublisher():
+	def __init__(self, address, station, spoolFilename, batchSize=50, flushInterval=.5, connectTimeout=2, maxQueued=100000):
+		'''
+			Args:
+				address (str): host:port of the aggregator
+				station (str): name identifying this station
+				spoolFilename (str): where unsent batches are kept (JSON lines)
+				batchSize (int): most records sent in one batch
+				flushInterval (float): seconds to wait for more records before sending a partial batch
+				connectTimeout (float): socket timeout for connecting and waiting for acknowledgements
+				maxQueued (int): records beyond this are dropped rather than growing the queue without bound
+		'''
+		self.address = parseAddress(address)
+		self.station = station
+		self.spoolFilename = spoolFilename
+		self.batchSize = batchSize
+		self.flushInterval = flushInterval
+		self.connectTimeout = connectTimeout
+
+		self.records = queue.Queue(maxQueued)
+		self.dropped = 0
+		self.connection = None
+		self.connectionFile = None
+		self.spoolLock = threading.Lock()
+		self.nextConnectTime = 0
+		self.retryDelay = flushInterval
+
+		self.thread = threading.Thread(target=self.run, name='ResultsPublisher', daemon=True)
+		self.thread.start()
+
+	def publish(self, record):
+		'''
+			Queues a record for sending. Never blocks.
+		'''
+		# stamped now, since spooled records may be sent by a later session with another station name
+		record = dict(record, station=self.station)
+		try:
+			self.records.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
+
+	def getBatch(self):
+		'''
+			Waits up to flushInterval for records
+
+			Returns:
+				tuple: (records, True if close() was called)
+		'''
+		batch = []
+		deadline = time.monotonic() + self.flushInterval
+		while len(batch) < self.batchSize:
+			try:
+				record = self.records.get(timeout=max(0, deadline - time.monotonic()))
+			except queue.Empty:
+				break
+
+			if record is None:
+				return batch, True
+			batch.append(record)
+
+		return batch, False
+
+	def connect(self):
+		if self.connection is not None:
+			return True
+
+		if time.monotonic() < self.nextConnectTime:
+			return False
+
+		try:
+			self.connection = socket.create_connection(self.address, timeout=self.connectTimeout)
+			self.connectionFile = self.connection.makefile('rwb')
+			self.retryDelay = self.flushInterval
+			logging.info(f'Connected to aggregator at {self.address[0]}:{self.address[1]}')
+			return True
+		except OSError as exc:
+			# back off up to 30s between attempts
+			self.nextConnectTime = time.monotonic() + self.retryDelay
+			self.retryDelay = min(30, self.retryDelay * 2)
+			logging.debug(f'Aggregator unavailable: {exc}')
+			return False
+
+	def disconnect(self):
+		# the file from makefile() holds its own reference to the socket, so both are closed
+		for stream in (self.connectionFile, self.connection):
+			try:
+				stream.close()
+			except OSError:
+				pass
+		self.connectionFile = None
+		self.connection = None
+
+	def send(self, records):
+		'''
+			Returns:
+				bool: True if the aggregator acknowledged the batch
+		'''
+		if not self.connect():
+			return False
+
+		try:
+			self.connectionFile.write(json.dumps({'station': self.station, 'records': records}).encode('utf-8') + b'\n')
+			self.connectionFile.flush()
+			if self.connectionFile.readline().strip() == b'ok':
+				return True
+		except OSError as exc:
+			logging.warning(f'Lost connection to aggregator: {exc}')
+
+		self.disconnect()
+		return False
+
+	def spool(self, records):
+		with self.spoolLock, open(self.spoolFilename, 'a') as spoolFile:
+			for record in records:
+				spoolFile.write(json.dumps(record) + '\n')
+
+	def sendSpooled(self):
+		'''
+			Sends previously spooled records, keeping any that still fail
+		'''
+		if not os.path.exists(self.spoolFilename) or not self.connect():
+			return
+
+		with self.spoolLock:
+			with open(self.spoolFilename) as spoolFile:
+				spooled = [json.loads(line) for line in spoolFile if line.strip()]
+			os.remove(self.spoolFilename)
+
+		for start in range(0, len(spooled), self.batchSize):
+			if not self.send(spooled[start:start+self.batchSize]):
+				self.spool(spooled[start:])
+				return
+
+		logging.info(f'Sent {len(spooled)} spooled records to the aggregator')
+
+	def run(self):
+		closing = False
+		while not closing:
+			batch, closing = self.getBatch()
+
+			self.sendSpooled()
+			if batch and not self.send(batch):
+				self.spool(batch)
+
+		if self.connection is not None:
+			self.disconnect()
+
+	def drain(self):
+		'''
+			Returns:
+				list: every record still queued
+		'''
+		records = []
+		while True:
+			try:
+				record = self.records.get_nowait()
+			except queue.Empty:
+				return records
+
+			if record is not None:
+				records.append(record)
+
+	def close(self, timeout=5):
+		'''
+			Sends (or spools) everything queued so far and stops the worker
+		'''
+		try:
+			self.records.put(None, timeout=timeout)
+		except queue.Full:
+			# the worker isn't keeping up, so what's still queued is left for a later session to send
+			logging.warning('Aggregator publish queue is full, spooling the remaining records')
+			self.spool(self.drain())
+			self.records.put_nowait(None)
+
+		self.thread.join(timeout)
+		if self.dropped:
+			logging.warning(f'Dropped {self.dropped} records because the publish queue was full')
+
+def getPublisher(address, station, spoolFilename):
+	if address:
+		return ResultsPublisher(address, station, spoolFilename)
+	else:
+		return NullPublisher()
+
+class AggregatorHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			try:
+				batch = json.loads(line)
+				with self.server.lock:
+					self.server.store.addRecords(batch['station'], batch['records'])
+			except Exception as exc:
+				logging.error(f'Rejected batch from {self.client_address}: {exc}')
+				return
+
+			self.wfile.write(b'ok\n')
+			self.wfile.flush()
+
+class AggregatorServer(socketserver.ThreadingTCPServer):
+	'''
+		Receives batches from every station and writes them to a single ResultsStore
+	'''
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address=('127.0.0.1', DEFAULT_PORT), storeFilename='aggregate.sqlite'):
+		super().__init__(address, AggregatorHandler)
+		self.store = results.ResultsStore(storeFilename)
+		self.lock = threading.Lock()
+
+	def server_close(self):
+		super().server_close()
+		self.store.close()
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Collects trial and threshold records from testing stations')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+	parser.add_argument('--db', default='aggregate.sqlite', help='Results database to write to')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+	server = AggregatorServer((args.host, args.port), args.db)
+	logging.info(f'Aggregating into {args.db} on {args.host}:{args.port}')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+if __name__ == '__main__':
+	main()
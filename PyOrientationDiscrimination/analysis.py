@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import glob
+import argparse
+
+import numpy
+
+import BestPest
+
+RESPONSE_PATTERN = re.compile(r'Response: E=([^,]+),O=([^+]+)\+([^,]+),Correct=(True|False)(?:,RT=([^\s,]+))?')
+SETTINGS_PATTERN = re.compile(r'Settings: (\{.*\})')
+
+DEFAULT_PRECISION = 0.5
+DEFAULT_MAX_ANGLE = 10
+
+def getStimulusLevels(precision, maxAngle):
+	# same grid as OrientationDiscriminationTester.setupStepHandler
+	return numpy.arange(precision, maxAngle + precision, precision)
+
+def parseLog(filename):
+	"""
+		Extracts the per-trial responses (and the settings, if logged) from a session log
+
+		Returns:
+			dict: settings (dict or None) and float arrays eccentricity, orientation, offset, correct, rt (nan when not logged)
+	"""
+	with open(filename, encoding='utf-8', errors='replace') as logFile:
+		text = logFile.read()
+
+	settingsMatch = SETTINGS_PATTERN.search(text)
+	settings = json.loads(settingsMatch.group(1)) if settingsMatch is not None else None
+
+	rows = numpy.array(RESPONSE_PATTERN.findall(text), dtype=str).reshape(-1, 5)
+	correct = (rows[:, 3] == 'True')
+	rows[rows == ''] = 'nan'
+	eccentricity, orientation, offset, rt = rows[:, [0, 1, 2, 4]].T.astype(float)
+
+	return {
+		'settings': settings,
+		'eccentricity': eccentricity,
+		'orientation': orientation,
+		'offset': offset,
+		'correct': correct,
+		'rt': rt,
+	}
+
+def getGridSettings(session, precision=None, maxAngle=None):
+	"""
+		Returns the stimulus grid a session was run with, preferring explicit arguments over the logged settings
+	"""
+	logged = (session['settings'] or {}).get('Stimuli settings', {})
+	if precision is None:
+		precision = logged.get('stimulus_angle_precision', DEFAULT_PRECISION)
+	if maxAngle is None:
+		maxAngle = logged.get('max_stimulus_angle', DEFAULT_MAX_ANGLE)
+
+	return precision, maxAngle
+
+def groupConditions(session, precision, maxAngle):
+	"""
+		Splits a session's trials by condition into padded (condition, trial) arrays
+
+		Returns:
+			tuple: (conditions, stimIndices, responses, trialCounts). stimIndices is -1 after a condition's last trial.
+	"""
+	levels = getStimulusLevels(precision, maxAngle)
+	stimIndices = numpy.rint((session['offset'] - levels[0]) / precision).astype(int)
+	stimIndices = numpy.clip(stimIndices, 0, len(levels)-1)
+
+	keys = numpy.stack([session['eccentricity'], session['orientation']], axis=1)
+	conditions, conditionIds = numpy.unique(keys, axis=0, return_inverse=True)
+	conditionIds = conditionIds.reshape(-1)
+
+	# position of each trial within its condition
+	order = numpy.argsort(conditionIds, kind='stable')
+	trialCounts = numpy.bincount(conditionIds, minlength=len(conditions))
+	starts = numpy.concatenate([[0], numpy.cumsum(trialCounts)[:-1]])
+	positions = numpy.empty(len(order), dtype=int)
+	positions[order] = numpy.arange(len(order)) - numpy.repeat(starts, trialCounts)
+
+	shape = (len(conditions), trialCounts.max() if len(trialCounts) else 0)
+	paddedIndices = numpy.full(shape, -1)
+	paddedResponses = numpy.zeros(shape, dtype=bool)
+	paddedIndices[conditionIds, positions] = stimIndices
+	paddedResponses[conditionIds, positions] = session['correct']
+
+	return conditions, paddedIndices, paddedResponses, trialCounts
+
+def analyzeSession(session, precision=None, maxAngle=None, resamples=0, confidenceLevel=.95):
+	"""
+		Replays every condition of a session through the Best PEST posterior
+
+		Args:
+			resamples (int): If positive, also bootstrap each condition's final threshold with this many resamples
+			confidenceLevel (float): Width of the bootstrapped interval
+
+		Returns:
+			dict: conditions (n, 2) [eccentricity, orientation], trials (n,), (n, maxTrials) threshold and confidence traces
+				holding the estimate after each trial (nan past a condition's last trial), and (n, 2) intervals
+	"""
+	precision, maxAngle = getGridSettings(session, precision, maxAngle)
+	levels = getStimulusLevels(precision, maxAngle)
+
+	conditions, stimIndices, responses, trialCounts = groupConditions(session, precision, maxAngle)
+	logProbs = BestPest.replayResponses(len(levels), stimIndices, responses)
+	bestIndices = BestPest.getBestIndices(logProbs)
+
+	padding = stimIndices < 0
+	thresholds = levels[bestIndices]
+	thresholds[padding] = numpy.nan
+	confidence = BestPest.getConfidences(logProbs, bestIndices)
+	confidence[padding] = numpy.nan
+
+	if resamples > 0:
+		intervals = BestPest.bootstrapIntervals(levels, stimIndices, responses, resamples, confidenceLevel)
+	else:
+		intervals = numpy.full((len(conditions), 2), numpy.nan)
+
+	return {
+		'conditions': conditions,
+		'trials': trialCounts,
+		'thresholds': thresholds,
+		'confidence': confidence,
+		'intervals': intervals,
+	}
+
+def iterSessions(dataPath):
+	"""
+		Streams the session logs in dataPath one at a time
+
+		Yields:
+			tuple: (session name, parsed log)
+	"""
+	for filename in sorted(glob.glob(os.path.join(dataPath, '*.log'))):
+		yield os.path.splitext(os.path.basename(filename))[0], parseLog(filename)
+
+def analyzeDirectory(dataPath, precision=None, maxAngle=None, resamples=0, confidenceLevel=.95):
+	"""
+		Analyzes every session log in dataPath
+
+		Returns:
+			dict: one row per (session, condition): session, eccentricity, orientation, trials, (rows, maxTrials) thresholds/confidence traces,
+				and (rows, 2) intervals
+	"""
+	sessionNames = []
+	results = []
+	for name, session in iterSessions(dataPath):
+		if len(session['offset']) == 0:
+			continue
+		sessionNames.append(name)
+		results.append(analyzeSession(session, precision, maxAngle, resamples, confidenceLevel))
+
+	if len(results) == 0:
+		maxTrials = 0
+	else:
+		maxTrials = max(result['thresholds'].shape[1] for result in results)
+
+	def pad(traces):
+		padded = numpy.full((len(traces), maxTrials), numpy.nan)
+		padded[:, :traces.shape[1]] = traces
+		return padded
+
+	rows = {'session': [], 'eccentricity': [], 'orientation': [], 'trials': [], 'thresholds': [], 'confidence': [], 'intervals': []}
+	for name, result in zip(sessionNames, results):
+		rows['session'] += [name] * len(result['conditions'])
+		rows['eccentricity'].append(result['conditions'][:, 0])
+		rows['orientation'].append(result['conditions'][:, 1])
+		rows['trials'].append(result['trials'])
+		rows['thresholds'].append(pad(result['thresholds']))
+		rows['confidence'].append(pad(result['confidence']))
+		rows['intervals'].append(result['intervals'])
+
+	output = {'session': numpy.array(rows['session'], dtype=str)}
+	for key in ['eccentricity', 'orientation', 'trials', 'thresholds', 'confidence', 'intervals']:
+		output[key] = numpy.concatenate(rows[key]) if rows[key] else numpy.zeros(0)
+
+	return output
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Re-derives per-trial threshold and confidence traces from session logs')
+	parser.add_argument('data_path', nargs='?', default='data', help='Directory containing the session .log files')
+	parser.add_argument('-o', '--output', default='traces.npz', help='Where to save the traces')
+	parser.add_argument('--precision', type=float, default=None, help='Stimulus angle precision (defaults to the logged setting, then 0.5)')
+	parser.add_argument('--max-angle', type=float, default=None, help='Max stimulus angle (defaults to the logged setting, then 10)')
+	parser.add_argument('--bootstrap', type=int, default=0, metavar='RESAMPLES', help='Bootstrap confidence intervals for each final threshold')
+	parser.add_argument('--confidence-level', type=float, default=.95)
+	args = parser.parse_args(argv)
+
+	output = analyzeDirectory(args.data_path, args.precision, args.max_angle, args.bootstrap, args.confidence_level)
+	numpy.savez(args.output, **output)
+
+	print(f'{len(set(output["session"]))} sessions, {len(output["session"])} conditions -> {args.output}')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,79 @@
+import os, sys
+import runpy
+import logging
+import subprocess
+
+class CalibrationWorker():
+	"""
+		Keeps a Python process running with the calibration program's dependencies already imported,
+		so starting a calibration doesn't pay for interpreter startup and imports. Each worker runs
+		one calibration; a replacement is spawned as soon as it finishes.
+	"""
+	def __init__(self, module='PyPupilGazeTracker.AccuracyChecker', preload=('psychopy.visual', 'PyPupilGazeTracker.GazeTracker')):
+		"""
+			Args:
+				module (str): The module to run as __main__ when a calibration is requested
+				preload (list): Modules to import while the worker waits
+		"""
+		self.module = module
+		self.preload = list(preload)
+		self.process = None
+
+	def spawn(self):
+		self.process = subprocess.Popen(
+			[sys.executable, os.path.realpath(__file__), self.module, *self.preload],
+			stdin=subprocess.PIPE,
+			universal_newlines=True,
+		)
+		logging.debug(f'Spawned calibration worker (pid={self.process.pid})')
+
+	def run(self, timeout=None):
+		"""
+			Runs the calibration program in the warm worker and waits for it to finish
+
+			Returns:
+				int: the calibration program's exit code
+		"""
+		if self.process is None or self.process.poll() is not None:
+			self.spawn()
+
+		self.process.stdin.write('run\n')
+		self.process.stdin.flush()
+		exitCode = self.process.wait(timeout)
+		logging.info(f'Calibration worker exited with {exitCode}')
+
+		self.spawn()
+
+		return exitCode
+
+	def stop(self, timeout=5):
+		if self.process is None or self.process.poll() is not None:
+			return
+
+		self.process.stdin.close()
+		try:
+			self.process.wait(timeout)
+		except subprocess.TimeoutExpired:
+			self.process.kill()
+
+def _workerMain(module, preload):
+	for name in preload:
+		try:
+			__import__(name)
+		except Exception as exc:
+			print(f'Calibration worker could not preload {name}: {exc}', file=sys.stderr)
+
+	if sys.stdin.readline().strip() != 'run':
+		return 0
+
+	# hide the worker's own arguments from the calibration program
+	sys.argv = [module]
+	try:
+		runpy.run_module(module, run_name='__main__', alter_sys=True)
+	except SystemExit as exc:
+		return exc.code
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(_workerMain(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,141 @@
+'''
+	Estimates gaze tracker drift from the participant's fixations, so small systematic errors can be corrected
+	without recalibrating
+
+	While the participant is asked to fixate, gaze samples are grouped into stable clusters (samples spanning a
+	fixation period with little dispersion). Each cluster near the target is taken as a confirmed fixation, and
+	its offset from the target is folded into running statistics. A consistent offset is corrected for. A full
+	calibration is only asked for when correction can't explain the error: the offsets are too large or too
+	scattered, or fixations keep failing without any stable cluster to learn from.
+'''
+import math
+import logging
+import collections
+
+class DriftEstimator():
+	def __init__(self, fixationPeriod=.3, clusterDispersion=.5, captureRadius=3, maxCorrection=2, maxDispersion=.5, minFixations=3, smoothing=.2, maxUnexplainedFailures=3):
+		'''
+			Args:
+				fixationPeriod (float): seconds of samples that make up a fixation
+				clusterDispersion (float): largest RMS distance (deg) of a fixation's samples from their centroid
+				captureRadius (float): fixations further than this (deg) from the target aren't taken to be on it
+				maxCorrection (float): largest offset (deg) corrected for rather than recalibrating
+				maxDispersion (float): largest spread (deg) of fixation offsets that a single correction can explain
+				minFixations (int): fixations needed before correcting or judging dispersion
+				smoothing (float): weight of each new fixation once minFixations have been seen, so slow drift is tracked
+				maxUnexplainedFailures (int): failed fixation attempts without a stable cluster before recalibrating
+		'''
+		self.fixationPeriod = fixationPeriod
+		self.clusterDispersion = clusterDispersion
+		self.captureRadius = captureRadius
+		self.maxCorrection = maxCorrection
+		self.maxDispersion = maxDispersion
+		self.minFixations = minFixations
+		self.smoothing = smoothing
+		self.maxUnexplainedFailures = maxUnexplainedFailures
+
+		self.samples = collections.deque()
+		self.reset()
+
+	def reset(self):
+		'''
+			Forgets everything learned, e.g. after a calibration
+		'''
+		self.samples.clear()
+		self.fixations = 0
+		self.mean = [0.0, 0.0]
+		self.variance = 0.0
+		self.correction = (0.0, 0.0)
+		self.clustersThisAttempt = 0
+		self.unexplainedFailures = 0
+
+	def addSample(self, pos, timestamp, target=(0, 0)):
+		'''
+			Adds an uncorrected gaze sample taken while the participant was asked to fixate target
+
+			Returns:
+				bool: True if the sample completed a fixation
+		'''
+		self.samples.append((timestamp, pos[0] - target[0], pos[1] - target[1]))
+		if timestamp - self.samples[0][0] < self.fixationPeriod:
+			return False
+
+		count = len(self.samples)
+		x = sum(sample[1] for sample in self.samples) / count
+		y = sum(sample[2] for sample in self.samples) / count
+		dispersion = math.sqrt(sum((sample[1] - x)**2 + (sample[2] - y)**2 for sample in self.samples) / count)
+
+		if dispersion > self.clusterDispersion or math.hypot(x, y) > self.captureRadius:
+			self.samples.popleft()
+			return False
+
+		self.samples.clear()
+		self.addFixation(x, y)
+		return True
+
+	def addFixation(self, x, y):
+		'''
+			Folds a fixation's offset from the target into the running mean and dispersion
+		'''
+		self.fixations += 1
+		self.clustersThisAttempt += 1
+
+		# a plain running mean until there are enough fixations, exponentially weighted after that
+		weight = max(1 / self.fixations, self.smoothing)
+		dx = x - self.mean[0]
+		dy = y - self.mean[1]
+		self.mean[0] += weight * dx
+		self.mean[1] += weight * dy
+		self.variance = (1 - weight) * (self.variance + weight * (dx**2 + dy**2))
+
+		if self.fixations >= self.minFixations:
+			# only correct offsets that stand out from the scatter of the fixations
+			effectiveCount = min(self.fixations, 1 / self.smoothing)
+			standardError = math.sqrt(self.variance / effectiveCount)
+			if math.hypot(*self.mean) > 2 * standardError and math.hypot(*self.mean) <= self.maxCorrection:
+				self.correction = tuple(self.mean)
+			else:
+				self.correction = (0.0, 0.0)
+
+	def correct(self, pos):
+		'''
+			Returns:
+				list: the gaze position with the estimated drift removed
+		'''
+		return [pos[0] - self.correction[0], pos[1] - self.correction[1]]
+
+	def endAttempt(self, fixated):
+		'''
+			Records the outcome of an attempt to get the participant to fixate
+		'''
+		if fixated or self.clustersThisAttempt > 0:
+			self.unexplainedFailures = 0
+		else:
+			self.unexplainedFailures += 1
+
+		self.clustersThisAttempt = 0
+		self.samples.clear()
+
+	def getDispersion(self):
+		return math.sqrt(self.variance)
+
+	def needsCalibration(self):
+		'''
+			Returns:
+				bool: True if correcting for drift can't explain the gaze error
+		'''
+		if self.unexplainedFailures >= self.maxUnexplainedFailures:
+			logging.info(f'Calibration needed: {self.unexplainedFailures} failed fixations without a stable gaze cluster')
+			return True
+
+		if self.fixations >= self.minFixations:
+			offset = math.hypot(*self.mean)
+			if offset > self.maxCorrection:
+				logging.info(f'Calibration needed: gaze offset {offset:.2f} deg is beyond drift correction')
+				return True
+
+			if self.getDispersion() > self.maxDispersion:
+				logging.info(f'Calibration needed: fixation offsets are scattered by {self.getDispersion():.2f} deg')
+				return True
+
+		return False
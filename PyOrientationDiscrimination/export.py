@@ -0,0 +1,324 @@
+'''
+	Typed columnar export of each session, so downstream analysis doesn't have to parse text
+
+	Alongside the data file, each session keeps one .npy file per table, each holding a structured array
+	with a fixed dtype:
+		<data filename>.trials.npy      one row per trial (TRIAL_DTYPE)
+		<data filename>.thresholds.npy  one row per condition per block (THRESHOLD_DTYPE)
+		<data filename>.posteriors.npy  the condition's posterior over every stimulus level, alongside each threshold
+
+	Rows are appended as a row group when each block completes. The row count in the header is only
+	updated after the rows are written, so an interrupted session leaves every completed block readable.
+	ColumnLoader memory-maps the tables of many sessions and only reads the columns asked for.
+
+	Usage:
+		python export.py load data --table trials --columns eccentricity offset correct -o trials.npz
+		python export.py backfill data    # exports sessions recorded before this, from their logs and data files
+'''
+import io
+import os
+import csv
+import glob
+import argparse
+
+import numpy
+
+import analysis, results
+
+TABLES = ('trials', 'thresholds', 'posteriors')
+
+TRIAL_DTYPE = numpy.dtype([
+	('trial', numpy.int32),
+	('block', numpy.int16),        # -1 if backfilled from a log
+	('eccentricity', numpy.float64),
+	('orientation', numpy.float64),
+	('offset', numpy.float64),
+	('direction', numpy.int8),     # -1 left, 1 right, 0 unknown
+	('correct', numpy.bool_),
+	('rt', numpy.float64),
+	('onset', numpy.float64),      # core.getTime() of the second stimulus
+])
+
+THRESHOLD_DTYPE = numpy.dtype([
+	('block', numpy.int16),
+	('eccentricity', numpy.float64),
+	('orientation', numpy.float64),
+	('trials', numpy.int32),
+	('threshold', numpy.float64),
+	('ci_low', numpy.float64),
+	('ci_high', numpy.float64),
+])
+
+def getPosteriorDtype(levelCount):
+	'''
+		Returns:
+			numpy.dtype: posterior snapshot rows for a grid of levelCount stimulus levels (min_level + i * precision)
+	'''
+	return numpy.dtype([
+		('block', numpy.int16),
+		('eccentricity', numpy.float64),
+		('orientation', numpy.float64),
+		('trials', numpy.int32),
+		('min_level', numpy.float64),
+		('precision', numpy.float64),
+		('probabilities', numpy.float64, (levelCount,)),
+	])
+
+HEADER_READERS = {(1, 0): numpy.lib.format.read_array_header_1_0, (2, 0): numpy.lib.format.read_array_header_2_0}
+HEADER_WRITERS = {(1, 0): numpy.lib.format.write_array_header_1_0, (2, 0): numpy.lib.format.write_array_header_2_0}
+
+def getTableFilename(basename, table):
+	return f'{basename}.{table}.npy'
+
+def saveTable(filename, rows):
+	temporaryFilename = filename + '.tmp'
+	with open(temporaryFilename, 'wb') as tableFile:
+		numpy.save(tableFile, rows)
+	os.replace(temporaryFilename, filename)
+
+def appendRows(filename, rows):
+	'''
+		Appends a row group to a table, creating it if needed
+
+		Args:
+			filename (str): .npy file holding a 1-D structured array
+			rows (numpy.array): rows with the same dtype as the table
+	'''
+	rows = numpy.ascontiguousarray(rows)
+	if not os.path.exists(filename):
+		saveTable(filename, rows)
+		return
+
+	with open(filename, 'r+b') as tableFile:
+		version = numpy.lib.format.read_magic(tableFile)
+		shape, fortranOrder, dtype = HEADER_READERS[version](tableFile)
+		headerLength = tableFile.tell()
+		if dtype != rows.dtype:
+			raise ValueError(f'{filename} holds {dtype}, not {rows.dtype}')
+
+		header = io.BytesIO()
+		HEADER_WRITERS[version](header, {'descr': numpy.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (shape[0] + len(rows),)})
+
+		# numpy pads the header so the row count can grow in place; rows from an interrupted append are overwritten
+		if len(header.getvalue()) == headerLength:
+			tableFile.seek(headerLength + shape[0] * dtype.itemsize)
+			tableFile.write(rows.tobytes())
+			tableFile.truncate()
+			tableFile.flush()
+			tableFile.seek(0)
+			tableFile.write(header.getvalue())
+			return
+
+		existing = numpy.frombuffer(tableFile.read(shape[0] * dtype.itemsize), dtype=dtype)
+
+	# older versions of numpy don't leave room to grow, so the table is rewritten
+	saveTable(filename, numpy.concatenate([existing, rows]))
+
+class NullExporter():
+	def addTrial(self, trial, eccentricity, orientation, offset, direction, correct, rt, onset):
+		pass
+
+	def addCondition(self, eccentricity, orientation, stepHandler, threshold, interval):
+		pass
+
+	def flush(self):
+		pass
+
+	def close(self):
+		pass
+
+class SessionExporter():
+	def __init__(self, basename):
+		'''
+			Args:
+				basename (str): data filename without the extension; tables are written next to it
+		'''
+		self.basename = basename
+		self.block = 0
+		self.trials = []
+		self.thresholds = []
+		self.posteriors = []
+
+	def addTrial(self, trial, eccentricity, orientation, offset, direction, correct, rt, onset):
+		self.trials.append((trial, self.block, eccentricity, orientation, offset, direction, correct, rt, onset))
+
+	def addCondition(self, eccentricity, orientation, stepHandler, threshold, interval):
+		'''
+			Records a condition's threshold and a snapshot of its posterior over every stimulus level
+		'''
+		trials = len(stepHandler.responses)
+		levels = stepHandler.stimulusLevels
+		precision = levels[1] - levels[0] if len(levels) > 1 else 0
+
+		self.thresholds.append((self.block, eccentricity, orientation, trials, threshold, interval[0], interval[1]))
+		self.posteriors.append((self.block, eccentricity, orientation, trials, levels[0], precision, stepHandler.getNormalizedProbabilities()))
+
+	def flush(self):
+		'''
+			Appends everything recorded since the last flush as one row group per table, and starts the next block
+		'''
+		if self.trials:
+			appendRows(getTableFilename(self.basename, 'trials'), numpy.array(self.trials, dtype=TRIAL_DTYPE))
+		if self.thresholds:
+			appendRows(getTableFilename(self.basename, 'thresholds'), numpy.array(self.thresholds, dtype=THRESHOLD_DTYPE))
+		if self.posteriors:
+			posteriorDtype = getPosteriorDtype(len(self.posteriors[0][-1]))
+			appendRows(getTableFilename(self.basename, 'posteriors'), numpy.array(self.posteriors, dtype=posteriorDtype))
+
+		self.block += 1
+		self.trials = []
+		self.thresholds = []
+		self.posteriors = []
+
+	def close(self):
+		'''
+			Writes the trials of an unfinished block
+		'''
+		if self.trials or self.thresholds:
+			self.flush()
+
+def getExporter(enabled, basename):
+	if enabled:
+		return SessionExporter(basename)
+	else:
+		return NullExporter()
+
+class ColumnLoader():
+	'''
+		Memory-maps one table from every session in a directory. Each column is concatenated across sessions
+		the first time it's asked for, so only the columns used are read.
+
+		The session column holds each row's index into sessions.
+	'''
+	def __init__(self, dataPath, table='trials'):
+		if table not in TABLES:
+			raise ValueError(f'Unknown table {table}, expected one of {TABLES}')
+
+		suffix = f'.{table}.npy'
+		filenames = sorted(glob.glob(os.path.join(dataPath, '*' + suffix)))
+
+		self.table = table
+		self.sessions = numpy.array([os.path.basename(filename)[:-len(suffix)] for filename in filenames], dtype=str)
+		self.tables = [numpy.load(filename, mmap_mode='r') for filename in filenames]
+		self.columns = {}
+
+		if self.tables:
+			self.dtype = self.tables[0].dtype
+		elif table == 'trials':
+			self.dtype = TRIAL_DTYPE
+		elif table == 'thresholds':
+			self.dtype = THRESHOLD_DTYPE
+		else:
+			self.dtype = getPosteriorDtype(0)
+
+	def __len__(self):
+		return sum(len(rows) for rows in self.tables)
+
+	def keys(self):
+		return ['session'] + list(self.dtype.names)
+
+	def __getitem__(self, column):
+		if column not in self.columns:
+			if column == 'session':
+				self.columns[column] = numpy.repeat(numpy.arange(len(self.tables)), [len(rows) for rows in self.tables])
+			elif column not in self.dtype.names:
+				raise KeyError(column)
+			elif not self.tables:
+				self.columns[column] = numpy.zeros((0,) + self.dtype[column].shape, dtype=self.dtype[column].base)
+			else:
+				shapes = set(rows.dtype[column].shape for rows in self.tables)
+				if len(shapes) > 1:
+					raise ValueError(f'Sessions in {self.table} have different {column} shapes {sorted(shapes)} (different stimulus grids)')
+				self.columns[column] = numpy.concatenate([rows[column] for rows in self.tables])
+
+		return self.columns[column]
+
+	def load(self, columns=None):
+		'''
+			Returns:
+				dict: the requested columns (every column if omitted), plus session and sessions
+		'''
+		columns = self.keys() if columns is None else ['session'] + [column for column in columns if column != 'session']
+		output = {column: self[column] for column in columns}
+		output['sessions'] = self.sessions
+
+		return output
+
+def backfillSession(basename):
+	'''
+		Exports a session recorded without the columnar export from its log and data file. Block numbers,
+		directions, onsets and posteriors weren't recorded, so they're -1, 0, nan and left out.
+
+		Returns:
+			bool: True if anything was exported
+	'''
+	exported = False
+	logFilename = basename + '.log'
+	trialsFilename = getTableFilename(basename, 'trials')
+	if os.path.exists(logFilename) and not os.path.exists(trialsFilename):
+		session = analysis.parseLog(logFilename)
+		rows = numpy.zeros(len(session['offset']), dtype=TRIAL_DTYPE)
+		rows['trial'] = numpy.arange(1, len(rows) + 1)
+		rows['block'] = -1
+		for column in ['eccentricity', 'orientation', 'offset', 'correct', 'rt']:
+			rows[column] = session[column]
+		rows['onset'] = numpy.nan
+
+		if len(rows) > 0:
+			saveTable(trialsFilename, rows)
+			exported = True
+
+	csvFilename = basename + '.csv'
+	thresholdsFilename = getTableFilename(basename, 'thresholds')
+	if os.path.exists(csvFilename) and not os.path.exists(thresholdsFilename) and results.isThresholdFile(csvFilename):
+		with open(csvFilename, newline='') as dataFile:
+			rows = numpy.array([
+				(
+					-1, float(row['Eccentricity']), float(row['Orientation']), -1, float(row['Threshold']),
+					float(row.get('CI low') or 'nan'), float(row.get('CI high') or 'nan')
+				)
+				for row in csv.DictReader(dataFile)
+			], dtype=THRESHOLD_DTYPE)
+
+		if len(rows) > 0:
+			saveTable(thresholdsFilename, rows)
+			exported = True
+
+	return exported
+
+def backfill(dataPath):
+	'''
+		Returns:
+			int: number of sessions exported
+	'''
+	# other CSVs in the data path (e.g. the profiler's .phases.csv) aren't sessions
+	basenames = set(os.path.splitext(filename)[0] for filename in glob.glob(os.path.join(dataPath, '*.log')))
+	basenames.update(os.path.splitext(filename)[0] for filename in glob.glob(os.path.join(dataPath, '*.csv')) if results.isThresholdFile(filename))
+	return sum(backfillSession(basename) for basename in sorted(basenames))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Loads the columnar session exports, or backfills them for older sessions')
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	loadParser = commands.add_parser('load', help='Concatenate columns from every session')
+	loadParser.add_argument('data_path', nargs='?', default='data')
+	loadParser.add_argument('--table', choices=TABLES, default='trials')
+	loadParser.add_argument('--columns', nargs='+', help='Columns to load (default: all)')
+	loadParser.add_argument('-o', '--output', help='Save the columns to this .npz file')
+
+	backfillParser = commands.add_parser('backfill', help='Export sessions recorded without the columnar export')
+	backfillParser.add_argument('data_path', nargs='?', default='data')
+
+	args = parser.parse_args(argv)
+
+	if args.command == 'load':
+		loader = ColumnLoader(args.data_path, args.table)
+		output = loader.load(args.columns)
+		print(f'{len(loader.sessions)} sessions, {len(loader)} {args.table} rows')
+		if args.output:
+			numpy.savez(args.output, **output)
+	else:
+		print(f'Exported {backfill(args.data_path)} sessions')
+
+if __name__ == '__main__':
+	main()
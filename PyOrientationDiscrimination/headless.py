@@ -0,0 +1,463 @@
+'''
+	Headless backend for OrientationDiscriminationTester
+
+	Replaces the window, sound, shutter, gaze tracker and keyboard with null stand-ins driven by a virtual
+	clock and a simulated observer, so runBlocks runs a whole session at CPU speed on any machine (no
+	display, psychopy or lab hardware needed). Since every sleep is virtual, the wall time a trial takes
+	is the framework's own overhead.
+
+	Usage:
+		python headless.py --trials 24 --observer-threshold 2 --seed 1
+'''
+import os, sys
+import math
+import types
+import random
+import logging
+import argparse
+import tempfile
+import importlib.util
+import contextlib
+
+import numpy
+
+import shutter
+
+PACKAGE_PATH = os.path.dirname(os.path.realpath(__file__))
+FRAME_DURATION = 1 / 60.0
+
+class VirtualClock():
+	'''
+		Stands in for the time module inside the tester: sleep() advances the clock instead of blocking
+	'''
+	def __init__(self):
+		self.now = 0.0
+
+	def sleep(self, seconds):
+		self.now += max(0, seconds)
+
+	def time(self):
+		return self.now
+
+	def getTime(self):
+		return self.now
+
+class SimulatedObserver():
+	'''
+		Scripted responder with a Weibull psychometric function for the rotation between the two stimuli
+	'''
+	def __init__(self, threshold=2.0, slope=2.0, lapseRate=.02, reactionTime=.6, reactionTimeSD=.15, seed=None):
+		self.threshold = threshold
+		self.slope = slope
+		self.lapseRate = lapseRate
+		self.reactionTime = reactionTime
+		self.reactionTimeSD = reactionTimeSD
+		self.random = random.Random(seed)
+
+	def getProbabilityCorrect(self, offset):
+		detected = 1 - math.exp(-(abs(offset) / self.threshold) ** self.slope)
+		return (1 - self.lapseRate) * (.5 + .5 * detected) + self.lapseRate * .5
+
+	def respond(self, offset):
+		'''
+			Returns:
+				tuple: (True if the observer says the second stimulus was rotated clockwise, reaction time)
+		'''
+		correct = self.random.random() < self.getProbabilityCorrect(offset)
+		reactionTime = max(.15, self.random.gauss(self.reactionTime, self.reactionTimeSD))
+
+		return (offset > 0) == correct, reactionTime
+
+class NullStim():
+	def __init__(self, win=None, **kwargs):
+		self.win = win
+		self.pos = (0, 0)
+		self.ori = 0
+		self.size = 1
+		self.text = ''
+		self.color = None
+		self.autoDraw = False
+		self.boundingBox = (100, 40)
+		self.__dict__.update(kwargs)
+
+	def draw(self, *args, **kwargs):
+		if self.win is not None:
+			self.win.drawCount += 1
+
+class NullGratingStim(NullStim):
+	def draw(self, *args, **kwargs):
+		super().draw()
+		self.win.drawnOrientations.append(self.ori)
+
+class NullWindowHandle():
+	def minimize(self):
+		pass
+
+	def maximize(self):
+		pass
+
+	def set_fullscreen(self, fullscreen=True):
+		pass
+
+	def activate(self):
+		pass
+
+class NullWindow():
+	def __init__(self, clock, size=(1920, 1080), **kwargs):
+		self.clock = clock
+		self.size = size
+		self.winHandle = NullWindowHandle()
+		self.drawCount = 0
+		self.flipCount = 0
+		self.drawnOrientations = []
+		self.flipCallbacks = []
+
+	def callOnFlip(self, function, *args, **kwargs):
+		self.flipCallbacks.append((function, args, kwargs))
+
+	def flip(self, clearBuffer=True):
+		self.clock.sleep(FRAME_DURATION)
+		self.flipCount += 1
+
+		callbacks, self.flipCallbacks = self.flipCallbacks, []
+		for function, args, kwargs in callbacks:
+			function(*args, **kwargs)
+
+		return self.clock.now
+
+	def close(self):
+		pass
+
+class NullMonitor():
+	def __init__(self, name):
+		self.name = name
+		self.sizePix = (1920, 1080)
+
+	def setDistance(self, distance):
+		pass
+
+	def setWidth(self, width):
+		pass
+
+	def setSizePix(self, sizePix):
+		self.sizePix = sizePix
+
+	def getSizePix(self):
+		return self.sizePix
+
+	def save(self):
+		pass
+
+class NullSound():
+	def __init__(self, *args, **kwargs):
+		self.playCount = 0
+
+	def play(self):
+		self.playCount += 1
+
+class HeadlessEvents():
+	'''
+		Stands in for psychopy.event: the ready key is always pressed, and responses come from the observer
+	'''
+	def __init__(self, clock, observer, config):
+		self.clock = clock
+		self.observer = observer
+		self.window = None # bound once the tester has created its window
+		self.leftKey = config['Input settings']['rotated_left_key']
+		self.rightKey = config['Input settings']['rotated_right_key']
+
+	def getKeys(self, *args, timeStamped=False, **kwargs):
+		# responses only come from waitKeys
+		if timeStamped:
+			return []
+		return ['space']
+
+	def clearEvents(self, *args, **kwargs):
+		pass
+
+	def waitKeys(self, *args, timeStamped=False, **kwargs):
+		# the last two gratings drawn are this trial's pair
+		first, second = self.window.drawnOrientations[-2:]
+		self.window.drawnOrientations = []
+
+		clockwise, reactionTime = self.observer.respond(second - first)
+		self.clock.sleep(reactionTime)
+		key = self.rightKey if clockwise else self.leftKey
+
+		if timeStamped:
+			return [(key, self.clock.now)]
+		else:
+			return [key]
+
+class SimulatedGazeTracker():
+	'''
+		Reports gaze (already in degrees) at the fixation point plus Gaussian noise, and optionally a
+		calibration error that drifts until the next calibration
+	'''
+	def __init__(self, noise=.2, seed=None, clock=None, offset=(0, 0), driftRate=(0, 0), calibrationError=0, calibrationDuration=20, **kwargs):
+		'''
+			Args:
+				noise (float): standard deviation (deg) of each sample on each axis
+				clock (VirtualClock): advanced by calibrationDuration on each calibration, and times the drift
+				offset (tuple): systematic error (deg) until the first calibration
+				driftRate (tuple): deg per minute the systematic error grows by
+				calibrationError (float): standard deviation (deg) of the systematic error a calibration leaves
+				calibrationDuration (float): seconds a calibration takes
+		'''
+		self.noise = noise
+		self.random = random.Random(seed)
+		self.clock = clock
+		self.offset = offset
+		self.driftRate = driftRate
+		self.calibrationError = calibrationError
+		self.calibrationDuration = calibrationDuration
+		self.calibratedTime = self.getTime()
+		self.calibrations = 0
+
+	def getTime(self):
+		return self.clock.now if self.clock is not None else 0
+
+	def start(self, *args, **kwargs):
+		pass
+
+	def stop(self):
+		pass
+
+	def doCalibration(self, *args, **kwargs):
+		self.calibrations += 1
+		if self.clock is not None:
+			self.clock.sleep(self.calibrationDuration)
+
+		self.offset = (self.random.gauss(0, self.calibrationError), self.random.gauss(0, self.calibrationError))
+		self.calibratedTime = self.getTime()
+
+	def getPosition(self):
+		minutes = (self.getTime() - self.calibratedTime) / 60
+		return [
+			self.offset[0] + self.driftRate[0] * minutes + self.random.gauss(0, self.noise),
+			self.offset[1] + self.driftRate[1] * minutes + self.random.gauss(0, self.noise),
+		]
+
+class NullCalibrationWorker():
+	def spawn(self):
+		pass
+
+	def run(self, timeout=None):
+		return 0
+
+	def stop(self, timeout=None):
+		pass
+
+class HeadlessExit(Exception):
+	def __init__(self, exitCode):
+		super().__init__(f'core.quit({exitCode})')
+		self.exitCode = exitCode
+
+def _module(name, **attributes):
+	module = types.ModuleType(name)
+	module.__dict__.update(attributes)
+	return module
+
+def _recordSetting(name, dataType, default, **kwargs):
+	return (name.lower().replace(' ', '_'), default)
+
+def _recordGroup(name, *settings):
+	return (name, dict(settings))
+
+def _raiseQuit(exitCode=0):
+	raise HeadlessExit(exitCode)
+
+@contextlib.contextmanager
+def standIns(clock):
+	'''
+		Temporarily replaces psychopy, the lab hardware packages and the settings dialog in sys.modules
+	'''
+	visual = _module('psychopy.visual',
+		Window=lambda *args, **kwargs: NullWindow(clock, *args, **kwargs),
+		Rect=NullStim, Circle=NullStim, ShapeStim=NullStim, TextStim=NullStim, ImageStim=NullStim,
+		GratingStim=NullGratingStim,
+	)
+	modules = {
+		'psychopy': _module('psychopy',
+			prefs=types.SimpleNamespace(general={}),
+			core=_module('psychopy.core', getTime=clock.getTime, quit=_raiseQuit),
+			visual=visual,
+			gui=_module('psychopy.gui'),
+			data=_module('psychopy.data', getDateStr=lambda: 'headless'),
+			event=_module('psychopy.event'), # replaced per session by HeadlessEvents
+			monitors=_module('psychopy.monitors', Monitor=NullMonitor),
+			sound=_module('psychopy.sound', init=lambda: None, Sound=NullSound),
+			tools=_module('psychopy.tools'),
+		),
+		'MonitorShutter': _module('MonitorShutter', ShutterController=lambda: shutter.FakeShutterController(latency=0)),
+		'monitorTools': _module('monitorTools',
+			getPhysicalSize=lambda: (527, 296),
+			getResolution=lambda: (1920, 1080),
+			scaleSizeByEccentricity=lambda size, eccentricity: size,
+		),
+		'ConfigHelper': _module('ConfigHelper', ConfigHelper=None, ConfigGroup=_recordGroup, Setting=_recordSetting),
+		'PySide2': _module('PySide2'),
+		'PySide2.QtWidgets': _module('PySide2.QtWidgets', QApplication=None),
+	}
+
+	saved = {name: sys.modules.get(name) for name in modules}
+	sys.modules.update(modules)
+	if PACKAGE_PATH not in sys.path:
+		sys.path.insert(0, PACKAGE_PATH)
+
+	try:
+		yield modules
+	finally:
+		for name, module in saved.items():
+			if module is None:
+				del sys.modules[name]
+			else:
+				sys.modules[name] = module
+
+def _loadModule(name, filename):
+	spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_PATH, filename))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def loadTesterModule(clock=None):
+	'''
+		Imports a private copy of the tester module against the stand-ins, without running a session
+	'''
+	with standIns(clock or VirtualClock()):
+		return _loadModule('odHeadlessTester', '__main__.py')
+
+def getDefaultConfig():
+	'''
+		Returns:
+			dict: every setting at its default, as the settings dialog would return them
+	'''
+	with standIns(VirtualClock()):
+		settingsModule = _loadModule('odHeadlessSettings', 'settings.py')
+
+	return {name: dict(values) for name, values in settingsModule.SETTINGS_GROUP}
+
+def runSession(overrides=None, observer=None, seed=None, dataPath=None, gaze=None):
+	'''
+		Runs a full session headless
+
+		Args:
+			overrides (dict): {group: {setting: value}} applied over the defaults
+			observer (SimulatedObserver): the responder, a default observer if omitted
+			seed (int): seeds trial order and the default observer/gaze noise
+			dataPath (str): where to write the data file, a temporary directory if omitted
+			gaze (dict): SimulatedGazeTracker options (offset, driftRate, ...) for a synthetic gaze trace
+
+		Returns:
+			dict: exitCode, thresholds {(eccentricity, orientation): threshold}, trialOverhead (seconds of wall time per trial),
+				virtualDuration (seconds the session would take in the lab), flips, draws, fixationAttempts,
+				calibrations, and the tester itself
+	'''
+	config = getDefaultConfig()
+	for group, values in (overrides or {}).items():
+		config[group].update(values)
+
+	temporaryDirectory = None
+	if dataPath is None:
+		temporaryDirectory = tempfile.TemporaryDirectory()
+		dataPath = temporaryDirectory.name
+
+	config['General settings'].update(session_id='headless', start_time='headless', data_path=dataPath)
+	config['Input settings']['response_backend'] = 'psychopy'
+	config['Debug settings']['profile_phases'] = True
+	for key in ['sitmulusTone', 'positiveFeedback', 'negativeFeedback', 'gazeTone']:
+		config[key] = NullSound()
+
+	if observer is None:
+		observer = SimulatedObserver(seed=seed)
+
+	clock = VirtualClock()
+	with standIns(clock) as modules:
+		testerModule = _loadModule('odHeadlessTester', '__main__.py')
+		testerModule.time = clock
+		testerModule.random = random.Random(seed)
+		testerModule.calibration = _module('calibration', CalibrationWorker=NullCalibrationWorker)
+		testerModule.PyPupilGazeTracker = _module('PyPupilGazeTracker',
+			GazeTracker=_module('PyPupilGazeTracker.GazeTracker', GazeTracker=lambda **kwargs: SimulatedGazeTracker(seed=seed, clock=clock, **dict(kwargs, **(gaze or {})))),
+			smoothing=_module('PyPupilGazeTracker.smoothing', SimpleDecay=lambda: None),
+			PsychoPyVisuals=_module('PyPupilGazeTracker.PsychoPyVisuals',
+				ScreenMarkers=NullStim,
+				FixationStim=NullStim,
+				screenToMonitorCenterDeg=lambda monitor, pos: pos,
+			),
+		)
+
+		headlessEvents = HeadlessEvents(clock, observer, config)
+		events = modules['psychopy'].event
+		events.getKeys = headlessEvents.getKeys
+		events.clearEvents = headlessEvents.clearEvents
+		events.waitKeys = headlessEvents.waitKeys
+
+		tester = testerModule.OrientationDiscriminationTester(config)
+		headlessEvents.window = tester.win
+		try:
+			tester.start()
+			exitCode = 0
+		except HeadlessExit as exc:
+			exitCode = exc.exitCode
+
+	profiler = tester.profiler
+	stackIds = profiler.stackIds[:profiler.count]
+	trialStack = profiler.stackLookup.get('runBlocks;runTrial')
+	trialOverhead = profiler.getDurations()[stackIds == trialStack] / 1e9
+	fixationStack = profiler.stackLookup.get('runBlocks;runTrial;waitForFixation')
+
+	thresholds = {}
+	for eccentricity, eccDicts in tester.stepHandlers.items():
+		for orientation, stepHandler in eccDicts.items():
+			thresholds[(eccentricity, orientation)] = stepHandler.getBestPest()
+
+	if temporaryDirectory is not None:
+		logging.shutdown()
+		temporaryDirectory.cleanup()
+
+	return {
+		'exitCode': exitCode,
+		'thresholds': thresholds,
+		'trialOverhead': trialOverhead,
+		'virtualDuration': clock.now,
+		'flips': tester.win.flipCount,
+		'draws': tester.win.drawCount,
+		'fixationAttempts': int(numpy.count_nonzero(stackIds == fixationStack)) if fixationStack is not None else 0,
+		'calibrations': tester.gazeTracker.calibrations if tester.gazeTracker is not None else 0,
+		'tester': tester,
+	}
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Runs a simulated session without a display and reports per-trial framework overhead')
+	parser.add_argument('--trials', type=int, default=24, help='Trials per stimulus config')
+	parser.add_argument('--observer-threshold', type=float, default=2.0, help='Simulated observer threshold in degrees')
+	parser.add_argument('--wait-for-fixation', action='store_true', help='Simulate the gaze tracker too')
+	parser.add_argument('--gaze-drift', type=float, default=0, help='Horizontal gaze tracker drift in degrees per minute')
+	parser.add_argument('--no-drift-correction', action='store_true', help='Recalibrate every few retries instead')
+	parser.add_argument('--seed', type=int, default=None)
+	args = parser.parse_args(argv)
+
+	result = runSession(
+		{
+			'Stimuli settings': {'trials_per_stimulus_config': args.trials},
+			'Gaze tracking': {'wait_for_fixation': args.wait_for_fixation, 'drift_correction': not args.no_drift_correction},
+		},
+		SimulatedObserver(args.observer_threshold, seed=args.seed),
+		args.seed,
+		gaze={'driftRate': (args.gaze_drift, 0)},
+	)
+
+	overhead = result['trialOverhead'] * 1000
+	p50, p90, p99 = numpy.percentile(overhead, [50, 90, 99])
+	print(f'{len(overhead)} trials, {result["flips"]} flips, {result["virtualDuration"]/60:.1f} virtual minutes')
+	if args.wait_for_fixation:
+		print(f'{result["fixationAttempts"]} fixation attempts, {result["calibrations"]} calibrations')
+	print(f'Per-trial overhead: mean={overhead.mean():.3f}ms p50={p50:.3f}ms p90={p90:.3f}ms p99={p99:.3f}ms max={overhead.max():.3f}ms')
+	for (eccentricity, orientation), threshold in sorted(result['thresholds'].items()):
+		print(f'E={eccentricity} O={orientation}: {threshold}')
+
+	return result['exitCode']
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,320 @@
+'''
+	Flip-aligned event markers for co-registering sessions with EEG and other recorders
+
+	Markers are timestamped on the experiment clock (psychopy's core.getTime) as the event happens, or
+	as soon as the flip that shows it returns (through win.callOnFlip), and queued for a sender thread
+	so the trial loop never waits on the network. Each marker is 16 bytes (see MARKER_FORMAT).
+
+	Addresses:
+		udp://host:port   one datagram per marker
+		tcp://host:port   a stream of markers over one connection
+		pipe://path       a named pipe (\\\\.\\pipe\\name on Windows, a FIFO elsewhere)
+
+	Usage (receiver, for checking a setup):
+		python markers.py udp://0.0.0.0:5758
+'''
+import time
+import queue
+import socket
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+from urllib.parse import urlsplit
+
+import numpy
+
+# event code (uint8), sequence number (uint16, wraps), trial number (uint32), timestamp in seconds (float64)
+MARKER_FORMAT = struct.Struct('<BxHId')
+
+EVENT_CODES = {
+	'trial start': 1,
+	'stim1 onset': 2,
+	'stim2 onset': 3,
+	'mask onset': 4,
+	'response': 5,
+	'gaze break': 6,
+}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+
+def parseAddress(address):
+	'''
+		Returns:
+			tuple: (scheme, (host, port)) for udp/tcp, (scheme, path) for pipe
+	'''
+	url = urlsplit(address)
+	if url.scheme in ('udp', 'tcp'):
+		return url.scheme, (url.hostname, url.port)
+	elif url.scheme == 'pipe':
+		return url.scheme, address[len('pipe://'):]
+	else:
+		raise ValueError(f'Unsupported event marker address: {address}')
+
+def decodeMarkers(data):
+	'''
+		Returns:
+			list: (event name, sequence, trial, timestamp) for every whole marker in data
+	'''
+	markers = []
+	for offset in range(0, len(data) - MARKER_FORMAT.size + 1, MARKER_FORMAT.size):
+		code, sequence, trial, timestamp = MARKER_FORMAT.unpack_from(data, offset)
+		markers.append((EVENT_NAMES.get(code, code), sequence, trial, timestamp))
+
+	return markers
+
+class NullMarkerStream():
+	def mark(self, event, trial, timestamp=None):
+		pass
+
+	def markOnFlip(self, win, event, trial):
+		pass
+
+	def close(self, timeout=None):
+		pass
+
+class MarkerStream():
+	def __init__(self, address, clock, maxQueued=1024, capacity=16384, retryDelay=.5):
+		'''
+			Args:
+				address (str): where to send markers (see the module docstring)
+				clock (function): returns the experiment time in seconds; markers and latencies use this clock
+				maxQueued (int): markers beyond this are dropped rather than delaying the trial loop
+				capacity (int): number of send latencies to keep for the summary
+				retryDelay (float): seconds before the first reconnect attempt, doubled after each failure up to 30
+		'''
+		self.scheme, self.target = parseAddress(address)
+		self.clock = clock
+		self.sequence = 0
+		self.dropped = 0
+		self.failed = 0
+
+		self.latencies = numpy.zeros(capacity)
+		self.latencyCount = 0
+
+		self.connection = None
+		self.warned = False
+		self.initialRetryDelay = retryDelay
+		self.retryDelay = retryDelay
+		self.nextConnectTime = 0
+		self.markers = queue.Queue(maxQueued)
+		self.thread = threading.Thread(target=self.run, name='MarkerStream', daemon=True)
+		self.thread.start()
+
+	def mark(self, event, trial, timestamp=None):
+		'''
+			Queues a marker. Never blocks.
+
+			Args:
+				event (str): one of EVENT_CODES
+				trial (int): trial number
+				timestamp (float): when the event happened on the experiment clock, now if omitted
+		'''
+		if timestamp is None:
+			timestamp = self.clock()
+
+		self.sequence = (self.sequence + 1) & 0xffff
+		try:
+			self.markers.put_nowait(MARKER_FORMAT.pack(EVENT_CODES[event], self.sequence, trial, timestamp))
+		except queue.Full:
+			self.dropped += 1
+
+	def markOnFlip(self, win, event, trial):
+		'''
+			Marks an event as soon as the next flip of win returns
+		'''
+		win.callOnFlip(self.mark, event, trial)
+
+	def connect(self):
+		if self.connection is not None:
+			return True
+		# while the recorder is down, markers fail straight away instead of each waiting on a connection attempt
+		if time.monotonic() < self.nextConnectTime:
+			return False
+
+		try:
+			if self.scheme == 'udp':
+				self.connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+				self.connection.connect(self.target)
+			elif self.scheme == 'tcp':
+				self.connection = socket.create_connection(self.target, timeout=1)
+				self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			else:
+				self.connection = open(self.target, 'wb')
+			return True
+		except OSError as exc:
+			# markers keep coming while the recorder is down, only the first failure is worth a warning
+			if not self.warned:
+				logging.warning(f'Could not open event marker stream: {exc}')
+				self.warned = True
+			self.connection = None
+			self.backOff()
+			return False
+
+	def backOff(self):
+		self.nextConnectTime = time.monotonic() + self.retryDelay
+		self.retryDelay = min(30, self.retryDelay * 2)
+
+	def send(self, marker):
+		if not self.connect():
+			return False
+
+		try:
+			# a partial write would split a marker and misalign every one after it
+			if self.scheme == 'pipe':
+				self.connection.write(marker)
+				self.connection.flush()
+			elif self.scheme == 'tcp':
+				self.connection.sendall(marker)
+			else:
+				self.connection.send(marker)
+			self.retryDelay = self.initialRetryDelay
+			return True
+		except OSError as exc:
+			logging.warning(f'Lost event marker stream: {exc}')
+			self.connection.close()
+			self.connection = None
+			self.backOff()
+			return False
+
+	def run(self):
+		# connected up front, so the first marker doesn't wait for it
+		self.connect()
+
+		while True:
+			marker = self.markers.get()
+			if marker is None:
+				break
+
+			if not self.send(marker):
+				self.failed += 1
+				continue
+
+			if self.latencyCount < len(self.latencies):
+				self.latencies[self.latencyCount] = self.clock() - MARKER_FORMAT.unpack(marker)[3]
+				self.latencyCount += 1
+
+		if self.connection is not None:
+			self.connection.close()
+			self.connection = None
+
+	def getLatencySummary(self):
+		'''
+			Returns:
+				dict: count of markers sent, dropped (queue full) and failed (send error), and P50/P99/max seconds from event to send
+		'''
+		latencies = self.latencies[:self.latencyCount]
+		summary = {'count': self.latencyCount, 'dropped': self.dropped, 'failed': self.failed}
+		if self.latencyCount > 0:
+			summary['p50'], summary['p99'] = numpy.percentile(latencies, [50, 99])
+			summary['max'] = latencies.max()
+
+		return summary
+
+	def close(self, timeout=2):
+		'''
+			Sends everything queued so far, stops the sender and logs the latency summary
+		'''
+		try:
+			self.markers.put(None, timeout=timeout)
+		except queue.Full:
+			# the sender isn't keeping up, so what's still queued is dropped rather than holding up the end of the session
+			while True:
+				try:
+					self.markers.get_nowait()
+				except queue.Empty:
+					break
+				self.dropped += 1
+			self.markers.put_nowait(None)
+
+		self.thread.join(timeout)
+
+		summary = self.getLatencySummary()
+		if summary['count'] > 0:
+			logging.info(
+				f'Event markers: {summary["count"]} sent, {summary["dropped"]} dropped, {summary["failed"]} failed, '
+				f'latency p50={summary["p50"]*1000:.3f}ms p99={summary["p99"]*1000:.3f}ms max={summary["max"]*1000:.3f}ms'
+			)
+		else:
+			logging.info(f'Event markers: none sent, {summary["dropped"]} dropped, {summary["failed"]} failed')
+
+def getMarkerStream(address, clock):
+	if address:
+		return MarkerStream(address, clock)
+	else:
+		return NullMarkerStream()
+
+class _TCPMarkerHandler(socketserver.BaseRequestHandler):
+	def handle(self):
+		pending = b''
+		while True:
+			data = self.request.recv(4096)
+			if not data:
+				break
+
+			pending += data
+			whole = len(pending) - len(pending) % MARKER_FORMAT.size
+			self.server.receiver.receive(pending[:whole])
+			pending = pending[whole:]
+
+class _UDPMarkerHandler(socketserver.BaseRequestHandler):
+	def handle(self):
+		self.server.receiver.receive(self.request[0])
+
+class MarkerReceiver():
+	'''
+		Collects markers sent to a udp:// or tcp:// address, standing in for a recorder
+	'''
+	def __init__(self, address, onMarker=None):
+		'''
+			Args:
+				address (str): udp://host:port or tcp://host:port to listen on (port 0 picks a free port)
+				onMarker (function): called with (event name, sequence, trial, timestamp) for each marker
+		'''
+		scheme, target = parseAddress(address)
+		if scheme == 'udp':
+			self.server = socketserver.UDPServer(target, _UDPMarkerHandler)
+		elif scheme == 'tcp':
+			self.server = socketserver.ThreadingTCPServer(target, _TCPMarkerHandler)
+			self.server.daemon_threads = True
+		else:
+			raise ValueError('MarkerReceiver listens on udp:// or tcp:// addresses')
+
+		self.server.receiver = self
+		self.address = f'{scheme}://{self.server.server_address[0]}:{self.server.server_address[1]}'
+		self.onMarker = onMarker
+		self.markers = []
+		self.lock = threading.Lock()
+
+		self.thread = threading.Thread(target=self.server.serve_forever, name='MarkerReceiver', daemon=True)
+		self.thread.start()
+
+	def receive(self, data):
+		markers = decodeMarkers(data)
+		with self.lock:
+			self.markers += markers
+
+		if self.onMarker is not None:
+			for marker in markers:
+				self.onMarker(*marker)
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Prints the event markers sent to an address')
+	parser.add_argument('address', help='udp://host:port or tcp://host:port')
+	args = parser.parse_args(argv)
+
+	receiver = MarkerReceiver(args.address, lambda event, sequence, trial, timestamp: print(f'{timestamp:.6f} trial={trial} #{sequence} {event}'))
+	print(f'Listening on {receiver.address}')
+	try:
+		receiver.thread.join()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		receiver.close()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,180 @@
+import time
+import logging
+
+import numpy
+
+class _NullSpan():
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_NULL_SPAN = _NullSpan()
+
+class NullProfiler():
+	"""
+		Stand-in used when profiling is disabled. Every call is a no-op so the trial loop pays
+		only for an attribute lookup and an empty context manager.
+	"""
+	enabled = False
+
+	def span(self, name):
+		return _NULL_SPAN
+
+	def export(self, basePath):
+		pass
+
+class _Span():
+	__slots__ = ('profiler', 'name', 'index')
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.index = self.profiler.open(self.name)
+		return self
+
+	def __exit__(self, *exc):
+		self.profiler.close(self.index)
+		return False
+
+class PhaseProfiler():
+	"""
+		Records nested timing spans (in perf_counter_ns) into preallocated arrays
+
+		Spans are identified by their full call path (e.g. "runBlocks;runTrial;flipBuffer") so the
+		export can be fed straight into flamegraph.pl / speedscope as folded stacks.
+	"""
+	enabled = True
+
+	def __init__(self, capacity=65536):
+		"""
+			Args:
+				capacity (int): Number of spans to preallocate. The buffer doubles if a session outgrows it.
+		"""
+		self.starts = numpy.zeros(capacity, dtype=numpy.int64)
+		self.ends = numpy.zeros(capacity, dtype=numpy.int64)
+		self.stackIds = numpy.zeros(capacity, dtype=numpy.int32)
+		self.parents = numpy.full(capacity, -1, dtype=numpy.int32)
+		self.count = 0
+
+		self.stackNames = []
+		self.stackLookup = {}
+		self.openStack = []
+
+	def span(self, name):
+		return _Span(self, name)
+
+	def _grow(self):
+		capacity = len(self.starts) * 2
+		for attr in ('starts', 'ends', 'stackIds', 'parents'):
+			old = getattr(self, attr)
+			new = numpy.full(capacity, -1 if attr == 'parents' else 0, dtype=old.dtype)
+			new[:len(old)] = old
+			setattr(self, attr, new)
+
+	def open(self, name):
+		if self.count == len(self.starts):
+			self._grow()
+
+		if self.openStack:
+			parent = self.openStack[-1]
+			stack = self.stackNames[self.stackIds[parent]] + ';' + name
+		else:
+			parent = -1
+			stack = name
+
+		stackId = self.stackLookup.get(stack)
+		if stackId is None:
+			stackId = len(self.stackNames)
+			self.stackLookup[stack] = stackId
+			self.stackNames.append(stack)
+
+		index = self.count
+		self.count += 1
+		self.stackIds[index] = stackId
+		self.parents[index] = parent
+		self.openStack.append(index)
+		self.starts[index] = time.perf_counter_ns()
+
+		return index
+
+	def close(self, index):
+		self.ends[index] = time.perf_counter_ns()
+		# spans normally close in LIFO order, but an exception may unwind several at once
+		while self.openStack and self.openStack.pop() != index:
+			pass
+
+	def getDurations(self):
+		"""
+			Returns:
+				numpy.array: duration in ns of each completed span (unfinished spans are 0)
+		"""
+		starts = self.starts[:self.count]
+		ends = self.ends[:self.count]
+		return numpy.where(ends > 0, ends - starts, 0)
+
+	def getSelfDurations(self):
+		"""
+			Returns:
+				numpy.array: duration in ns of each span excluding the time spent in its children
+		"""
+		durations = self.getDurations()
+		parents = self.parents[:self.count]
+		hasParent = parents >= 0
+
+		childTime = numpy.zeros(self.count, dtype=numpy.int64)
+		numpy.add.at(childTime, parents[hasParent], durations[hasParent])
+
+		return numpy.maximum(durations - childTime, 0)
+
+	def getSummary(self):
+		"""
+			Returns:
+				list: one (stack, count, total ms, p50 ms, p90 ms, p99 ms, max ms) tuple per call path
+		"""
+		durations = self.getDurations() / 1e6
+		stackIds = self.stackIds[:self.count]
+
+		summary = []
+		for stackId, stack in enumerate(self.stackNames):
+			values = durations[stackIds == stackId]
+			if len(values) == 0:
+				continue
+			p50, p90, p99 = numpy.percentile(values, [50, 90, 99])
+			summary.append((stack, len(values), values.sum(), p50, p90, p99, values.max()))
+
+		return summary
+
+	def export(self, basePath):
+		"""
+			Writes `basePath`.folded (flame graph input, self time in microseconds) and
+			`basePath`.phases.csv (per-phase percentiles)
+		"""
+		if self.count == 0:
+			return
+
+		selfTimes = self.getSelfDurations() // 1000
+		totals = numpy.bincount(self.stackIds[:self.count], weights=selfTimes, minlength=len(self.stackNames))
+
+		foldedFilename = basePath + '.folded'
+		with open(foldedFilename, 'w') as foldedFile:
+			for stack, total in zip(self.stackNames, totals):
+				if total > 0:
+					foldedFile.write(f'{stack} {int(total)}\n')
+
+		summaryFilename = basePath + '.phases.csv'
+		with open(summaryFilename, 'w') as summaryFile:
+			summaryFile.write('Phase,Count,Total ms,P50 ms,P90 ms,P99 ms,Max ms\n')
+			for stack, count, total, p50, p90, p99, maximum in self.getSummary():
+				summaryFile.write(f'{stack},{count},{total:.3f},{p50:.3f},{p90:.3f},{p99:.3f},{maximum:.3f}\n')
+
+		logging.info(f'Wrote phase profile to {foldedFilename} and {summaryFilename}')
+
+def getProfiler(enabled):
+	if enabled:
+		return PhaseProfiler()
+	else:
+		return NullProfiler()
@@ -0,0 +1,137 @@
+import time
+import queue
+import logging
+
+# pynput reports numpad digits with different virtual key codes per platform
+_NUMPAD_VK_RANGES = (
+	96,    # Windows VK_NUMPAD0
+	65456, # X11 XK_KP_0
+)
+
+def _keyName(key):
+	"""
+		Converts a pynput key into the name psychopy.event would report (e.g. 'num_4', 'space', 'a')
+	"""
+	vk = getattr(key, 'vk', None)
+	if vk is not None:
+		for start in _NUMPAD_VK_RANGES:
+			if start <= vk < start + 10:
+				return f'num_{vk - start}'
+
+	char = getattr(key, 'char', None)
+	if char is not None:
+		return char.lower()
+
+	name = getattr(key, 'name', str(key))
+	return {'esc': 'escape'}.get(name, name)
+
+class PsychoPyKeyboard():
+	"""
+		Reads responses from psychopy's event queue. Keys are only timestamped when pyglet events
+		are dispatched (on flip or while waiting), so reaction times are quantized to that.
+	"""
+	def __init__(self, clock):
+		from psychopy import event
+		self.event = event
+		self.clock = clock
+		self.pending = []
+
+	def start(self):
+		pass
+
+	def stop(self):
+		pass
+
+	def clear(self):
+		self.pending = []
+		self.event.clearEvents()
+
+	def poll(self):
+		"""
+			Dispatches window events so keys pressed while the caller is busy are timestamped now, rather than at the next waitKeys
+		"""
+		self.pending += [(key, keyTime) for key, keyTime in self.event.getKeys(timeStamped=True)]
+
+	def waitKeys(self):
+		"""
+			Blocks until at least one key is pressed
+
+			Returns:
+				list: (key name, timestamp) tuples
+		"""
+		if self.pending:
+			keys, self.pending = self.pending, []
+			return keys
+
+		# keyboard.clear() already dropped stale keys; clearing here would lose a response pressed since the last poll()
+		return [(key, keyTime) for key, keyTime in self.event.waitKeys(timeStamped=True, clearEvents=False)]
+
+class PynputKeyboard():
+	"""
+		Captures key-down events on pynput's listener thread, timestamping each one as it arrives
+		rather than when the render thread next dispatches window events
+	"""
+	def __init__(self, clock):
+		from pynput import keyboard
+		self.clock = clock
+		self.events = queue.Queue()
+		self.listener = keyboard.Listener(on_press=self.onPress)
+
+	def onPress(self, key):
+		self.events.put((_keyName(key), self.clock()))
+
+	def start(self):
+		self.listener.start()
+		self.listener.wait()
+
+	def stop(self):
+		self.listener.stop()
+
+	def clear(self):
+		while True:
+			try:
+				self.events.get_nowait()
+			except queue.Empty:
+				break
+
+	def poll(self):
+		# keys are already timestamped on the listener thread
+		pass
+
+	def waitKeys(self):
+		"""
+			Blocks (without polling) until at least one key is pressed
+
+			Returns:
+				list: (key name, timestamp) tuples, including any other keys already queued
+		"""
+		keys = [self.events.get()]
+		while True:
+			try:
+				keys.append(self.events.get_nowait())
+			except queue.Empty:
+				return keys
+
+def getKeyboard(backend, clock=time.perf_counter):
+	"""
+		Creates and starts the keyboard response backend, falling back to psychopy's event queue
+		if pynput isn't available
+
+		Args:
+			backend (str): 'pynput' or 'psychopy'
+			clock (callable): Returns the current time in seconds. Must be the clock used to timestamp flips.
+	"""
+	keyboard = None
+	if backend == 'pynput':
+		try:
+			keyboard = PynputKeyboard(clock)
+		except Exception as exc:
+			logging.warning(f'Failed to start pynput keyboard capture ({exc}). Falling back to psychopy events.')
+
+	if keyboard is None:
+		keyboard = PsychoPyKeyboard(clock)
+
+	keyboard.start()
+	logging.info(f'Using {type(keyboard).__name__} for responses')
+
+	return keyboard
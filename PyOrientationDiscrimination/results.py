@@ -0,0 +1,319 @@
+import os
+import re
+import csv
+import json
+import glob
+import sqlite3
+import hashlib
+import argparse
+import datetime
+
+import numpy
+
+FILENAME_PATTERN = re.compile(r'OD_(\d{4}_\w{3}_\d{2}_\d{4})_(.*)')
+SETTINGS_PATTERN = re.compile(r'Settings: (\{.*\})')
+THRESHOLD_COLUMNS = ('Eccentricity', 'Orientation', 'Threshold')
+
+SCHEMA = '''
+	CREATE TABLE IF NOT EXISTS files (
+		path TEXT PRIMARY KEY,
+		mtime REAL,
+		size INTEGER,
+		sha1 TEXT
+	);
+	CREATE TABLE IF NOT EXISTS sessions (
+		id INTEGER PRIMARY KEY,
+		name TEXT UNIQUE,
+		session_id TEXT,
+		start_time TEXT,
+		practice INTEGER
+	);
+	CREATE TABLE IF NOT EXISTS thresholds (
+		session INTEGER REFERENCES sessions(id) ON DELETE CASCADE,
+		eccentricity REAL,
+		orientation REAL,
+		threshold REAL,
+		ci_low REAL,
+		ci_high REAL
+	);
+	CREATE TABLE IF NOT EXISTS trials (
+		session INTEGER REFERENCES sessions(id) ON DELETE CASCADE,
+		trial INTEGER,
+		eccentricity REAL,
+		orientation REAL,
+		offset REAL,
+		correct INTEGER,
+		rt REAL,
+		UNIQUE(session, trial)
+	);
+	CREATE INDEX IF NOT EXISTS sessions_session_id ON sessions(session_id);
+	CREATE INDEX IF NOT EXISTS sessions_start_time ON sessions(start_time);
+	CREATE INDEX IF NOT EXISTS thresholds_session ON thresholds(session);
+	CREATE INDEX IF NOT EXISTS thresholds_eccentricity ON thresholds(eccentricity);
+	CREATE INDEX IF NOT EXISTS thresholds_orientation ON thresholds(orientation);
+'''
+
+THRESHOLD_DTYPE = [
+	('session', 'U128'),
+	('session_id', 'U64'),
+	('start_time', 'datetime64[m]'),
+	('practice', numpy.int8),  # 1 practice, 0 not, -1 unknown
+	('eccentricity', float),
+	('orientation', float),
+	('threshold', float),
+	('ci_low', float),
+	('ci_high', float),
+]
+
+def parseStartTime(startTime):
+	"""
+		Converts psychopy's data.getDateStr() format (e.g. 2019_Mar_05_1403) to ISO 8601
+	"""
+	try:
+		return datetime.datetime.strptime(startTime, '%Y_%b_%d_%H%M').isoformat(timespec='minutes')
+	except (TypeError, ValueError):
+		return None
+
+def readSessionInfo(csvFilename):
+	"""
+		Finds the session ID, start time and practice flag for a data file, from the Settings line in the
+		matching .log if there is one, otherwise from the file name
+
+		Returns:
+			dict: session_id, start_time (ISO 8601 or None), practice (bool or None)
+	"""
+	name = os.path.splitext(os.path.basename(csvFilename))[0]
+	info = {'session_id': name, 'start_time': None, 'practice': None}
+
+	match = FILENAME_PATTERN.match(name)
+	if match is not None:
+		info['start_time'] = parseStartTime(match.group(1))
+		info['session_id'] = match.group(2)
+
+	logFilename = os.path.splitext(csvFilename)[0] + '.log'
+	if os.path.exists(logFilename):
+		with open(logFilename, encoding='utf-8', errors='replace') as logFile:
+			for line in logFile:
+				match = SETTINGS_PATTERN.search(line)
+				if match is not None:
+					general = json.loads(match.group(1)).get('General settings', {})
+					info['session_id'] = general.get('session_id', info['session_id'])
+					info['start_time'] = parseStartTime(general.get('start_time')) or info['start_time']
+					info['practice'] = general.get('practice')
+					break
+
+	return info
+
+def isThresholdFile(filename):
+	"""
+		Returns:
+			bool: True if filename is a session's threshold file, rather than another CSV in the data path
+				(e.g. the profiler's .phases.csv)
+	"""
+	with open(filename, newline='', encoding='utf-8', errors='replace') as dataFile:
+		header = next(csv.reader(dataFile), [])
+
+	return all(column in header for column in THRESHOLD_COLUMNS)
+
+def hashFile(filename):
+	sha1 = hashlib.sha1()
+	with open(filename, 'rb') as dataFile:
+		for chunk in iter(lambda: dataFile.read(1 << 16), b''):
+			sha1.update(chunk)
+
+	return sha1.hexdigest()
+
+class ResultsStore():
+	"""
+		SQLite index of the threshold files from any number of sessions
+	"""
+	def __init__(self, filename='results.sqlite'):
+		# the aggregator writes from its connection threads (serialized by its own lock)
+		self.db = sqlite3.connect(filename, check_same_thread=False)
+		self.db.execute('PRAGMA foreign_keys = ON')
+		self.db.executescript(SCHEMA)
+
+		# databases created before confidence intervals were recorded
+		columns = [row[1] for row in self.db.execute('PRAGMA table_info(thresholds)')]
+		for column in ['ci_low', 'ci_high']:
+			if column not in columns:
+				self.db.execute(f'ALTER TABLE thresholds ADD COLUMN {column} REAL')
+
+	def close(self):
+		self.db.close()
+
+	def ingest(self, dataPath):
+		"""
+			Adds new and changed data files from dataPath. Files whose mtime and size haven't changed are
+			skipped without being read; touched files with an unchanged hash are not re-parsed. CSV files
+			without threshold columns are skipped.
+
+			Returns:
+				int: number of files (re-)ingested
+		"""
+		ingested = 0
+		for filename in sorted(glob.glob(os.path.join(dataPath, '*.csv'))):
+			path = os.path.realpath(filename)
+			stat = os.stat(path)
+
+			known = self.db.execute('SELECT mtime, size, sha1 FROM files WHERE path = ?', (path,)).fetchone()
+			if known is not None and known[0] == stat.st_mtime and known[1] == stat.st_size:
+				continue
+
+			if not isThresholdFile(path):
+				continue
+
+			sha1 = hashFile(path)
+			with self.db:
+				if known is None or known[2] != sha1:
+					self.ingestFile(path)
+					ingested += 1
+
+				self.db.execute('INSERT OR REPLACE INTO files (path, mtime, size, sha1) VALUES (?, ?, ?, ?)', (path, stat.st_mtime, stat.st_size, sha1))
+
+		return ingested
+
+	def getSession(self, name, info):
+		"""
+			Returns the row id of a session, creating or updating it with info
+		"""
+		self.db.execute(
+			'INSERT INTO sessions (name, session_id, start_time, practice) VALUES (?, ?, ?, ?) '
+			'ON CONFLICT(name) DO UPDATE SET session_id=excluded.session_id, start_time=excluded.start_time, practice=excluded.practice',
+			(name, info['session_id'], info['start_time'], info['practice'])
+		)
+		return self.db.execute('SELECT id FROM sessions WHERE name = ?', (name,)).fetchone()[0]
+
+	def ingestFile(self, path):
+		name = os.path.splitext(os.path.basename(path))[0]
+		session = self.getSession(name, readSessionInfo(path))
+
+		with open(path, newline='') as dataFile:
+			rows = [
+				(
+					session, float(row['Eccentricity']), float(row['Orientation']), float(row['Threshold']),
+					float(row.get('CI low') or 'nan'), float(row.get('CI high') or 'nan')
+				)
+				for row in csv.DictReader(dataFile)
+			]
+
+		self.db.execute('DELETE FROM thresholds WHERE session = ?', (session,))
+		self.db.executemany('INSERT INTO thresholds (session, eccentricity, orientation, threshold, ci_low, ci_high) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+	def addRecords(self, station, records):
+		"""
+			Stores records streamed from a station (see aggregator.py). Re-sent records replace the earlier copy.
+
+			Args:
+				station (str): name of the station that sent the records, unless a record has its own;
+					sessions are stored as {station}/{session}
+				records (list): dicts with a type of 'session', 'trial' or 'threshold'
+		"""
+		with self.db:
+			for record in records:
+				name = f'{record.get("station", station)}/{record["session"]}'
+				if record['type'] == 'session':
+					self.getSession(name, {
+						'session_id': record.get('session_id'),
+						'start_time': parseStartTime(record.get('start_time')),
+						'practice': record.get('practice'),
+					})
+					continue
+
+				row = self.db.execute('SELECT id FROM sessions WHERE name = ?', (name,)).fetchone()
+				session = row[0] if row is not None else self.getSession(name, {'session_id': None, 'start_time': None, 'practice': None})
+
+				if record['type'] == 'trial':
+					self.db.execute(
+						'INSERT OR REPLACE INTO trials (session, trial, eccentricity, orientation, offset, correct, rt) VALUES (?, ?, ?, ?, ?, ?, ?)',
+						(session, record['trial'], record['eccentricity'], record['orientation'], record['offset'], record['correct'], record['rt'])
+					)
+				elif record['type'] == 'threshold':
+					self.db.execute(
+						'DELETE FROM thresholds WHERE session = ? AND eccentricity = ? AND orientation = ?',
+						(session, record['eccentricity'], record['orientation'])
+					)
+					self.db.execute(
+						'INSERT INTO thresholds (session, eccentricity, orientation, threshold, ci_low, ci_high) VALUES (?, ?, ?, ?, ?, ?)',
+						(session, record['eccentricity'], record['orientation'], record['threshold'], record['ci_low'], record['ci_high'])
+					)
+
+	def query(self, eccentricity=None, orientation=None, sessionId=None, practice=None, since=None, until=None):
+		"""
+			Retrieves thresholds matching every given filter
+
+			Args:
+				eccentricity (float): Only this eccentricity
+				orientation (float): Only this orientation
+				sessionId (str): Only sessions with this session ID
+				practice (bool): Only practice (True) or non-practice (False) sessions. Sessions whose log predates
+					the Settings line have an unknown practice flag and match neither.
+				since (str): Only sessions starting on or after this ISO 8601 date/time
+				until (str): Only sessions starting before this ISO 8601 date/time
+
+			Returns:
+				numpy.recarray: fields session, session_id, start_time, practice (1, 0, or -1 if unknown), eccentricity, orientation,
+					threshold, ci_low, ci_high
+		"""
+		clauses = []
+		params = []
+		for clause, value in [
+			('t.eccentricity = ?', eccentricity),
+			('t.orientation = ?', orientation),
+			('s.session_id = ?', sessionId),
+			('s.practice = ?', practice),
+			('s.start_time >= ?', since),
+			('s.start_time < ?', until),
+		]:
+			if value is not None:
+				clauses.append(clause)
+				params.append(value)
+
+		sql = 'SELECT s.name, s.session_id, s.start_time, s.practice, t.eccentricity, t.orientation, t.threshold, t.ci_low, t.ci_high FROM thresholds t JOIN sessions s ON s.id = t.session'
+		if clauses:
+			sql += ' WHERE ' + ' AND '.join(clauses)
+		sql += ' ORDER BY s.start_time, s.name'
+
+		rows = [
+			(name, sessionId or '', startTime or 'NaT', -1 if isPractice is None else int(bool(isPractice)), ecc, ori, threshold, numpy.nan if low is None else low, numpy.nan if high is None else high)
+			for name, sessionId, startTime, isPractice, ecc, ori, threshold, low, high in self.db.execute(sql, params)
+		]
+
+		return numpy.array(rows, dtype=THRESHOLD_DTYPE).view(numpy.recarray)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Indexes threshold files from many sessions and queries them')
+	parser.add_argument('--db', default='results.sqlite', help='Results database')
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	ingestParser = commands.add_parser('ingest', help='Add new or changed data files')
+	ingestParser.add_argument('data_path', nargs='?', default='data')
+
+	queryParser = commands.add_parser('query', help='Print matching thresholds as CSV')
+	queryParser.add_argument('--eccentricity', type=float)
+	queryParser.add_argument('--orientation', type=float)
+	queryParser.add_argument('--session-id')
+	queryParser.add_argument('--practice', choices=['yes', 'no'])
+	queryParser.add_argument('--since', help='ISO 8601 date, e.g. 2026-10-01')
+	queryParser.add_argument('--until', help='ISO 8601 date, e.g. 2026-11-01')
+	queryParser.add_argument('-o', '--output', help='Save the result to this .npy file instead')
+
+	args = parser.parse_args(argv)
+	store = ResultsStore(args.db)
+
+	if args.command == 'ingest':
+		print(f'Ingested {store.ingest(args.data_path)} files')
+	else:
+		practice = None if args.practice is None else (args.practice == 'yes')
+		result = store.query(args.eccentricity, args.orientation, args.session_id, practice, args.since, args.until)
+		if args.output:
+			numpy.save(args.output, result)
+		else:
+			print(','.join(result.dtype.names))
+			for row in result:
+				print(','.join(str(value) for value in row))
+
+	store.close()
+
+if __name__ == '__main__':
+	main()
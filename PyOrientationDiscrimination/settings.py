@@ -1,8 +1,12 @@
+import os
+import json
 import typing
+import hashlib
 from ConfigHelper import ConfigHelper, ConfigGroup, Setting # https://git.vpclab.com/VPCLab/ConfigHelper
 from PySide2.QtWidgets import QApplication
 
 PROGRAM_NAME = 'PyOrientationDiscrimination'
+PRESET_PATH = 'presets'
 
 SETTINGS_GROUP = [
 	ConfigGroup('General settings',
@@ -13,6 +17,12 @@ SETTINGS_GROUP = [
 		Setting('Practice history',     int, 10, helpText='The number of trials the program looks at when looking for a streak'),
 		Setting('Separate blocks by',   str, 'Orientations', allowedValues=['Orientations', 'Eccentricities']),
 		Setting('Data path',            str, 'data'),
+		Setting('Bootstrap resamples',  int, 2000, helpText='Resamples used for threshold confidence intervals (0 to disable)'),
+		Setting('Confidence level',     float, 0.95, helpText='Width of the threshold confidence intervals'),
+		Setting('Columnar export',      bool, True, helpText='Also write trials, thresholds and posteriors as typed .npy tables after each block'),
+		Setting('Aggregator address',   str, '', helpText='host:port of the results aggregator (leave empty to disable)'),
+		Setting('Station name',         str, '', helpText='Identifies this station to the aggregator (defaults to the computer name)'),
+		Setting('Event marker address', str, '', helpText='udp://host:port, tcp://host:port or pipe://path to send flip-aligned event markers to (leave empty to disable)'),
 
 	), ConfigGroup('Gaze tracking',
 		Setting('Wait for fixation',                  bool,  False),
@@ -21,7 +31,10 @@ SETTINGS_GROUP = [
 		Setting('Fixation period',                    float, 0.3,  helpText='In seconds'),
 		Setting('Render at gaze',                     bool,  False),
 		Setting('Retries',                            int,   30),
-		Setting('Retries to trigger calibration',     int,   3),
+		Setting('Retries to trigger calibration',     int,   3,    helpText='With drift correction, only failures without a steady gaze count'),
+		Setting('Drift correction',                   bool,  True, helpText='Correct systematic gaze offsets and recalibrate only when that can\'t explain them'),
+		Setting('Max drift correction',               float, 1.5,  helpText='In degrees, at most Gaze offset max'),
+		Setting('Max fixation dispersion',            float, 0.5,  helpText='In degrees'),
 		Setting('Show gaze',                          bool,  False),
 		Setting('Show circular fixation',             bool,  False),
 
@@ -33,6 +46,7 @@ SETTINGS_GROUP = [
 		Setting('Fixation color',                     str,   'black',   helpText='Web-safe names or hex codes (#4f2cff)'),
 		Setting('Show annuli',                        bool,  False),
 		Setting('Annuli color',                       str,   '#ffffff', helpText='Web-safe names or hex codes (#4f2cff)'),
+		Setting('Shutter command timeout',            float, 5,         helpText='In seconds'),
 
 	), ConfigGroup('Stimuli settings',
 		Setting('Eccentricities',                     typing.List[float], [2, 4, 6],            helpText='In degrees'),
@@ -43,6 +57,7 @@ SETTINGS_GROUP = [
 		Setting('Time between stimuli',               int, 1000,                              helpText='In ms'),
 		Setting('Max stimulus angle',                 float, 10,                                helpText='In deg'),
 		Setting('Stimulus angle precision',           float, 0.5,                             helpText='In deg'),
+		Setting('Adaptive stimulus grid',             bool, False,                            helpText='Refine the staircase posterior around the threshold instead of updating every level, on grids of 2000 or more levels'),
 		Setting('Stimulus contrast',                  float, 0.5),
 		Setting('Stimulus frequency',                 float, 6,                                 helpText='In cycles per degree'),
 		Setting('Stimulus size',                      float, 4,                                 helpText='In degrees of visual angle'),
@@ -55,9 +70,49 @@ SETTINGS_GROUP = [
 		Setting('Rotated left key label',             str, '1'),
 		Setting('Rotated right key label',            str, '2'),
 		Setting('Wait for ready key',                 bool, True),
+		Setting('Response backend',                   str, 'pynput', allowedValues=['pynput', 'psychopy'], helpText='pynput timestamps keys on a capture thread'),
+
+	), ConfigGroup('Debug settings',
+		Setting('Profile phases',                     bool, False, helpText='Writes per-phase timings (.folded, .phases.csv) next to the data file'),
+		Setting('Profile with cProfile',              bool, False, helpText='Writes a cProfile dump (.prof) next to the data file'),
 
 	),
 ]
 
 def getSettings(filename = f'{PROGRAM_NAME}-settings.ini'):
-	return ConfigHelper(SETTINGS_GROUP, filename).getSettings()
\ No newline at end of file
+	return ConfigHelper(SETTINGS_GROUP, filename).getSettings()
+
+def hashFile(filename):
+	if not os.path.exists(filename):
+		return None
+
+	with open(filename, 'rb') as iniFile:
+		return hashlib.sha1(iniFile.read()).hexdigest()
+
+def getPresetSettings(name, presetPath=PRESET_PATH, revalidate=False):
+	'''
+		Loads the named preset ({presetPath}/{name}.ini) without showing the settings dialog
+
+		The first time a preset is used, and whenever its INI file or the settings themselves (this module,
+		which defines SETTINGS_GROUP) change, it's validated through the dialog once and the result is cached
+		in {presetPath}/{name}.validated.json.
+	'''
+	iniFilename = os.path.join(presetPath, f'{name}.ini')
+	cacheFilename = os.path.join(presetPath, f'{name}.validated.json')
+
+	if not revalidate and os.path.exists(cacheFilename):
+		with open(cacheFilename) as cacheFile:
+			cache = json.load(cacheFile)
+
+		# settings added since the preset was validated would be missing from the cache
+		if cache['ini_sha1'] == hashFile(iniFilename) and cache.get('schema_sha1') == hashFile(__file__):
+			return cache['settings']
+
+	os.makedirs(presetPath, exist_ok=True)
+	config = getSettings(iniFilename)
+	config = {group: dict(values) for group, values in config.items()}
+
+	with open(cacheFilename, 'w') as cacheFile:
+		json.dump({'ini_sha1': hashFile(iniFilename), 'schema_sha1': hashFile(__file__), 'settings': config}, cacheFile, indent='\t')
+
+	return config
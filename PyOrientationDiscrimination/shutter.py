@@ -0,0 +1,173 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+# commands that change what the participant sees; these are never dropped, since trials depend on them
+STATE_COMMANDS = ('openShutter', 'closeShutter', 'activateLights')
+
+class ShutterError(RuntimeError):
+	pass
+
+class FakeShutterController():
+	"""
+		Local stand-in for MonitorShutter.ShutterController that answers after a fixed delay,
+		for exercising the command queue without the shutter host
+	"""
+	def __init__(self, latency=0.05):
+		self.latency = latency
+		self.commands = []
+
+	def _command(self, name):
+		time.sleep(self.latency)
+		self.commands.append(name)
+
+	def openShutter(self):
+		self._command('openShutter')
+
+	def closeShutter(self):
+		self._command('closeShutter')
+
+	def activateLights(self):
+		self._command('activateLights')
+
+	def disconnectFromHost(self):
+		self._command('disconnectFromHost')
+
+class AsyncShutterController():
+	"""
+		Sends shutter/light commands to a ShutterController from a worker thread so the caller
+		never waits on the hardware host. Commands run in the order they were submitted.
+	"""
+	def __init__(self, controllerFactory, timeout=5, attempts=2):
+		"""
+			Args:
+				controllerFactory (callable): Creates the underlying controller. Called on the worker thread,
+					so connecting to the host doesn't block either.
+				timeout (float): Seconds a command other than STATE_COMMANDS may wait in the queue before it's
+					dropped, and the default time flush() will wait
+				attempts (int): times a state command is tried before it's reported as failed
+		"""
+		self.controllerFactory = controllerFactory
+		self.controller = None
+		self.timeout = timeout
+		self.attempts = attempts
+		self.latencies = []
+		self.failures = []
+
+		self.commands = queue.Queue()
+		self.thread = threading.Thread(target=self.run, name='ShutterCommands', daemon=True)
+		self.thread.start()
+
+	def submit(self, command, *args):
+		"""
+			Queues a controller method call
+
+			Returns:
+				concurrent.futures.Future: resolves with the method's return value
+		"""
+		future = Future()
+		self.commands.put((command, args, time.perf_counter(), future))
+		return future
+
+	def openShutter(self):
+		return self.submit('openShutter')
+
+	def closeShutter(self):
+		return self.submit('closeShutter')
+
+	def activateLights(self):
+		return self.submit('activateLights')
+
+	def flush(self, timeout=None):
+		"""
+			Waits for every command submitted so far to finish, so the shutter and lights are in the state
+			the caller asked for
+
+			Raises:
+				ShutterError: if the queue didn't drain within the timeout, or a state command failed
+		"""
+		if timeout is None:
+			timeout = self.timeout
+
+		future = self.submit(None)
+		try:
+			future.result(timeout)
+		except Exception:
+			raise ShutterError(f'Shutter commands did not complete within {timeout}s')
+
+		if self.failures:
+			failures, self.failures = self.failures, []
+			raise ShutterError('Shutter commands failed: ' + ', '.join(failures))
+
+	def connect(self):
+		try:
+			self.controller = self.controllerFactory()
+		except Exception as exc:
+			logging.error(f'Failed to connect to shutter host: {exc}')
+
+	def run(self):
+		self.connect()
+
+		while True:
+			command, args, queuedTime, future = self.commands.get()
+			if command is None:
+				future.set_result(None)
+				continue
+			elif command == 'stop':
+				future.set_result(None)
+				break
+
+			startTime = time.perf_counter()
+			waited = startTime - queuedTime
+			if waited > self.timeout:
+				if command not in STATE_COMMANDS:
+					logging.warning(f'Dropping shutter command {command} after waiting {waited:.3f}s')
+					future.set_exception(TimeoutError(command))
+					continue
+
+				logging.warning(f'Shutter command {command} is running late after waiting {waited:.3f}s')
+
+			attempts = self.attempts if command in STATE_COMMANDS else 1
+			for attempt in range(attempts):
+				try:
+					if self.controller is None and attempt > 0:
+						self.connect()
+					if self.controller is None:
+						raise RuntimeError('Not connected to shutter host')
+					future.set_result(getattr(self.controller, command)(*args))
+					break
+				except Exception as exc:
+					logging.error(f'Shutter command {command} failed (attempt {attempt+1}/{attempts}): {exc}')
+					if attempt == attempts - 1:
+						if command in STATE_COMMANDS:
+							self.failures.append(f'{command} ({exc})')
+						future.set_exception(exc)
+
+			latency = time.perf_counter() - startTime
+			self.latencies.append(latency)
+			logging.debug(f'Shutter command {command}: queued {waited*1000:.1f}ms, took {latency*1000:.1f}ms')
+
+	def disconnectFromHost(self, timeout=None):
+		"""
+			Drains the queue, disconnects and stops the worker thread
+		"""
+		self.submit('disconnectFromHost')
+		self.close(timeout)
+
+	def close(self, timeout=None):
+		"""
+			Drains the queue and stops the worker thread without disconnecting, then logs the command latencies
+		"""
+		stopped = self.submit('stop')
+		try:
+			stopped.result(self.timeout if timeout is None else timeout)
+		except Exception:
+			logging.warning('Shutter worker did not stop in time')
+
+		self.logLatencySummary()
+
+	def logLatencySummary(self):
+		if self.latencies:
+			logging.info(f'Shutter commands: n={len(self.latencies)}, mean={1000*sum(self.latencies)/len(self.latencies):.1f}ms, max={1000*max(self.latencies):.1f}ms')
@@ -0,0 +1,99 @@
+'''
+	Compares drift correction with recalibrating every few retries on synthetic gaze traces
+
+	Each scenario runs a headless session with wait for fixation on, drift correction on and off, against
+	a simulated gaze tracker with a systematic error (see headless.SimulatedGazeTracker). Fails if drift
+	correction needs more retries or calibrations than the old rule, or more than a scenario allows.
+
+	Usage:
+		python benchmarks/gaze.py
+		python benchmarks/gaze.py --trials 12 --seed 2
+'''
+import os, sys
+import logging
+import argparse
+import tempfile
+
+PACKAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'PyOrientationDiscrimination')
+sys.path.insert(0, PACKAGE_PATH)
+
+import headless
+
+SCENARIOS = [
+	# gaze: SimulatedGazeTracker options; with drift correction, at most maxRetries/maxCalibrations and at least minCalibrations
+	{'name': 'no drift',             'gaze': {},                                               'maxRetries': 0, 'maxCalibrations': 0, 'minCalibrations': 0},
+	{'name': 'offset 1.2 deg',       'gaze': {'offset': (1.2, 0)},                             'maxRetries': 1, 'maxCalibrations': 0, 'minCalibrations': 0},
+	# drift 0.5 deg/min passes the default max drift correction (1.5 deg) within a session, so each drifting scenario recalibrates
+	{'name': 'drift 0.5 deg/min',    'gaze': {'driftRate': (.5, 0), 'calibrationError': .3},   'maxRetries': 1, 'maxCalibrations': 1, 'minCalibrations': 1},
+	{'name': 'drift 1 deg/min',      'gaze': {'driftRate': (.7, .7), 'calibrationError': .3},  'maxRetries': 2, 'maxCalibrations': 2, 'minCalibrations': 1},
+	# beyond what correction may explain, so it must still recalibrate
+	{'name': 'offset 1.8 deg',       'gaze': {'offset': (1.8, 0)},                             'maxRetries': 1, 'maxCalibrations': 1, 'minCalibrations': 1},
+	{'name': 'offset 4 deg',         'gaze': {'offset': (4, 0)},                               'maxRetries': 3, 'maxCalibrations': 1, 'minCalibrations': 1},
+]
+
+def runScenario(gaze, driftCorrection, trials, seed):
+	'''
+		Returns:
+			dict: trials, retries, calibrations and virtual minutes of one headless session
+	'''
+	with tempfile.TemporaryDirectory() as dataPath:
+		result = headless.runSession(
+			{
+				'Stimuli settings': {'trials_per_stimulus_config': trials},
+				'Gaze tracking': {'wait_for_fixation': True, 'drift_correction': driftCorrection},
+			},
+			seed=seed,
+			dataPath=dataPath,
+			gaze=dict(gaze),
+		)
+		logging.shutdown()
+
+	trialCount = len(result['trialOverhead'])
+	return {
+		'trials': trialCount,
+		'retries': result['fixationAttempts'] - trialCount,
+		'calibrations': result['calibrations'],
+		'minutes': result['virtualDuration'] / 60,
+	}
+
+def checkScenario(scenario, old, new):
+	'''
+		Returns:
+			list: descriptions of every expectation the scenario missed
+	'''
+	failures = []
+	for key in ['retries', 'calibrations']:
+		if new[key] > old[key]:
+			failures.append(f'{new[key]} {key} with drift correction, {old[key]} without')
+	if new['retries'] > scenario['maxRetries']:
+		failures.append(f'{new["retries"]} retries, expected at most {scenario["maxRetries"]}')
+	if not scenario['minCalibrations'] <= new['calibrations'] <= scenario['maxCalibrations']:
+		failures.append(f'{new["calibrations"]} calibrations, expected {scenario["minCalibrations"]} to {scenario["maxCalibrations"]}')
+
+	return failures
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Compares drift correction with periodic recalibration on synthetic gaze traces')
+	parser.add_argument('--trials', type=int, default=6, help='Trials per stimulus config')
+	parser.add_argument('--seed', type=int, default=1)
+	args = parser.parse_args(argv)
+
+	logging.disable(logging.CRITICAL)
+
+	print(f'{"scenario":22}  {"old rule":37}{"drift correction"}')
+	failed = False
+	for scenario in SCENARIOS:
+		old = runScenario(scenario['gaze'], False, args.trials, args.seed)
+		new = runScenario(scenario['gaze'], True, args.trials, args.seed)
+
+		line = f'{scenario["name"]:22}'
+		for result in (old, new):
+			line += f' {result["retries"]:4} retries {result["calibrations"]:2} calibrations {result["minutes"]:4.1f}min'
+		failures = checkScenario(scenario, old, new)
+		print(line + ('  FAILED: ' + '; '.join(failures) if failures else ''))
+		failed = failed or bool(failures)
+
+	return 1 if failed else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
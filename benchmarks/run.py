@@ -0,0 +1,247 @@
+'''
+	Benchmarks for the staircase, block scheduling and per-trial code paths
+
+	Usage:
+		python benchmarks/run.py                          # run everything
+		python benchmarks/run.py -k markResponse          # only cases whose name contains markResponse
+		python benchmarks/run.py --save baseline.json     # store the results as a baseline
+		python benchmarks/run.py --compare baseline.json  # flag cases slower than the baseline
+'''
+import os, sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+PACKAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'PyOrientationDiscrimination')
+sys.path.insert(0, PACKAGE_PATH)
+
+import numpy
+
+import BestPest, headless, export
+
+# (max_stimulus_angle, stimulus_angle_precision)
+GRIDS = [(10, .5), (45, .25), (45, .05)]
+# (number of eccentricities, number of orientations)
+CONDITIONS = [(3, 3), (5, 6)]
+POSITION_ANGLE_COUNTS = [4, 8]
+
+CASES = []
+
+def case(name, **paramGrid):
+	'''
+		Registers a benchmark. The decorated function does any setup and returns the callable to time.
+	'''
+	def register(setup):
+		combinations = [{}]
+		for key, values in paramGrid.items():
+			combinations = [dict(params, **{key: value}) for params in combinations for value in values]
+
+		for params in combinations:
+			label = ','.join(f'{key}={value}' for key, value in params.items())
+			CASES.append((f'{name}[{label}]' if label else name, setup, params))
+
+		return setup
+
+	return register
+
+def getStimulusLevels(grid):
+	maxAngle, precision = grid
+	return numpy.arange(precision, maxAngle + precision, precision)
+
+def getStaircase(grid, trials=40, seed=0):
+	rng = random.Random(seed)
+	stepHandler = BestPest.BestPest(getStimulusLevels(grid))
+	for _ in range(trials):
+		stepHandler.markResponse(rng.random() < .75)
+
+	return stepHandler
+
+def getConfig(grid=(10, .5), conditions=(3, 3), positionAngles=4):
+	# every setting at its default, so settings added later are always present
+	maxAngle, precision = grid
+	eccentricities, orientations = conditions
+	config = headless.getDefaultConfig()
+	config['General settings'].update({'practice': False, 'separate_blocks_by': 'Orientations', 'bootstrap_resamples': 2000, 'confidence_level': .95})
+	config['Stimuli settings'].update({
+		'eccentricities': [2.0 * (i+1) for i in range(eccentricities)],
+		'orientations': [180.0 * i / orientations for i in range(orientations)],
+		'stimulus_position_angles': [360.0 * i / positionAngles + 45 for i in range(positionAngles)],
+		'trials_per_stimulus_config': 24,
+		'max_stimulus_angle': maxAngle,
+		'stimulus_angle_precision': precision,
+	})
+
+	return config
+
+@case('markResponse', grid=GRIDS)
+def benchMarkResponse(grid):
+	stepHandler = BestPest.BestPest(getStimulusLevels(grid))
+	rng = random.Random(0)
+	return lambda: stepHandler.markResponse(rng.random() < .75)
+
+@case('staircase', grid=GRIDS + [(90, .01)], stepHandler=['BestPest', 'AdaptiveBestPest'])
+def benchStaircase(grid, stepHandler):
+	# a whole condition's worth of trials, from a fresh posterior each call
+	levels = getStimulusLevels(grid)
+	stepHandlerClass = getattr(BestPest, stepHandler)
+
+	def run():
+		rng = random.Random(0)
+		staircase = stepHandlerClass(levels)
+		for _ in range(48):
+			staircase.markResponse(rng.random() < .75)
+
+	return run
+
+@case('getNormalizedProbabilities', grid=GRIDS)
+def benchNormalizedProbabilities(grid):
+	return getStaircase(grid).getNormalizedProbabilities
+
+@case('getConfidence', grid=GRIDS)
+def benchConfidence(grid):
+	return getStaircase(grid).getConfidence
+
+@case('markResponseAndQuery', grid=GRIDS)
+def benchMarkResponseAndQuery(grid):
+	# a trial's worth of posterior queries after each update, as a stopping rule or HUD would make
+	stepHandler = BestPest.BestPest(getStimulusLevels(grid))
+	rng = random.Random(0)
+
+	def trial():
+		stepHandler.markResponse(rng.random() < .75)
+		stepHandler.getConfidence()
+		stepHandler.getPosteriorMean()
+		stepHandler.getMedian()
+		stepHandler.getHighestDensityInterval(.95)
+
+	return trial
+
+@case('bootstrapIntervals', grid=GRIDS, conditions=CONDITIONS)
+def benchBootstrap(grid, conditions):
+	stepHandlers = [getStaircase(grid, 24, seed) for seed in range(conditions[0] * conditions[1])]
+	stimIndices = numpy.array([[stimIndex for stimIndex, response in stepHandler.responses] for stepHandler in stepHandlers])
+	responses = numpy.array([[response for stimIndex, response in stepHandler.responses] for stepHandler in stepHandlers])
+	levels = getStimulusLevels(grid)
+
+	return lambda: BestPest.bootstrapIntervals(levels, stimIndices, responses, 2000)
+
+@case('setupBlocks', grid=GRIDS[:1], conditions=CONDITIONS, positionAngles=POSITION_ANGLE_COUNTS)
+def benchSetupBlocks(grid, conditions, positionAngles):
+	testerModule = headless.loadTesterModule()
+	tester = testerModule.OrientationDiscriminationTester.__new__(testerModule.OrientationDiscriminationTester)
+	tester.config = getConfig(grid, conditions, positionAngles)
+
+	return tester.setupBlocks
+
+@case('headlessSession', grid=GRIDS, conditions=CONDITIONS[:1], positionAngles=POSITION_ANGLE_COUNTS[:1])
+def benchHeadlessSession(grid, conditions, positionAngles):
+	# a short session through the full per-trial draw path, with null window/sound/keyboard and a virtual clock
+	stimuliSettings = getConfig(grid, conditions, positionAngles)['Stimuli settings']
+	stimuliSettings['trials_per_stimulus_config'] = 4
+
+	return lambda: headless.runSession({'Stimuli settings': stimuliSettings}, seed=0)
+
+@case('loadColumns', sessions=[100, 1000])
+def benchLoadColumns(sessions):
+	# a trials table per session as the columnar export writes them, read back across every session
+	dataDirectory = tempfile.TemporaryDirectory()
+	rng = numpy.random.default_rng(0)
+	for session in range(sessions):
+		rows = numpy.zeros(216, dtype=export.TRIAL_DTYPE)
+		rows['trial'] = numpy.arange(1, len(rows) + 1)
+		rows['eccentricity'] = rng.choice([2, 4, 6], len(rows))
+		rows['orientation'] = rng.choice([0, 45, 135], len(rows))
+		rows['offset'] = rng.integers(1, 21, len(rows)) * .5
+		rows['correct'] = rng.random(len(rows)) < .75
+		export.appendRows(export.getTableFilename(os.path.join(dataDirectory.name, f'OD_{session:04d}'), 'trials'), rows)
+
+	def run(dataDirectory=dataDirectory):
+		return export.ColumnLoader(dataDirectory.name).load(['eccentricity', 'orientation', 'offset', 'correct'])
+
+	return run
+
+def measure(func, minTime=.2, repeats=5):
+	'''
+		Returns:
+			tuple: (median seconds per call, min seconds per call, peak bytes allocated by one call)
+	'''
+	# calibrate the number of calls per repeat so each repeat takes about minTime / repeats
+	loops = 1
+	while True:
+		start = time.perf_counter()
+		for _ in range(loops):
+			func()
+		elapsed = time.perf_counter() - start
+		if elapsed >= minTime / repeats or loops >= 1 << 20:
+			break
+		loops *= 10 if elapsed < minTime / repeats / 10 else 2
+
+	timings = []
+	for _ in range(repeats):
+		start = time.perf_counter()
+		for _ in range(loops):
+			func()
+		timings.append((time.perf_counter() - start) / loops)
+
+	# measured separately, tracemalloc slows everything down
+	tracemalloc.start()
+	func()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return statistics.median(timings), min(timings), peak
+
+def formatTime(seconds):
+	for unit, scale in [('s', 1), ('ms', 1e-3), ('us', 1e-6)]:
+		if seconds >= scale:
+			return f'{seconds/scale:8.2f} {unit}'
+	return f'{seconds/1e-9:8.2f} ns'
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmarks the staircase, scheduling and per-trial code paths')
+	parser.add_argument('-k', dest='filter', default='', help='Only run cases whose name contains this')
+	parser.add_argument('--save', help='Write the results to this JSON file')
+	parser.add_argument('--compare', help='Compare against a JSON file written by --save')
+	parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown ratio reported as a regression')
+	args = parser.parse_args(argv)
+
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as baselineFile:
+			baseline = json.load(baselineFile)
+
+	results = {}
+	regressions = []
+	for name, setup, params in CASES:
+		if args.filter not in name:
+			continue
+
+		func = setup(**params)
+		median, fastest, peak = measure(func)
+		results[name] = {'median': median, 'min': fastest, 'peak_bytes': peak}
+
+		line = f'{name:60} {formatTime(median)}  (min {formatTime(fastest).strip()})  peak {peak/1024:9.1f} KiB'
+		if name in baseline:
+			ratio = median / baseline[name]['median']
+			line += f'  {ratio:5.2f}x'
+			if ratio > args.threshold:
+				line += '  REGRESSION'
+				regressions.append(name)
+		print(line)
+
+	if args.save:
+		with open(args.save, 'w') as resultsFile:
+			json.dump(results, resultsFile, indent='\t')
+
+	if regressions:
+		print(f'{len(regressions)} case(s) slower than {args.threshold}x the baseline')
+		return 1
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())